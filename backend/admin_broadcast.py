@@ -0,0 +1,79 @@
+# backend/admin_broadcast.py
+"""
+Coalesced, delta-based student updates for the admin dashboard.
+
+Instead of sending the full student record on every change, changed students
+are marked dirty and flushed once per tick as a single `student_updates` event.
+Each entry carries the student ID plus only the fields that changed since the
+last broadcast.
+"""
+import os
+import metrics
+from async_logging import get_logger
+
+log = get_logger("admin")
+
+# --- Configuration ---
+BROADCAST_INTERVAL_SECONDS = float(os.environ.get("LOCKIN_ADMIN_TICK_SECONDS", "0.25"))
+
+
+class StudentUpdateBroadcaster:
+    """
+    `get_view(student_id)` returns the admin-facing dict for a student (or None
+    if the student is gone). It is only called at flush time, so a student
+    that changes several times within one tick is sent once.
+    """
+
+    def __init__(self, socketio, get_view, room="admin_room", interval=BROADCAST_INTERVAL_SECONDS, on_flush=None):
+        self.socketio = socketio
+        self.get_view = get_view
+        self.on_flush = on_flush # Optional callback({student_id: full view}) after each broadcast
+        self.room = room
+        self.interval = interval
+        self._dirty = set()
+        self._last_sent = {} # student_id -> last view broadcast (baseline for diffs)
+        self._started = False
+        self.flushes = 0
+        self.updates_sent = 0
+
+    def start(self):
+        if self._started: return
+        self._started = True
+        self.socketio.start_background_task(self._run)
+
+    def mark_dirty(self, student_id):
+        self.start()
+        self._dirty.add(student_id)
+
+    def set_baseline(self, student_id, view):
+        """ Records a full view that admins already received (new_student / student_list). """
+        self._last_sent[student_id] = dict(view)
+
+    def forget(self, student_id):
+        self._dirty.discard(student_id)
+        self._last_sent.pop(student_id, None)
+
+    def flush(self):
+        if not self._dirty: return
+        dirty, self._dirty = self._dirty, set()
+        updates = []; flushed_views = {}
+        for student_id in dirty:
+            view = self.get_view(student_id)
+            if view is None: continue
+            previous = self._last_sent.get(student_id, {})
+            changes = {key: value for key, value in view.items() if previous.get(key, object()) != value}
+            if not changes: continue
+            self._last_sent[student_id] = view; flushed_views[student_id] = view
+            changes["id"] = student_id
+            updates.append(changes)
+        if not updates: return
+        self.flushes += 1; self.updates_sent += len(updates)
+        log.debug("[Update]: Emitting student_updates for %d students.", len(updates))
+        with metrics.time_stage("socket_emit"): self.socketio.emit("student_updates", updates, room=self.room)
+        if self.on_flush is not None: self.on_flush(flushed_views)
+
+    def _run(self):
+        while True:
+            self.socketio.sleep(self.interval)
+            try: self.flush()
+            except Exception as e: log.error(f"[Update]: Broadcast flush failed: {e}")
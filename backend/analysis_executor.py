@@ -0,0 +1,120 @@
+# backend/analysis_executor.py
+"""
+Runs blocking frame analysis (decode, FaceMesh, YOLOv5) off the eventlet hub.
+
+Socket handlers only enqueue work. A fixed number of green workers pull jobs,
+hand the blocking part to eventlet's native thread pool (tpool) and apply the
+result back on the hub, where emitting to sockets is safe.
+"""
+import os
+import time
+import eventlet
+from eventlet import tpool
+from eventlet.queue import LightQueue
+from async_logging import get_logger
+
+log = get_logger("analysis")
+
+# --- Configuration ---
+# Workers waiting on the phone batcher hold a native thread (for at most
+# LOCKIN_PHONE_BATCH_TIMEOUT), so this also caps how many frames can share one YOLOv5 batch.
+ANALYSIS_WORKERS = int(os.environ.get("LOCKIN_ANALYSIS_WORKERS", "16"))
+ANALYSIS_QUEUE_MAX = int(os.environ.get("LOCKIN_ANALYSIS_QUEUE_MAX", "256"))
+# The executor counts as saturated once a student's frame has waited this long for a worker
+SATURATION_WAIT_SECONDS = float(os.environ.get("LOCKIN_ANALYSIS_SATURATION_WAIT", "0.5"))
+
+
+class AnalysisExecutor:
+    """
+    Bounded, per-student analysis queue.
+
+    - At most one job per student is waiting; a newer frame replaces the older
+      one (the stale frame is never analysed).
+    - At most one job per student is running, so per-student state machines in
+      video_analysis / phone_detection never see concurrent frames.
+    - When `max_queue` students are already waiting, new work is dropped.
+
+    `analyze_fn(job)` runs in a native thread and must not touch sockets.
+    `apply_fn(job, result)` runs on the hub after analysis finishes.
+    """
+
+    def __init__(self, analyze_fn, apply_fn, workers=ANALYSIS_WORKERS, max_queue=ANALYSIS_QUEUE_MAX):
+        self.analyze_fn = analyze_fn
+        self.apply_fn = apply_fn
+        self.workers = max(1, workers)
+        self.max_queue = max(1, max_queue)
+        self._ready = LightQueue()  # student_ids whose pending job can be started
+        self._pending = {}          # student_id -> latest job not yet started
+        self._ready_since = {}      # student_id -> when its job started waiting for a free worker
+        self._running = set()       # student_ids with a job in a native thread
+        self._started = False
+        self.submitted = 0
+        self.completed = 0
+        self.dropped = 0
+        self.superseded = 0
+        self.failed = 0
+
+    def start(self):
+        """ Spawns the green workers. Safe to call more than once. """
+        if self._started: return
+        self._started = True
+        tpool.set_num_threads(self.workers) # Must happen before tpool is first used
+        for _ in range(self.workers): eventlet.spawn(self._worker)
+        log.info(f"[Analysis]: Executor started ({self.workers} workers, queue max {self.max_queue}).")
+
+    def submit(self, student_id, job):
+        """ Enqueues a job for a student. Returns False if the job was dropped. """
+        self.start()
+        if student_id in self._pending:
+            self._pending[student_id] = job; self.superseded += 1; self.submitted += 1
+            return True
+        if len(self._pending) >= self.max_queue:
+            self.dropped += 1
+            return False
+        self._pending[student_id] = job; self.submitted += 1
+        if student_id not in self._running: self._mark_ready(student_id)
+        return True
+
+    def discard(self, student_id):
+        """ Forgets any waiting job for a student (e.g. on disconnect). """
+        self._pending.pop(student_id, None); self._ready_since.pop(student_id, None)
+
+    def oldest_wait_seconds(self):
+        """ How long the longest-waiting job has been ready without a free worker to run it. """
+        if not self._ready_since: return 0.0
+        return time.monotonic() - min(self._ready_since.values())
+
+    def stats(self):
+        return {
+            "queue_depth": len(self._pending), "running": len(self._running),
+            "workers": self.workers, "max_queue": self.max_queue,
+            "submitted": self.submitted, "completed": self.completed,
+            "dropped": self.dropped, "superseded": self.superseded, "failed": self.failed,
+        }
+
+    def is_saturated(self, fraction=0.8, max_wait=SATURATION_WAIT_SECONDS):
+        """ True when the workers are falling behind: a ready job has waited too long, or the queue is nearly full. """
+        return self.oldest_wait_seconds() >= max_wait or len(self._pending) >= self.max_queue * fraction
+
+    def _mark_ready(self, student_id):
+        self._ready_since[student_id] = time.monotonic()
+        self._ready.put(student_id)
+
+    def _worker(self):
+        while True:
+            student_id = self._ready.get()
+            job = self._pending.pop(student_id, None)
+            self._ready_since.pop(student_id, None)
+            if job is None: continue # Discarded while waiting
+            self._running.add(student_id)
+            try:
+                result = tpool.execute(self.analyze_fn, job)
+                self.apply_fn(job, result)
+                self.completed += 1
+            except Exception as e:
+                self.failed += 1
+                log.error(f"[Analysis]: Job for {student_id} failed: {e}")
+            finally:
+                self._running.discard(student_id)
+                # A newer frame arrived while this one was running
+                if student_id in self._pending: self._mark_ready(student_id)
@@ -0,0 +1,226 @@
+# backend/artifact_writer.py
+"""
+Background writer for files the server keeps on disk: wallpapers in
+reference_images/ and suspicious audio clips in suspicious_audio/.
+
+Callers hand over finished bytes and return at once. One native writer thread
+drains a bounded queue in batches. It writes every file in the batch to a
+temporary name, fsyncs them together, renames them into place and fsyncs each
+directory once. A slow or stalled disk (e.g. shared storage) therefore only
+delays the writer, never frame or audio handling. When the queue is full the
+artifact is dropped and counted; nothing waits.
+
+Until a file lands, `pending(path)` returns its bytes, so it can already be served.
+Callers that need the file itself (e.g. to stat or re-read it) pass `on_done`,
+which the writer thread calls with True once the file is in place, or False
+if the write failed.
+
+Retention runs on the writer thread every RETENTION_INTERVAL_SECONDS. Each
+directory has its own limits on file count, total size and age, and the
+oldest files go first. Paths reported by a directory's `pinned` callback (a
+connected student's wallpaper) are never removed.
+"""
+import os
+import time
+from native_threading import threading, queue # Writer blocks on disk I/O in a real OS thread
+import metrics
+from async_logging import get_logger
+
+log = get_logger("artifacts")
+
+# --- Configuration ---
+QUEUE_MAX = int(os.environ.get("LOCKIN_ARTIFACT_QUEUE_MAX", "256"))
+WRITE_BATCH_MAX = 32
+FSYNC_ENABLED = os.environ.get("LOCKIN_ARTIFACT_FSYNC", "1") != "0"
+RETENTION_INTERVAL_SECONDS = float(os.environ.get("LOCKIN_ARTIFACT_RETENTION_INTERVAL", "60"))
+
+# Submit-to-durable latency; spans a local SSD (~ms) up to a stalled network mount
+WRITE_SECONDS = metrics.registry.histogram("lockin_artifact_write_seconds", "Time from submitting an artifact until it is on disk.", ["category"],
+                                           buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0, 120.0))
+
+
+class RetentionPolicy:
+    """ Limits for one directory; 0 disables a limit. """
+
+    def __init__(self, directory, max_files=0, max_bytes=0, max_age_seconds=0, pinned=None):
+        self.directory = directory
+        self.max_files = max_files
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self.pinned = pinned # Callable returning paths that must be kept
+
+    def expired(self, now):
+        """ Files to delete, oldest first. """
+        entries = []
+        with os.scandir(self.directory) as scan:
+            for entry in scan:
+                if entry.is_file() and not entry.name.endswith(".part"):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+        entries.sort()
+        pinned = {os.path.abspath(path) for path in (self.pinned() if self.pinned else ()) if path}
+        candidates = [entry for entry in entries if os.path.abspath(entry[2]) not in pinned]
+        total_files, total_bytes = len(entries), sum(size for _, size, _ in entries)
+        doomed = []
+        for mtime, size, path in candidates:
+            too_old = self.max_age_seconds and now - mtime > self.max_age_seconds
+            too_many = self.max_files and total_files > self.max_files
+            too_big = self.max_bytes and total_bytes > self.max_bytes
+            if not (too_old or too_many or too_big): break # Oldest first: everything after is newer
+            doomed.append(path); total_files -= 1; total_bytes -= size
+        return doomed
+
+
+class _Artifact:
+    __slots__ = ("path", "data", "category", "on_done", "submitted_at")
+
+    def __init__(self, path, data, category, on_done=None):
+        self.path = path
+        self.data = data
+        self.category = category
+        self.on_done = on_done
+        self.submitted_at = time.perf_counter()
+
+
+class ArtifactWriter:
+    def __init__(self, max_queue=QUEUE_MAX, fsync=FSYNC_ENABLED):
+        self.fsync = fsync
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._pending = {} # path -> bytes, until the file is in place
+        self._lock = threading.Lock()
+        self._policies = []
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._last_retention = 0.0
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.deleted = 0
+
+    def add_retention(self, policy):
+        self._policies.append(policy)
+
+    def _ensure_started(self):
+        if self._thread is not None: return
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="artifact-writer", daemon=True)
+                self._thread.start()
+
+    def submit(self, path, data, category, on_done=None):
+        """
+        Queues `data` to be written to `path`. Never blocks; returns False if the artifact was dropped.
+        `on_done(ok)` runs on the writer thread once a queued artifact is written or has failed; keep it short.
+        """
+        self._ensure_started()
+        artifact = _Artifact(path, data, category, on_done)
+        with self._lock: self._pending[path] = data
+        try:
+            self._queue.put_nowait(artifact)
+        except queue.Full:
+            with self._lock:
+                if self._pending.get(path) is data: del self._pending[path]
+            self.dropped += 1
+            metrics.count_event("artifact_write", "dropped")
+            log.warning(f"[Artifacts]: Write queue full, dropped {category} artifact {os.path.basename(path)}")
+            return False
+        return True
+
+    def pending(self, path):
+        """ Bytes of an artifact that is queued but not yet on disk, else None. """
+        with self._lock: return self._pending.get(path)
+
+    def stats(self):
+        return {"queue_depth": self._queue.qsize(), "written": self.written, "dropped": self.dropped, "failed": self.failed, "deleted": self.deleted}
+
+    # --- Writer Thread ---
+    def _run(self):
+        while True:
+            try: batch = [self._queue.get(timeout=RETENTION_INTERVAL_SECONDS)]
+            except queue.Empty: batch = []
+            while batch and len(batch) < WRITE_BATCH_MAX:
+                try: batch.append(self._queue.get_nowait())
+                except queue.Empty: break
+            if batch: self._write_batch(batch)
+            if time.monotonic() - self._last_retention >= RETENTION_INTERVAL_SECONDS: self._apply_retention()
+
+    def _write_batch(self, batch):
+        opened = []
+        for artifact in batch:
+            temp_path = f"{artifact.path}.{os.getpid()}.part" # serve_audio never sees a half-written file
+            handle = None
+            try:
+                handle = open(temp_path, "wb")
+                handle.write(artifact.data)
+                opened.append((artifact, temp_path, handle))
+            except Exception as e:
+                self._discard(temp_path, handle)
+                self._fail(artifact, e)
+        directories = set()
+        for artifact, temp_path, handle in opened:
+            try:
+                handle.flush()
+                if self.fsync: os.fsync(handle.fileno()) # One pass over the batch, after all the writes
+                handle.close()
+                os.replace(temp_path, artifact.path)
+                directories.add(os.path.dirname(artifact.path))
+            except Exception as e:
+                self._discard(temp_path, handle)
+                self._fail(artifact, e)
+                continue
+            self._done(artifact)
+        if self.fsync:
+            for directory in directories: self._fsync_directory(directory) # Makes the renames durable
+
+    @staticmethod
+    def _discard(temp_path, handle):
+        try:
+            if handle is not None: handle.close()
+            os.remove(temp_path)
+        except OSError: pass
+
+    def _done(self, artifact):
+        with self._lock:
+            if self._pending.get(artifact.path) is artifact.data: del self._pending[artifact.path]
+        self.written += 1
+        WRITE_SECONDS.observe(time.perf_counter() - artifact.submitted_at, category=artifact.category)
+        metrics.count_event("artifact_write", "ok")
+        self._notify(artifact, True)
+
+    def _fail(self, artifact, error):
+        with self._lock:
+            if self._pending.get(artifact.path) is artifact.data: del self._pending[artifact.path]
+        self.failed += 1
+        metrics.count_event("artifact_write", "error")
+        log.error(f"[Artifacts]: Could not write {artifact.path}: {error}")
+        self._notify(artifact, False)
+
+    @staticmethod
+    def _notify(artifact, ok):
+        if artifact.on_done is None: return
+        try: artifact.on_done(ok)
+        except Exception as e: log.error(f"[Artifacts]: Completion callback for {artifact.path} failed: {e}")
+
+    @staticmethod
+    def _fsync_directory(directory):
+        try:
+            fd = os.open(directory, os.O_RDONLY)
+            try: os.fsync(fd)
+            finally: os.close(fd)
+        except OSError: pass # Not supported everywhere (e.g. Windows)
+
+    def _apply_retention(self):
+        self._last_retention = time.monotonic()
+        now = time.time()
+        for policy in self._policies:
+            try: doomed = policy.expired(now)
+            except Exception as e:
+                log.warning(f"[Artifacts]: Retention scan of {policy.directory} failed: {e}"); continue
+            for path in doomed:
+                try: os.remove(path); self.deleted += 1
+                except FileNotFoundError: pass
+                except Exception as e: log.warning(f"[Artifacts]: Could not remove {path}: {e}")
+            if doomed: log.info(f"[Artifacts]: Retention removed {len(doomed)} file(s) from {policy.directory}")
+
+
+artifact_writer = ArtifactWriter()
@@ -0,0 +1,202 @@
+# backend/asr_backends.py
+"""
+Pluggable speech-recognition backends for voice_analysis.
+
+Each backend takes float32 PCM (mono, [-1, 1]) and returns the lowercased
+transcript, or "" when nothing was understood. No WAV files are involved.
+
+- "google": SpeechRecognition's Google Web Speech API. Needs network egress.
+- "pocketsphinx": offline CMU Sphinx decoder (the `offline` extra). The
+  acoustic/language models are loaded once per worker, not per chunk.
+
+Decoders are not thread-safe, so transcription runs on a small pool of
+long-lived worker threads, each owning its own backend instance. The pool's
+queue is bounded and callers wait at most ASR_TIMEOUT_SECONDS: when the
+workers fall behind, chunks are dropped (counted as asr/dropped or
+asr/timeout) and treated as having no transcript.
+"""
+import os
+import numpy as np
+from native_threading import threading, queue # Called from audio worker threads
+import metrics
+from async_logging import get_logger
+
+log = get_logger("asr")
+
+# --- Configuration ---
+# "auto" (pocketsphinx when installed, else google), "google" or "pocketsphinx"
+ASR_BACKEND = os.environ.get("LOCKIN_ASR_BACKEND", "auto").lower()
+ASR_WORKERS = int(os.environ.get("LOCKIN_ASR_WORKERS", "2"))
+ASR_LANGUAGE = os.environ.get("LOCKIN_ASR_LANGUAGE", "en-US")
+ASR_QUEUE_MAX = int(os.environ.get("LOCKIN_ASR_QUEUE_MAX", "16"))
+# Longest wait for a transcript; also the Google backend's request timeout
+ASR_TIMEOUT_SECONDS = float(os.environ.get("LOCKIN_ASR_TIMEOUT", "15"))
+
+
+class TranscriptionError(Exception):
+    """ Raised when a backend could not run at all (service unreachable, model missing). """
+
+
+def pcm_to_int16_bytes(audio_data):
+    """ float32 [-1, 1] samples -> little-endian 16-bit PCM bytes. """
+    return (np.clip(audio_data, -1.0, 1.0) * 32767).astype('<i2').tobytes()
+
+
+class GoogleASRBackend:
+    """ Google Web Speech API via SpeechRecognition, fed raw PCM through sr.AudioData. """
+    name = "google"
+
+    def __init__(self, language=ASR_LANGUAGE):
+        import speech_recognition as sr
+        self._sr = sr
+        self.language = language
+        self.recognizer = sr.Recognizer()
+        self.recognizer.operation_timeout = ASR_TIMEOUT_SECONDS # Otherwise a stalled request blocks the worker indefinitely
+
+    def transcribe(self, audio_data, samplerate):
+        audio = self._sr.AudioData(pcm_to_int16_bytes(audio_data), samplerate, 2)
+        try:
+            return self.recognizer.recognize_google(audio, language=self.language).lower()
+        except self._sr.UnknownValueError:
+            return ""
+        except self._sr.RequestError as e:
+            raise TranscriptionError(f"Google Speech Recognition request failed; {e}") from e
+
+
+class PocketSphinxBackend:
+    """ Offline CMU Sphinx decoder. The decoder (and its models) is created once and reused. """
+    name = "pocketsphinx"
+
+    def __init__(self):
+        self.decoder = None
+        self.samplerate = None
+
+    def _load(self, samplerate):
+        try:
+            from pocketsphinx import Decoder
+        except ImportError as e:
+            raise TranscriptionError("pocketsphinx is not installed (pip install pocketsphinx)") from e
+        try:
+            self.decoder = Decoder(samprate=samplerate) # pocketsphinx >= 5 ships the en-us model
+        except TypeError:
+            # Older (0.1.x) SWIG API: build the config from the bundled model path
+            from pocketsphinx import get_model_path
+            model_path = get_model_path()
+            config = Decoder.default_config()
+            config.set_string('-hmm', os.path.join(model_path, 'en-us'))
+            config.set_string('-lm', os.path.join(model_path, 'en-us.lm.bin'))
+            config.set_string('-dict', os.path.join(model_path, 'cmudict-en-us.dict'))
+            config.set_float('-samprate', float(samplerate))
+            config.set_string('-logfn', os.devnull)
+            self.decoder = Decoder(config)
+        self.samplerate = samplerate
+        log.info(f"Pocketsphinx decoder loaded ({samplerate} Hz).")
+
+    def transcribe(self, audio_data, samplerate):
+        if self.decoder is None or self.samplerate != samplerate: self._load(samplerate)
+        self.decoder.start_utt()
+        self.decoder.process_raw(pcm_to_int16_bytes(audio_data), False, True) # full_utt: whole segment at once
+        self.decoder.end_utt()
+        hypothesis = self.decoder.hyp()
+        return hypothesis.hypstr.lower() if hypothesis is not None else ""
+
+
+def resolve_backend_name(requested=ASR_BACKEND):
+    if requested != "auto": return requested
+    try:
+        import pocketsphinx # noqa: F401
+        return "pocketsphinx"
+    except ImportError:
+        return "google"
+
+def create_backend(name):
+    if name == "google": return GoogleASRBackend()
+    if name == "pocketsphinx": return PocketSphinxBackend()
+    raise ValueError(f"Unknown ASR backend '{name}' (expected google, pocketsphinx or auto)")
+
+
+class _PendingTranscription:
+    """ A chunk waiting for a worker, plus the slot its transcript is delivered to. """
+    __slots__ = ("audio_data", "samplerate", "done", "text", "error", "abandoned")
+
+    def __init__(self, audio_data, samplerate):
+        self.audio_data = audio_data
+        self.samplerate = samplerate
+        self.done = threading.Event()
+        self.text = ""
+        self.error = None
+        self.abandoned = False # Caller timed out; skipped if no worker has picked it up yet
+
+
+class ASRWorkerPool:
+    """
+    Long-lived transcription workers. Each worker creates its own backend on
+    start-up (loading models once) and then serves chunks from a shared queue.
+    """
+
+    def __init__(self, backend_name=None, workers=ASR_WORKERS, max_queue=ASR_QUEUE_MAX, timeout_seconds=ASR_TIMEOUT_SECONDS):
+        self.backend_name = backend_name or resolve_backend_name()
+        self.workers = max(1, workers)
+        self.timeout_seconds = timeout_seconds
+        self._queue = queue.Queue(maxsize=max(1, max_queue))
+        self._threads = []
+        self._start_lock = threading.Lock()
+        self.chunks_transcribed = 0
+        self.dropped = 0
+        self.timeouts = 0
+
+    def _ensure_started(self):
+        if self._threads: return
+        with self._start_lock:
+            if self._threads: return
+            log.info(f"Starting {self.workers} '{self.backend_name}' ASR worker(s).")
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._run, name=f"asr-worker-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def transcribe(self, audio_data, samplerate):
+        """
+        Queues one chunk and waits for a worker to transcribe it. Returns the lowercased
+        text, or "" when the pool is overloaded (queue full or no answer in time).
+        """
+        self._ensure_started()
+        pending = _PendingTranscription(audio_data, samplerate)
+        try: self._queue.put_nowait(pending)
+        except queue.Full:
+            self.dropped += 1; metrics.count_event("asr", "dropped")
+            log.warning(f"[ASR]: Queue full ({self._queue.maxsize} chunks), chunk not transcribed.")
+            return ""
+        if not pending.done.wait(self.timeout_seconds):
+            pending.abandoned = True; self.timeouts += 1; metrics.count_event("asr", "timeout")
+            log.warning(f"[ASR]: No transcript within {self.timeout_seconds:.0f}s, chunk skipped.")
+            return ""
+        if pending.error is not None: raise pending.error
+        return pending.text
+
+    def _run(self):
+        backend, load_error = None, None
+        try: backend = create_backend(self.backend_name)
+        except Exception as e:
+            load_error = e if isinstance(e, TranscriptionError) else TranscriptionError(f"Could not start ASR backend: {e}")
+            log.error(f"[ASR]: {load_error}")
+        while True:
+            pending = self._queue.get()
+            if pending.abandoned: continue
+            try:
+                if load_error is not None: raise load_error
+                with metrics.time_stage("asr"): pending.text = backend.transcribe(pending.audio_data, pending.samplerate)
+                self.chunks_transcribed += 1
+            except TranscriptionError as e:
+                pending.error = e
+            except Exception as e:
+                pending.error = TranscriptionError(f"Unexpected error during speech recognition: {e}")
+            finally:
+                pending.done.set()
+
+
+asr_pool = ASRWorkerPool()
+
+def transcribe(audio_data, samplerate):
+    """ Transcribes mono float32 PCM with the configured backend. Raises TranscriptionError on failure. """
+    return asr_pool.transcribe(audio_data, samplerate)
@@ -0,0 +1,194 @@
+# backend/async_logging.py
+"""
+Leveled, sampled, non-blocking logging for the backend.
+
+Callers on the hot path (eventlet hub and analysis worker threads) only format
+the record and push it onto a bounded in-memory queue. A single native writer
+thread drains the queue and writes records to stderr in batches, with one flush
+per batch, so no caller ever blocks on terminal or pipe I/O.
+
+Below WARNING, records are rate-sampled per event type (the logging call
+site). When a `student_id` is passed, sampling is also per student: at most
+LOCKIN_LOG_SAMPLE_MAX records per key per LOCKIN_LOG_SAMPLE_WINDOW seconds.
+The next record that gets through reports how many were suppressed.
+Warnings and errors are never sampled, so connection, join/leave, kick and
+artifact audit lines log at WARNING.
+
+    log = get_logger("video")
+    log.debug("[Video]: %s timer reset.", student_id, student_id=student_id)
+"""
+import os
+import sys
+import json
+import time
+import atexit
+import logging
+from native_threading import threading, queue # Writer must be a real OS thread (blocking I/O)
+
+# --- Configuration ---
+LOG_LEVEL = os.environ.get("LOCKIN_LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.environ.get("LOCKIN_LOG_FORMAT", "text").lower() # "text" or "json"
+SAMPLE_MAX = int(os.environ.get("LOCKIN_LOG_SAMPLE_MAX", "5")) # Per key and window; 0 disables sampling
+SAMPLE_WINDOW_SECONDS = float(os.environ.get("LOCKIN_LOG_SAMPLE_WINDOW", "10"))
+QUEUE_MAX = int(os.environ.get("LOCKIN_LOG_QUEUE_MAX", "10000")) # Records beyond this are dropped, never waited for
+WRITE_BATCH_MAX = 256
+ROOT_LOGGER_NAME = "lockin"
+
+
+class RateSampler(logging.Filter):
+    """ Lets through at most `max_records` per (logger, call site, student) and window, below WARNING. """
+
+    def __init__(self, max_records=SAMPLE_MAX, window_seconds=SAMPLE_WINDOW_SECONDS):
+        super().__init__()
+        self.max_records = max_records
+        self.window_seconds = window_seconds
+        self._windows = {} # key -> [window_start, passed, suppressed]
+        self._lock = threading.Lock()
+        self.suppressed_total = 0
+
+    def filter(self, record):
+        if self.max_records <= 0 or record.levelno >= logging.WARNING: return True
+        key = (record.name, record.lineno, getattr(record, "student_id", None))
+        now = time.monotonic()
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None or now - window[0] >= self.window_seconds:
+                if window is not None and window[2]: record.suppressed = window[2]
+                if window is None and len(self._windows) > 50000: self._prune(now)
+                self._windows[key] = [now, 1, 0]
+                return True
+            if window[1] < self.max_records:
+                window[1] += 1
+                return True
+            window[2] += 1; self.suppressed_total += 1
+            return False
+
+    def _prune(self, now):
+        for key in [k for k, w in self._windows.items() if now - w[0] >= self.window_seconds]: del self._windows[key]
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)-7s %(name)s: %(message)s")
+
+    def format(self, record):
+        line = super().format(record)
+        suppressed = getattr(record, "suppressed", 0)
+        return f"{line} (+{suppressed} similar suppressed)" if suppressed else line
+
+
+class JsonFormatter(logging.Formatter):
+    """ One JSON object per line, for log shippers. """
+
+    def format(self, record):
+        entry = {"ts": round(record.created, 3), "level": record.levelname, "logger": record.name, "msg": record.getMessage()}
+        student_id = getattr(record, "student_id", None)
+        if student_id is not None: entry["student_id"] = student_id
+        if getattr(record, "suppressed", 0): entry["suppressed"] = record.suppressed
+        if record.exc_info: entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class AsyncQueueHandler(logging.Handler):
+    """
+    Formats the message in the caller and hands it to a native writer thread.
+    Never blocks: when the queue is full the record is dropped and counted.
+    """
+
+    def __init__(self, stream=None, max_queue=QUEUE_MAX):
+        super().__init__()
+        self.stream = stream or sys.stderr
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+        self.dropped = 0
+        self._thread.start()
+
+    def createLock(self):
+        self.lock = threading.RLock() # Native lock: emit is called from hub and OS threads alike
+
+    def emit(self, record):
+        try:
+            # Resolve args/exceptions now; the objects they reference may change before the writer runs
+            record.msg = record.getMessage(); record.args = None
+            if record.exc_info:
+                record.exc_text = logging.Formatter().formatException(record.exc_info); record.exc_info = None
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+        except Exception:
+            self.handleError(record)
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < WRITE_BATCH_MAX:
+                try: batch.append(self._queue.get_nowait())
+                except queue.Empty: break
+            stop = any(record is None for record in batch)
+            lines = []
+            for record in batch:
+                if record is None: continue
+                try: lines.append(self.format(record))
+                except Exception: lines.append(f"<unformattable log record from {record.name}>")
+            try:
+                if lines: self.stream.write("\n".join(lines) + "\n"); self.stream.flush()
+            except Exception: pass
+            if stop: return
+
+    def close(self):
+        """ Drains what is queued (briefly) and stops the writer. """
+        try: self._queue.put(None, timeout=0.5)
+        except queue.Full: pass
+        self._thread.join(timeout=2.0)
+        super().close()
+
+
+class StudentLogger:
+    """ Thin wrapper over a stdlib logger that accepts `student_id=` for per-student sampling and JSON output. """
+
+    def __init__(self, logger):
+        self._logger = logger
+
+    def _log(self, level, msg, args, student_id, kwargs):
+        if not self._logger.isEnabledFor(level): return
+        if student_id is not None: kwargs["extra"] = dict(kwargs.get("extra") or {}, student_id=student_id)
+        kwargs.setdefault("stacklevel", 3) # Report the caller's line (the sampling key), not this wrapper
+        self._logger.log(level, msg, *args, **kwargs)
+
+    def isEnabledFor(self, level): return self._logger.isEnabledFor(level)
+    def debug(self, msg, *args, student_id=None, **kwargs): self._log(logging.DEBUG, msg, args, student_id, kwargs)
+    def info(self, msg, *args, student_id=None, **kwargs): self._log(logging.INFO, msg, args, student_id, kwargs)
+    def warning(self, msg, *args, student_id=None, **kwargs): self._log(logging.WARNING, msg, args, student_id, kwargs)
+    def error(self, msg, *args, student_id=None, **kwargs): self._log(logging.ERROR, msg, args, student_id, kwargs)
+    def critical(self, msg, *args, student_id=None, **kwargs): self._log(logging.CRITICAL, msg, args, student_id, kwargs)
+    def exception(self, msg, *args, student_id=None, **kwargs):
+        kwargs.setdefault("exc_info", True); self._log(logging.ERROR, msg, args, student_id, kwargs)
+
+
+_handler = None
+_setup_lock = threading.Lock()
+
+def setup_logging():
+    """ Installs the async handler on the 'lockin' logger (idempotent). """
+    global _handler
+    with _setup_lock:
+        if _handler is not None: return _handler
+        root = logging.getLogger(ROOT_LOGGER_NAME)
+        root.setLevel(getattr(logging, LOG_LEVEL, logging.INFO))
+        root.propagate = False
+        _handler = AsyncQueueHandler()
+        _handler.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else TextFormatter())
+        _handler.addFilter(RateSampler())
+        root.addHandler(_handler)
+        atexit.register(_handler.close)
+        return _handler
+
+def get_logger(name):
+    """ Returns the backend logger for a module, e.g. get_logger("video") -> 'lockin.video'. """
+    setup_logging()
+    return StudentLogger(logging.getLogger(f"{ROOT_LOGGER_NAME}.{name}"))
+
+def get_stats():
+    handler = setup_logging()
+    sampler = next((f for f in handler.filters if isinstance(f, RateSampler)), None)
+    return {"queued": handler._queue.qsize(), "dropped": handler.dropped, "suppressed": sampler.suppressed_total if sampler else 0}
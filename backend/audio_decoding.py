@@ -0,0 +1,67 @@
+# backend/audio_decoding.py
+"""
+In-memory decoding of browser audio chunks (webm/opus) to 16 kHz mono PCM.
+
+PyAV (optional `av` package) decodes in-process. Without it, the chunk is
+piped through ffmpeg over stdin/stdout. Either way nothing touches the disk.
+Each MediaRecorder chunk is a self-contained webm container, so a single
+long-lived ffmpeg process cannot be reused across chunks; the pipe fallback
+still avoids temp files.
+"""
+import io
+import numpy as np
+from native_threading import subprocess # Called from analysis worker threads
+from async_logging import get_logger
+
+log = get_logger("audio")
+
+try:
+    import av # PyAV: in-process FFmpeg bindings
+except ImportError:
+    av = None
+
+# --- Constants ---
+TARGET_SAMPLE_RATE = 16000 # What the speech recognizer expects
+FFMPEG_TIMEOUT_SECONDS = 10
+
+
+class AudioDecodeError(Exception):
+    """ Raised when a chunk cannot be decoded; the message is safe to show admins. """
+
+
+def decode_audio_chunk(encoded_bytes):
+    """
+    Decodes an encoded audio chunk (webm/opus, ogg, wav...) to a float32 NumPy
+    array in [-1, 1], mono, at TARGET_SAMPLE_RATE.
+    """
+    if not encoded_bytes: return np.zeros(0, dtype=np.float32)
+    pcm16 = _decode_with_pyav(encoded_bytes) if av is not None else _decode_with_ffmpeg_pipe(encoded_bytes)
+    return pcm16.astype(np.float32) / 32768.0
+
+def _decode_with_pyav(encoded_bytes):
+    try:
+        with av.open(io.BytesIO(encoded_bytes), mode="r") as container:
+            resampler = av.AudioResampler(format="s16", layout="mono", rate=TARGET_SAMPLE_RATE)
+            chunks = []
+            for frame in container.decode(audio=0):
+                for resampled in resampler.resample(frame): chunks.append(resampled.to_ndarray().reshape(-1))
+            for resampled in resampler.resample(None): chunks.append(resampled.to_ndarray().reshape(-1)) # Flush
+    except Exception as e:
+        raise AudioDecodeError(f"Audio decode error: {e}") from e
+    if not chunks: return np.zeros(0, dtype=np.int16)
+    return np.concatenate(chunks)
+
+def _decode_with_ffmpeg_pipe(encoded_bytes):
+    command = ['ffmpeg', '-hide_banner', '-loglevel', 'error', '-i', 'pipe:0',
+               '-f', 's16le', '-ac', '1', '-ar', str(TARGET_SAMPLE_RATE), 'pipe:1'] # Force mono, 16kHz raw PCM
+    try:
+        result = subprocess.run(command, input=bytes(encoded_bytes), capture_output=True, timeout=FFMPEG_TIMEOUT_SECONDS, check=True)
+    except subprocess.TimeoutExpired as e:
+        raise AudioDecodeError("Audio processing timeout") from e
+    except FileNotFoundError as e:
+        log.critical("[Audio]: 'ffmpeg' command not found. Install ffmpeg (or PyAV) and add to PATH.")
+        raise AudioDecodeError("Backend Error: ffmpeg not found") from e
+    except subprocess.CalledProcessError as e:
+        stderr = e.stderr.decode('utf-8', errors='replace') if e.stderr else ""
+        raise AudioDecodeError(f"Audio conversion error: {stderr[:100]}...") from e
+    return np.frombuffer(result.stdout, dtype='<i2')
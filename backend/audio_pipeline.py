@@ -0,0 +1,99 @@
+# backend/audio_pipeline.py
+"""
+Runs audio chunks (decode, VAD, ASR, risk scoring) on a dedicated pool of
+native threads instead of eventlet's shared tpool.
+
+Transcription can be slow: a network ASR service, or more audio than the ASR
+workers keep up with. Through tpool it would hold the threads that frame
+analysis, snapshot writes and state-store calls share. Here a backlog only
+fills this pool's own bounded queue; when that is full, new chunks are dropped
+and counted (audio_chunk/dropped).
+
+`process_fn(student_id, payload)` runs on a worker thread and must not touch
+sockets. Results go back to the hub, where a green drainer calls
+`apply_fn(student_id, payload, result)`. Other native threads can hand short
+callbacks to the same drainer with `post(fn, *args)`.
+"""
+import os
+from native_threading import threading, queue # Workers are real OS threads
+import metrics
+from async_logging import get_logger
+
+log = get_logger("audio")
+
+# --- Configuration ---
+AUDIO_WORKERS = int(os.environ.get("LOCKIN_AUDIO_WORKERS", "4"))
+AUDIO_QUEUE_MAX = int(os.environ.get("LOCKIN_AUDIO_QUEUE_MAX", "64"))
+RESULT_POLL_SECONDS = 0.02 # A native thread cannot wake a green one, so the hub polls for finished chunks
+
+
+class AudioPipeline:
+    def __init__(self, socketio, process_fn, apply_fn, workers=AUDIO_WORKERS, max_queue=AUDIO_QUEUE_MAX):
+        self.socketio = socketio
+        self.process_fn = process_fn
+        self.apply_fn = apply_fn
+        self.workers = max(1, workers)
+        self._jobs = queue.Queue(maxsize=max(1, max_queue))
+        self._results = queue.Queue()
+        self._started = False
+        self._start_lock = threading.Lock()
+        self.submitted = 0
+        self.completed = 0
+        self.dropped = 0
+        self.failed = 0
+
+    def start(self):
+        """ Starts the worker threads and the hub-side drainer. Safe to call more than once. """
+        with self._start_lock:
+            if self._started: return
+            self._started = True
+        for i in range(self.workers): threading.Thread(target=self._work, name=f"audio-{i}", daemon=True).start()
+        self.socketio.start_background_task(self._drain)
+        log.info(f"[Audio]: Pipeline started ({self.workers} workers, queue max {self._jobs.maxsize}).")
+
+    def submit(self, student_id, payload):
+        """ Queues a chunk. Never blocks; returns False if it was dropped. """
+        self.start()
+        try: self._jobs.put_nowait((student_id, payload))
+        except queue.Full:
+            self.dropped += 1
+            metrics.count_event("audio_chunk", "dropped")
+            log.warning("[Audio]: Queue full, dropped chunk from %s.", student_id, student_id=student_id)
+            return False
+        self.submitted += 1
+        return True
+
+    def post(self, fn, *args):
+        """ Runs `fn(*args)` on the hub at the next drain; for callbacks from native threads (e.g. artifact writes). """
+        self._results.put((None, fn, args))
+
+    def stats(self):
+        return {"queue_depth": self._jobs.qsize(), "workers": self.workers, "submitted": self.submitted,
+                "completed": self.completed, "dropped": self.dropped, "failed": self.failed}
+
+    def _work(self):
+        while True:
+            student_id, payload = self._jobs.get()
+            try:
+                with metrics.time_stage("audio_total"): result = self.process_fn(student_id, payload)
+            except Exception as e:
+                self.failed += 1
+                log.error(f"[Audio]: Chunk from {student_id} failed: {e}")
+                continue
+            self._results.put((student_id, payload, result))
+
+    def _drain(self):
+        while True:
+            try: student_id, payload, result = self._results.get_nowait()
+            except queue.Empty:
+                self.socketio.sleep(RESULT_POLL_SECONDS); continue
+            if student_id is None: # Posted callback: (None, fn, args)
+                try: payload(*result)
+                except Exception as e: log.error(f"[Audio]: Posted callback {getattr(payload, '__name__', payload)} failed: {e}")
+                continue
+            try:
+                self.apply_fn(student_id, payload, result)
+                self.completed += 1
+            except Exception as e:
+                self.failed += 1
+                log.error(f"[Audio]: Applying result for {student_id} failed: {e}")
@@ -0,0 +1,39 @@
+# backend/capture_rate.py
+"""
+Per-student capture-rate hints.
+
+The server tells each student client how often to send frames, so inference is
+spent where it can change an outcome: faster while a timer is running, slower
+for students who have been focused for a while, and slower for everyone when
+the analysis queue is saturated.
+"""
+import os
+import time
+
+# --- Configuration (milliseconds) ---
+DEFAULT_INTERVAL_MS = 2000
+FAST_INTERVAL_MS = int(os.environ.get("LOCKIN_CAPTURE_FAST_MS", "750"))
+SLOW_INTERVAL_MS = int(os.environ.get("LOCKIN_CAPTURE_SLOW_MS", "4000"))
+MAX_INTERVAL_MS = int(os.environ.get("LOCKIN_CAPTURE_MAX_MS", "8000"))
+LONG_FOCUSED_SECONDS = float(os.environ.get("LOCKIN_CAPTURE_LONG_FOCUSED_S", "60"))
+SATURATION_BACKOFF_FACTOR = 2.0
+
+# Statuses where a running timer decides the outcome, so fresher frames matter
+TIMER_STATUSES = ("Phone Detected (Pending)", "Welcome_Back", "Verifying...", "Looking Away")
+
+
+def recommend_interval_ms(status, focused_since, queue_saturated, now=None):
+    """
+    Returns the capture interval a student client should use.
+    `focused_since` is the time the student entered "Focused" (None if not focused).
+    """
+    now = now or time.time()
+    if status in TIMER_STATUSES:
+        interval = FAST_INTERVAL_MS
+    elif status == "Focused" and focused_since is not None and now - focused_since > LONG_FOCUSED_SECONDS:
+        interval = SLOW_INTERVAL_MS
+    else:
+        interval = DEFAULT_INTERVAL_MS
+    if queue_saturated:
+        interval = interval * SATURATION_BACKOFF_FACTOR
+    return int(min(interval, MAX_INTERVAL_MS))
@@ -0,0 +1,138 @@
+# backend/face_cascade.py
+"""
+Two-stage face analysis for analyze_frame.
+
+Most decisions (Away, Multiple Faces, Welcome Back) only need to know how many
+faces are in the frame. A short-range MediaPipe FaceDetection answers that for a
+fraction of the cost of the refined 478-landmark FaceMesh. The mesh then runs
+only when head pose / gaze is actually evaluated (exactly one face, student
+not busy verifying), and only on a square crop around that face, using the
+student's tracking context from face_mesh_pool.
+
+Landmarks stay in crop coordinates. The ratio features are unaffected by the
+crop, and solvePnP is given the crop's size (`mesh_shape`).
+
+With LOCKIN_FACE_CASCADE=0 the full-frame refined mesh is used for everything, as before.
+"""
+import os
+import numpy as np
+import metrics
+import landmark_features
+from face_mesh_pool import face_mesh_pool, FACE_CASCADE
+from model_registry import models # MediaPipe loads lazily / during warm-up
+from native_threading import threading # Detectors are per analysis thread
+from async_logging import get_logger
+
+log = get_logger("cascade")
+
+# --- Configuration ---
+# Extra context around the detector's box, as a fraction of the box size on each side
+CROP_MARGIN = float(os.environ.get("LOCKIN_FACE_CROP_MARGIN", "0.25"))
+DETECTION_CONFIDENCE = float(os.environ.get("LOCKIN_FACE_DETECTION_CONFIDENCE", "0.5"))
+
+
+class FaceObservation:
+    """ Faces found in one frame: their count and boxes, and the lone face's landmarks once the mesh has run. """
+    __slots__ = ("face_count", "boxes", "points", "mesh_shape", "mesh_ran")
+
+    def __init__(self, face_count, boxes=(), points=None, mesh_shape=None, mesh_ran=False):
+        self.face_count = face_count
+        self.boxes = list(boxes) # (xmin, ymin, width, height), relative to the frame
+        self.points = points # landmark_features.face_points() array of the meshed faces, or None
+        self.mesh_shape = mesh_shape # (h, w) of the image the mesh ran on (the crop, with the cascade)
+        self.mesh_ran = mesh_ran
+
+
+# --- Model (lazy, see model_registry) ---
+def _load_mediapipe():
+    import mediapipe as mp
+    return mp
+
+def _warm_up_mediapipe(mp):
+    # One detector and one mesh on a blank frame: maps the TFLite models and checks both graphs run
+    blank = np.zeros((240, 320, 3), dtype=np.uint8)
+    with mp.solutions.face_detection.FaceDetection(model_selection=0) as detector: detector.process(blank)
+    with mp.solutions.face_mesh.FaceMesh(**face_mesh_pool.options) as face_mesh: face_mesh.process(blank)
+
+models.register("mediapipe", _load_mediapipe, warmup=_warm_up_mediapipe)
+
+
+# --- Stage 1: presence / count ---
+_detectors = threading.local() # FaceDetection (and the fallback static mesh) is stateless between frames but not thread-safe
+
+def _detector():
+    detector = getattr(_detectors, "detector", None)
+    if detector is None:
+        mp = models.get("mediapipe")
+        # model_selection=0: short-range model (faces within ~2 m), the webcam case
+        detector = _detectors.detector = mp.solutions.face_detection.FaceDetection(model_selection=0, min_detection_confidence=DETECTION_CONFIDENCE)
+    return detector
+
+def detect_faces(image_rgb):
+    """ Returns the relative bounding boxes of the faces in the frame. """
+    with metrics.time_stage("face_detect"): results = _detector().process(image_rgb)
+    boxes = []
+    for detection in results.detections or []:
+        box = detection.location_data.relative_bounding_box
+        boxes.append((box.xmin, box.ymin, box.width, box.height))
+    return boxes
+
+
+# --- Stage 2: refined landmarks ---
+def _run_mesh(image_rgb, student_id):
+    """ Returns the landmark array of the faces found, shape (faces, N, 3). """
+    with face_mesh_pool.acquire(student_id) as face_mesh:
+        with metrics.time_stage("face_mesh"): results = face_mesh.process(image_rgb)
+    return landmark_features.face_points(results.multi_face_landmarks) # Converted once; features are computed on the array
+
+def _static_mesh():
+    face_mesh = getattr(_detectors, "static_mesh", None)
+    if face_mesh is None:
+        mp = models.get("mediapipe")
+        face_mesh = _detectors.static_mesh = mp.solutions.face_mesh.FaceMesh(**dict(face_mesh_pool.options, static_image_mode=True))
+    return face_mesh
+
+def _run_static_mesh(image_rgb):
+    """ Like _run_mesh, on this thread's static-image mesh: no tracking state to disturb. """
+    with metrics.time_stage("face_mesh"): results = _static_mesh().process(image_rgb)
+    return landmark_features.face_points(results.multi_face_landmarks)
+
+def crop_face(image_rgb, box, margin=CROP_MARGIN):
+    """ Square crop around a relative box, grown by `margin` on each side and clamped to the frame. """
+    img_h, img_w = image_rgb.shape[:2]
+    xmin, ymin, width, height = box
+    center_x, center_y = (xmin + width / 2.0) * img_w, (ymin + height / 2.0) * img_h
+    half = max(width * img_w, height * img_h) * (0.5 + margin)
+    x0, x1 = max(0, int(center_x - half)), min(img_w, int(center_x + half))
+    y0, y1 = max(0, int(center_y - half)), min(img_h, int(center_y + half))
+    if x1 - x0 < 2 or y1 - y0 < 2: return None
+    crop = np.ascontiguousarray(image_rgb[y0:y1, x0:x1]) # MediaPipe needs a contiguous buffer
+    crop.flags.writeable = False
+    return crop
+
+def observe_faces(image_rgb, student_id):
+    """ Stage 1 with the cascade; the full-frame refined mesh without it. """
+    if FACE_CASCADE:
+        boxes = detect_faces(image_rgb)
+        return FaceObservation(len(boxes), boxes)
+    points = _run_mesh(image_rgb, student_id)
+    return FaceObservation(len(points), points=points, mesh_shape=image_rgb.shape[:2], mesh_ran=True)
+
+def refine_landmarks(observation, image_rgb, student_id):
+    """
+    Landmark array (faces, N, 3) of the lone face, running the refined mesh on its
+    crop the first time it is needed for this observation. None when the mesh finds no face.
+    """
+    if observation.mesh_ran or observation.face_count != 1:
+        return observation.points if observation.points is not None and len(observation.points) else None
+    observation.mesh_ran = True
+    crop = crop_face(image_rgb, observation.boxes[0]) if observation.boxes else None
+    points = _run_mesh(crop, student_id) if crop is not None else None
+    mesh_image = crop
+    if points is None or not len(points):
+        metrics.count_event("face_mesh_crop", "miss")
+        # Crop too tight or detector box off: try the whole frame, on a static-image mesh so the
+        # student's video-mode tracker keeps seeing crops of one size
+        points, mesh_image = _run_static_mesh(image_rgb), image_rgb
+    observation.points, observation.mesh_shape = (points[:1], mesh_image.shape[:2]) if len(points) else (None, None)
+    return observation.points
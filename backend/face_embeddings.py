@@ -0,0 +1,135 @@
+# backend/face_embeddings.py
+"""
+Reference face embeddings for identity verification.
+
+The reference (wallpaper) embedding is computed once, on a verification
+worker after the wallpaper is saved, and cached in memory and on disk next to
+the reference image. A re-verification then only has to embed the live frame
+and compare distances.
+"""
+import os
+import hashlib
+import numpy as np
+from native_threading import threading
+from model_registry import models # DeepFace (TensorFlow) loads lazily / during warm-up
+from async_logging import get_logger
+
+log = get_logger("embeddings")
+
+# --- Constants ---
+EMBEDDING_MODEL_NAME = 'Facenet'
+EMBEDDING_DETECTOR_BACKEND = 'mtcnn' # Recommended detector for Facenet
+EMBEDDINGS_DIR = os.path.join(os.path.dirname(__file__), "reference_images") # Stored beside the wallpapers
+
+
+# --- Model (lazy, see model_registry) ---
+def _load_deepface():
+    from deepface import DeepFace
+    DeepFace.build_model(EMBEDDING_MODEL_NAME)
+    return DeepFace
+
+def _warm_up_deepface(DeepFace):
+    # Blank image, no face required: builds the MTCNN detector and runs Facenet once
+    DeepFace.represent(img_path=np.zeros((160, 160, 3), dtype=np.uint8), model_name=EMBEDDING_MODEL_NAME,
+                       detector_backend=EMBEDDING_DETECTOR_BACKEND, enforce_detection=False)
+
+models.register("deepface", _load_deepface, warmup=_warm_up_deepface)
+
+
+# --- Embedding Helpers ---
+def compute_embeddings(image):
+    """
+    Embeds every face found in `image` (BGR numpy array or file path).
+    Raises ValueError when no face is detected, like DeepFace.verify does.
+    Returns a list of (embedding, face_area) tuples.
+    """
+    representations = models.get("deepface").represent(
+        img_path=image,
+        model_name=EMBEDDING_MODEL_NAME,
+        detector_backend=EMBEDDING_DETECTOR_BACKEND,
+        enforce_detection=True
+    )
+    faces = []
+    for rep in representations:
+        area = rep.get("facial_area") or {}
+        faces.append((np.asarray(rep["embedding"], dtype=np.float32), area.get("w", 0) * area.get("h", 0)))
+    return faces
+
+def compute_reference_embedding(image):
+    """ Embeds the largest face in the reference image. """
+    faces = compute_embeddings(image)
+    return max(faces, key=lambda face: face[1])[0]
+
+def cosine_distance(a, b):
+    """ Same metric DeepFace.verify uses by default for Facenet. """
+    denom = float(np.linalg.norm(a) * np.linalg.norm(b))
+    if denom == 0: return 1.0
+    return 1.0 - float(np.dot(a, b)) / denom
+
+
+# --- Embedding Store ---
+def source_id_for(source_path):
+    """ Content address of a reference image (the same SHA-256 ID snapshot_store gives the JPEG). """
+    with open(source_path, "rb") as source_file: return hashlib.sha256(source_file.read()).hexdigest()
+
+
+class EmbeddingStore:
+    """
+    Reference embeddings keyed by student.
+    Each entry remembers the content hash of the reference image it came from,
+    so a replaced wallpaper is never matched against a stale embedding, while
+    a rewritten but identical one (or a restart) still reuses it.
+    """
+
+    def __init__(self, directory=EMBEDDINGS_DIR):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._cache = {} # {student_id: (source_id, embedding)}
+        self._lock = threading.Lock()
+
+    def path_for(self, student_id):
+        safe_student_id = "".join(c for c in student_id if c.isalnum() or c in ('-', '_', '.')).rstrip()
+        return os.path.join(self.directory, f"embedding_{safe_student_id}.npz")
+
+    def put(self, student_id, embedding, source_id):
+        """ Caches an embedding and persists it beside the reference image. """
+        embedding = np.asarray(embedding, dtype=np.float32)
+        with self._lock: self._cache[student_id] = (source_id, embedding)
+        try:
+            np.savez(self.path_for(student_id), embedding=embedding, source_id=np.array(source_id))
+        except Exception as e:
+            log.warning(f"[Embeddings]: Could not persist embedding for {student_id}: {e}")
+
+    def get(self, student_id, source_id):
+        """ Returns the embedding of the reference image with this content ID, loading it from disk if needed, else None. """
+        with self._lock: cached = self._cache.get(student_id)
+        if cached is not None and cached[0] == source_id: return cached[1]
+
+        file_path = self.path_for(student_id)
+        if not os.path.exists(file_path): return None
+        try:
+            with np.load(file_path) as data:
+                if "source_id" not in data.files or str(data["source_id"]) != source_id: return None # Older format or other image
+                embedding = data["embedding"].astype(np.float32)
+        except Exception as e:
+            log.warning(f"[Embeddings]: Ignoring unreadable embedding file {file_path}: {e}")
+            return None
+        with self._lock: self._cache[student_id] = (source_id, embedding)
+        return embedding
+
+    def get_or_compute(self, student_id, source_path):
+        """ The reference embedding for the image at `source_path`; embeds it (seconds) only if no stored one matches its content. """
+        source_id = source_id_for(source_path)
+        embedding = self.get(student_id, source_id)
+        if embedding is None:
+            log.info(f"[Embeddings]: No stored embedding for {student_id}, computing from {source_path}.")
+            embedding = compute_reference_embedding(source_path)
+            self.put(student_id, embedding, source_id)
+        return embedding
+
+    def forget(self, student_id):
+        """ Drops the in-memory entry; the persisted file survives restarts. """
+        with self._lock: self._cache.pop(student_id, None)
+
+
+embedding_store = EmbeddingStore()
@@ -0,0 +1,172 @@
+# backend/face_mesh_pool.py
+"""
+Per-student MediaPipe FaceMesh tracking contexts.
+
+FaceMesh in video mode (static_image_mode=False) only runs its face detector
+when tracking is lost; otherwise it follows the previous frame's landmarks,
+which is much cheaper. A single shared FaceMesh fed interleaved frames from
+many students loses tracking on every call, and is not safe to call from
+several threads at once.
+
+This pool binds one FaceMesh to each student. At most LOCKIN_FACEMESH_POOL_SIZE
+instances exist, further capped by LOCKIN_FACEMESH_POOL_MEMORY_MB /
+LOCKIN_FACEMESH_INSTANCE_MB. When the pool is full, the least recently used idle
+instance is reset and handed to the new student. If every instance is busy,
+the caller waits for one.
+
+    with face_mesh_pool.acquire(student_id) as face_mesh:
+        results = face_mesh.process(image_rgb)
+"""
+import os
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from native_threading import threading # Used from analysis executor / inference worker threads
+from model_registry import models, ModelUnavailable
+from async_logging import get_logger
+
+log = get_logger("facemesh")
+
+# --- Configuration ---
+POOL_SIZE = int(os.environ.get("LOCKIN_FACEMESH_POOL_SIZE", "64"))
+# Memory budget for all instances; 0 = no budget beyond POOL_SIZE
+POOL_MEMORY_MB = float(os.environ.get("LOCKIN_FACEMESH_POOL_MEMORY_MB", "0"))
+# Approximate resident memory of one refined FaceMesh graph (models + buffers)
+INSTANCE_MEMORY_MB = float(os.environ.get("LOCKIN_FACEMESH_INSTANCE_MB", "40"))
+ACQUIRE_TIMEOUT_SECONDS = 10.0
+# With the cascade (face_cascade) FaceMesh only sees single-face crops; without it, it must find every face itself
+FACE_CASCADE = os.environ.get("LOCKIN_FACE_CASCADE", "1") != "0"
+
+FACE_MESH_OPTIONS = {
+    "static_image_mode": False, # Video mode: track between frames of the same student
+    # FaceMesh re-runs its detector whenever it tracks fewer faces than this, so keep it tight
+    "max_num_faces": 1 if FACE_CASCADE else 5,
+    "min_detection_confidence": 0.5,
+    "min_tracking_confidence": 0.5,
+    "refine_landmarks": True, # Needed for iris landmarks
+}
+
+
+class FaceMeshUnavailable(Exception):
+    """ MediaPipe could not create a FaceMesh, or none became free in time. """
+
+
+class FaceMeshBusy(FaceMeshUnavailable):
+    """ Every instance stayed busy for ACQUIRE_TIMEOUT_SECONDS: a transient overload, not a MediaPipe failure. """
+
+
+def effective_pool_size(pool_size=POOL_SIZE, memory_mb=POOL_MEMORY_MB, instance_mb=INSTANCE_MEMORY_MB):
+    size = max(1, pool_size)
+    if memory_mb > 0 and instance_mb > 0: size = min(size, max(1, int(memory_mb // instance_mb)))
+    return size
+
+
+class _MeshContext:
+    __slots__ = ("face_mesh", "student_id", "busy", "last_used")
+
+    def __init__(self, face_mesh, student_id):
+        self.face_mesh = face_mesh
+        self.student_id = student_id
+        self.busy = False
+        self.last_used = time.monotonic()
+
+
+class FaceMeshPool:
+    """ LRU pool of FaceMesh instances keyed by student ID. """
+
+    def __init__(self, max_instances=None, options=None):
+        self.max_instances = max_instances or effective_pool_size()
+        self.options = dict(options or FACE_MESH_OPTIONS)
+        self._contexts = OrderedDict() # student_id -> _MeshContext, least recently used first
+        self._condition = threading.Condition(threading.Lock())
+        self._factory = None
+        self.created = 0
+        self.evictions = 0
+
+    def _create_face_mesh(self):
+        try:
+            if self._factory is None: self._factory = models.get("mediapipe").solutions.face_mesh.FaceMesh
+            face_mesh = self._factory(**self.options)
+        except (AttributeError, ModelUnavailable) as e:
+            raise FaceMeshUnavailable("Could not initialize MediaPipe FaceMesh. Is MediaPipe installed correctly?") from e
+        except Exception as e:
+            raise FaceMeshUnavailable(f"Unexpected error initializing FaceMesh: {e}") from e
+        self.created += 1
+        return face_mesh
+
+    def _take_context(self, student_id, deadline):
+        """ Returns (context, needs_new_mesh, needs_reset) with the context marked busy. Called with the lock held. """
+        while True:
+            context = self._contexts.get(student_id)
+            if context is not None:
+                if not context.busy:
+                    self._contexts.move_to_end(student_id)
+                    context.busy = True
+                    return context, False, False
+            elif len(self._contexts) < self.max_instances:
+                context = self._contexts[student_id] = _MeshContext(None, student_id)
+                context.busy = True
+                return context, True, False
+            else:
+                victim_id = next((sid for sid, c in self._contexts.items() if not c.busy), None)
+                if victim_id is not None:
+                    context = self._contexts.pop(victim_id)
+                    context.student_id = student_id
+                    context.busy = True
+                    self._contexts[student_id] = context
+                    self.evictions += 1
+                    return context, False, True
+            remaining = deadline - time.monotonic()
+            if remaining <= 0: raise FaceMeshBusy(f"No FaceMesh instance free within {ACQUIRE_TIMEOUT_SECONDS:.0f}s")
+            self._condition.wait(remaining)
+
+    @contextmanager
+    def acquire(self, student_id):
+        """ Yields the student's FaceMesh for exclusive use. Raises FaceMeshBusy on timeout, FaceMeshUnavailable otherwise. """
+        deadline = time.monotonic() + ACQUIRE_TIMEOUT_SECONDS
+        with self._condition: context, needs_new_mesh, needs_reset = self._take_context(student_id, deadline)
+        try:
+            if needs_new_mesh: context.face_mesh = self._create_face_mesh()
+            elif needs_reset: self._reset(context)
+        except Exception:
+            with self._condition:
+                if self._contexts.get(student_id) is context: del self._contexts[student_id]
+                self._condition.notify()
+            raise
+        try:
+            yield context.face_mesh
+        finally:
+            with self._condition:
+                context.busy = False
+                context.last_used = time.monotonic()
+                self._condition.notify()
+
+    def _reset(self, context):
+        """ Drops the previous student's tracking state so the new student starts with a fresh detection. """
+        reset = getattr(context.face_mesh, "reset", None)
+        if reset is not None:
+            reset()
+        else: # Older MediaPipe without SolutionBase.reset(): rebuild the graph
+            self._close(context.face_mesh)
+            context.face_mesh = self._create_face_mesh()
+
+    def _close(self, face_mesh):
+        try: face_mesh.close()
+        except Exception as e: log.warning(f"[FaceMesh]: Error closing FaceMesh instance: {e}")
+
+    def release(self, student_id):
+        """ Frees the student's instance (on disconnect). A busy instance is left for LRU eviction. """
+        with self._condition:
+            context = self._contexts.get(student_id)
+            if context is None or context.busy: return
+            del self._contexts[student_id]
+            self._condition.notify()
+        if context.face_mesh is not None: self._close(context.face_mesh)
+
+    def stats(self):
+        with self._condition:
+            return {"instances": len(self._contexts), "busy": sum(1 for c in self._contexts.values() if c.busy),
+                    "max_instances": self.max_instances, "created": self.created, "evictions": self.evictions}
+
+
+face_mesh_pool = FaceMeshPool()
@@ -0,0 +1,63 @@
+# backend/frame_change.py
+"""
+Cheap per-student change detector used to skip redundant inference.
+
+Each frame is shrunk to a tiny grayscale thumbnail and compared with the
+thumbnail of the last frame that went through full FaceMesh/YOLO inference.
+If the mean absolute difference stays under the threshold, the previous model
+results can be reused and only the timers need to advance.
+"""
+import os
+import cv2
+import numpy as np
+
+# --- Per-Student State Management ---
+student_change_states = {} # {student_id: {"reference_thumb", "consecutive_skips", "frames", "skipped"}}
+
+# --- Configuration ---
+CHANGE_GATING_ENABLED = os.environ.get("LOCKIN_CHANGE_GATING", "1") != "0"
+# Mean absolute grey-level difference (0-255) above which a frame counts as changed
+CHANGE_THRESHOLD = float(os.environ.get("LOCKIN_CHANGE_THRESHOLD", "6.0"))
+# Force a full inference pass after this many consecutive skipped frames
+MAX_CONSECUTIVE_SKIPS = int(os.environ.get("LOCKIN_CHANGE_MAX_SKIPS", "5"))
+THUMBNAIL_SIZE = (32, 24) # (width, height)
+
+
+def _thumbnail(image_bgr):
+    # Downscale first, so the colour conversion only touches 768 pixels
+    small = cv2.resize(image_bgr, THUMBNAIL_SIZE, interpolation=cv2.INTER_AREA)
+    return cv2.cvtColor(small, cv2.COLOR_BGR2GRAY).astype(np.int16)
+
+def frame_changed(image_bgr, student_id):
+    """
+    Returns True when the frame needs full inference, False when the last
+    results can be reused. Updates the student's skip statistics.
+    """
+    state = student_change_states.get(student_id)
+    if state is None:
+        state = student_change_states[student_id] = {"reference_thumb": None, "consecutive_skips": 0, "frames": 0, "skipped": 0}
+    state["frames"] += 1
+
+    if not CHANGE_GATING_ENABLED: return True
+    thumb = _thumbnail(image_bgr)
+    reference = state["reference_thumb"]
+    if (reference is not None and reference.shape == thumb.shape
+            and state["consecutive_skips"] < MAX_CONSECUTIVE_SKIPS
+            and float(np.mean(np.abs(thumb - reference))) < CHANGE_THRESHOLD):
+        state["consecutive_skips"] += 1; state["skipped"] += 1
+        return False
+
+    # Changed (or due for a refresh): this frame becomes the new reference
+    state["reference_thumb"] = thumb; state["consecutive_skips"] = 0
+    return True
+
+def get_skip_stats(student_id):
+    """ Returns {"frames": int, "skipped": int, "skip_rate": float} for a student. """
+    state = student_change_states.get(student_id)
+    if not state or not state["frames"]: return {"frames": 0, "skipped": 0, "skip_rate": 0.0}
+    return {"frames": state["frames"], "skipped": state["skipped"], "skip_rate": state["skipped"] / state["frames"]}
+
+# --- Cleanup Function ---
+def remove_student_change_state(student_id):
+    """ Removes state for a disconnected student """
+    student_change_states.pop(student_id, None)
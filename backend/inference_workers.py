@@ -0,0 +1,330 @@
+# backend/inference_workers.py
+"""
+Inference tier: separate worker processes that own the FaceMesh/YOLOv5/DeepFace
+models, so the Python glue around them runs on every core instead of behind
+the web process's GIL.
+
+Decoded BGR frames are not pickled. The web process copies each frame into a
+slot of a shared-memory ring and sends only the slot index plus a little
+metadata over a pipe. The worker runs focus and phone analysis on a
+zero-copy view of that slot and sends back the compact result dicts.
+
+Per-student timers and tracking state live in the worker that analyses the
+student, so students are pinned to a worker by a stable hash of their ID, and
+inside the worker to one serve thread, which also applies their `forget`.
+Workers are started with the "spawn" method: forking a process that has
+eventlet's hub and loaded models is unsafe.
+
+A frame slot stays with its request until the worker has answered or died, so
+a late answer to a timed-out request hands the slot back. A worker that dies
+only fails its own requests and is respawned; while it warms up, its students
+are analysed by the other ready workers.
+"""
+import os
+import sys
+import time
+import zlib
+import itertools
+import multiprocessing
+from multiprocessing import shared_memory
+import numpy as np
+from native_threading import threading, queue # Called from analysis worker threads
+from async_logging import get_logger
+
+log = get_logger("inference")
+
+# --- Configuration ---
+# 0 keeps inference in the web process (analysis executor threads)
+INFERENCE_PROCESSES = int(os.environ.get("LOCKIN_INFERENCE_PROCESSES", "0"))
+# Concurrent requests per worker process; >1 lets the worker's YOLOv5 batcher form batches
+INFERENCE_THREADS_PER_PROCESS = int(os.environ.get("LOCKIN_INFERENCE_THREADS", "4"))
+# Largest frame a slot can hold (pixels); bigger frames are downscaled before the hand-off
+MAX_FRAME_PIXELS = int(os.environ.get("LOCKIN_INFERENCE_MAX_FRAME_PIXELS", str(1280 * 720)))
+REQUEST_TIMEOUT_SECONDS = float(os.environ.get("LOCKIN_INFERENCE_TIMEOUT", "30"))
+STARTUP_TIMEOUT_SECONDS = 300.0 # Model loading (and first-run weight downloads) in a fresh worker
+RESPAWN_DELAY_SECONDS = 5.0 # Pause before replacing a dead worker, so a crash loop does not spin
+
+
+class InferenceError(Exception):
+    """ The worker failed or did not answer; the frame should be treated as an analysis error. """
+
+
+# --- Worker Process Side ---
+def _worker_main(worker_index, shm_name, slot_bytes, connection, threads):
+    """ Entry point of a worker process. Models load and warm up here, before the worker reports ready. """
+    import video_analysis
+    import phone_detection
+    import face_embeddings
+    from model_registry import models
+    models.warm_up() # Registered lazily on import; load them all now so the first frame is fast
+    shm = shared_memory.SharedMemory(name=shm_name)
+    send_lock = threading.Lock()
+    # One queue per serve thread, each student always on the same one: a frame the parent gave up on
+    # still finishes before the student's next frame or `forget` runs, so per-student state has one user
+    queues = [queue.Queue() for _ in range(max(1, threads))]
+
+    def queue_for(student_id): # adler32, not the parent's crc32: within a worker those all share one residue
+        return queues[zlib.adler32(student_id.encode("utf-8")) % len(queues)]
+
+    def reply(message):
+        with send_lock: connection.send(message)
+
+    def handle(request):
+        request_id = request["id"]
+        try:
+            height, width = request["shape"]
+            offset = request["slot"] * slot_bytes
+            image_bgr = np.ndarray((height, width, 3), dtype=np.uint8, buffer=shm.buf, offset=offset) # Zero-copy view of the slot
+            student_id = request["student_id"]
+            if request.get("reference_path"): video_analysis.prepare_reference(student_id, request["reference_path"]) # Queued; embeds the wallpaper file
+            focus = phone = None
+            try: focus = video_analysis.analyze_frame(image_bgr, student_id, request["fallback_reference_path"], reuse_last_results=request["reuse"])
+            except Exception as e: focus = {"error": str(e)}
+            try: phone = phone_detection.analyze_phone_frame(image_bgr, student_id, reuse_last_results=request["reuse"])
+            except Exception as e: phone = {"error": str(e)}
+            del image_bgr # Drop the view before the parent reuses the slot
+            reply({"id": request_id, "focus": focus, "phone": phone})
+        except Exception as e:
+            reply({"id": request_id, "error": f"{type(e).__name__}: {e}"})
+
+    def forget(student_id):
+        video_analysis.remove_student_state(student_id); phone_detection.remove_student_phone_state(student_id)
+
+    def serve(requests):
+        while True:
+            request = requests.get()
+            if request is None: return
+            if request.get("forget"): forget(request["forget"])
+            else: handle(request)
+
+    for i, requests in enumerate(queues): threading.Thread(target=serve, args=(requests,), name=f"inference-{worker_index}-{i}", daemon=True).start()
+    reply({"ready": worker_index, "models": models.status()})
+    try:
+        while True:
+            try: message = connection.recv()
+            except EOFError: break # Parent went away
+            if message.get("stop"): break
+            queue_for(message.get("forget") or message["student_id"]).put(message)
+    finally:
+        for requests in queues: requests.put(None)
+        shm.close()
+
+
+# --- Web Process Side ---
+class _main_module_hidden:
+    """
+    "spawn" re-runs the parent's __main__ script (server.py) in each child unless
+    it cannot find it. Hide its __file__ while workers start, so the children only
+    import this module.
+    """
+
+    def __enter__(self):
+        self.main = sys.modules.get("__main__")
+        self.file = getattr(self.main, "__file__", None)
+        if self.file is not None and getattr(self.main, "__spec__", None) is None: del self.main.__file__
+        else: self.file = None
+        return self
+
+    def __exit__(self, *exc):
+        if self.file is not None: self.main.__file__ = self.file
+
+
+class _PendingRequest:
+    """ One request in flight. It owns its frame slot until the worker answers or dies. """
+    __slots__ = ("done", "result", "worker_index", "slot")
+
+    def __init__(self, worker_index, slot):
+        self.done = threading.Event()
+        self.result = None
+        self.worker_index = worker_index
+        self.slot = slot
+
+
+class _WorkerHandle:
+    def __init__(self, index, process, connection):
+        self.index = index
+        self.process = process
+        self.connection = connection
+        self.send_lock = threading.Lock()
+        self.ready = threading.Event()
+        self.alive = True
+        self.models = {} # model_registry status reported by the worker once warmed up
+
+
+class InferenceProcessPool:
+    """
+    Owns the shared-memory frame ring and the worker processes.
+    `analyze()` is called from the analysis executor's native threads and
+    blocks until the student's worker answers.
+    """
+
+    def __init__(self, processes=INFERENCE_PROCESSES, threads_per_process=INFERENCE_THREADS_PER_PROCESS, max_frame_pixels=MAX_FRAME_PIXELS):
+        self.processes = max(1, processes)
+        self.threads_per_process = max(1, threads_per_process)
+        self.slot_bytes = max_frame_pixels * 3
+        self.slots = self.processes * self.threads_per_process * 2 # Double-buffer every worker thread
+        self.max_frame_pixels = max_frame_pixels
+        self._shm = None
+        self._free_slots = queue.Queue()
+        self._workers = []
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+        self._ids = itertools.count()
+        self._start_lock = threading.Lock()
+        self._context = None
+        self._stopping = False
+        self.requests_sent = 0
+        self.requests_failed = 0
+        self.respawns = 0
+
+    def start(self):
+        with self._start_lock:
+            if self._workers: return
+            self._shm = shared_memory.SharedMemory(create=True, size=self.slots * self.slot_bytes)
+            for slot in range(self.slots): self._free_slots.put(slot)
+            self._context = multiprocessing.get_context("spawn")
+            with _main_module_hidden():
+                for index in range(self.processes): self._workers.append(self._spawn_worker(index))
+            log.info(f"[Inference]: Started {self.processes} worker processes x {self.threads_per_process} threads, "
+                     f"{self.slots} frame slots ({self.slots * self.slot_bytes // (1024 * 1024)} MB shared memory).")
+
+    def _spawn_worker(self, index):
+        """ Starts worker process `index` and its reader thread. Call inside _main_module_hidden. """
+        parent_end, child_end = self._context.Pipe(duplex=True)
+        process = self._context.Process(target=_worker_main, name=f"lockin-inference-{index}",
+                                        args=(index, self._shm.name, self.slot_bytes, child_end, self.threads_per_process), daemon=True)
+        process.start()
+        child_end.close()
+        worker = _WorkerHandle(index, process, parent_end)
+        threading.Thread(target=self._read_results, args=(worker,), name=f"inference-reader-{index}", daemon=True).start()
+        return worker
+
+    def _worker_for(self, student_id):
+        key = zlib.crc32(student_id.encode("utf-8")) # Stable across restarts, unlike hash()
+        worker = self._workers[key % len(self._workers)]
+        if worker.alive and worker.ready.is_set(): return worker
+        # Pinned worker dead or still warming up after a respawn: borrow a ready one (the student's timers start over there)
+        healthy = [w for w in self._workers if w.alive and w.ready.is_set()]
+        return healthy[key % len(healthy)] if healthy else worker
+
+    def _read_results(self, worker):
+        while True:
+            try: message = worker.connection.recv()
+            except (EOFError, OSError):
+                worker.alive = False
+                if self._stopping: return
+                log.error(f"[Inference]: Worker {worker.index} exited (code {worker.process.exitcode}).")
+                self._fail_worker_pending(worker, f"Inference worker {worker.index} exited")
+                self._respawn(worker)
+                return
+            if "ready" in message:
+                worker.models = message.get("models") or {}
+                worker.ready.set(); log.info(f"[Inference]: Worker {worker.index} ready."); continue
+            with self._pending_lock: pending = self._pending.pop(message["id"], None)
+            if pending is None: continue
+            self._free_slots.put(pending.slot) # The worker is done with the frame, even if its caller gave up waiting
+            pending.result = message; pending.done.set()
+
+    def _fail_worker_pending(self, worker, reason):
+        """ Fails the dead worker's requests and frees their slots; other workers' requests are untouched. """
+        with self._pending_lock:
+            failed = {request_id: p for request_id, p in self._pending.items() if p.worker_index == worker.index}
+            for request_id in failed: del self._pending[request_id]
+        for pending in failed.values():
+            self._free_slots.put(pending.slot)
+            pending.result = {"error": reason}; pending.done.set()
+
+    def _respawn(self, worker):
+        """ Replaces a dead worker, on its reader thread, retrying until a process starts. """
+        while not self._stopping:
+            time.sleep(RESPAWN_DELAY_SECONDS)
+            if self._stopping: return
+            try:
+                with self._start_lock, _main_module_hidden(): self._workers[worker.index] = self._spawn_worker(worker.index)
+            except Exception as e:
+                log.error(f"[Inference]: Could not respawn worker {worker.index}: {e}"); continue
+            self.respawns += 1
+            log.info(f"[Inference]: Respawned worker {worker.index}.")
+            return
+
+    def _send(self, worker, message):
+        with worker.send_lock: worker.connection.send(message)
+
+    def analyze(self, image_bgr, student_id, fallback_reference_path, reuse_last_results=False, reference_path=None):
+        """
+        Runs focus + phone analysis for one frame in the student's worker process.
+        Returns (focus_analysis, phone_analysis); either may be {"error": str}.
+        """
+        self.start()
+        worker = self._worker_for(student_id)
+        if not worker.alive: raise InferenceError(f"Inference worker {worker.index} is not running (respawn pending)")
+        if not worker.ready.wait(STARTUP_TIMEOUT_SECONDS): raise InferenceError(f"Inference worker {worker.index} is still loading models")
+        height, width = image_bgr.shape[:2]
+        if height * width > self.max_frame_pixels:
+            import cv2
+            scale = (self.max_frame_pixels / float(height * width)) ** 0.5
+            image_bgr = cv2.resize(image_bgr, (max(1, int(width * scale)), max(1, int(height * scale))), interpolation=cv2.INTER_AREA)
+            height, width = image_bgr.shape[:2]
+
+        try: slot = self._free_slots.get(timeout=REQUEST_TIMEOUT_SECONDS)
+        except queue.Empty:
+            self.requests_failed += 1
+            raise InferenceError(f"No free frame slot within {REQUEST_TIMEOUT_SECONDS:.0f}s (all {self.slots} held by unanswered requests)")
+        request_id = next(self._ids)
+        pending = _PendingRequest(worker.index, slot); registered = False
+        try:
+            view = np.ndarray((height, width, 3), dtype=np.uint8, buffer=self._shm.buf, offset=slot * self.slot_bytes)
+            np.copyto(view, image_bgr) # The only copy of the frame
+            del view
+            with self._pending_lock: self._pending[request_id] = pending; registered = True
+            self._send(worker, {"id": request_id, "slot": slot, "shape": (height, width), "student_id": student_id,
+                                "fallback_reference_path": fallback_reference_path, "reuse": reuse_last_results, "reference_path": reference_path})
+        except Exception as e:
+            # Whoever removes the request from _pending frees its slot; a reader failing the dead worker may have done so
+            with self._pending_lock: owned = not registered or self._pending.pop(request_id, None) is not None
+            if owned: self._free_slots.put(slot)
+            self.requests_failed += 1
+            raise InferenceError(f"Could not send frame to inference worker {worker.index}: {e}") from e
+        self.requests_sent += 1
+        # From here the slot is freed by the reader thread, when the worker answers or dies
+        if not pending.done.wait(REQUEST_TIMEOUT_SECONDS):
+            self.requests_failed += 1
+            raise InferenceError(f"Inference worker {worker.index} timed out")
+        result = pending.result
+        if "error" in result and "focus" not in result:
+            self.requests_failed += 1
+            raise InferenceError(result["error"])
+        return result["focus"], result["phone"]
+
+    def forget(self, student_id):
+        """ Drops the student's analysis state in its worker (on disconnect). """
+        for worker in list(self._workers): # Any worker may have borrowed the student while its own was down
+            if not worker.alive: continue
+            try: self._send(worker, {"forget": student_id})
+            except Exception as e: log.warning(f"[Inference]: Could not forget {student_id}: {e}")
+
+    def readiness(self):
+        """ Per-worker readiness for /ready: running, warmed up, and every model loaded. """
+        workers = {}
+        for worker in self._workers:
+            model_states = {name: status["state"] for name, status in worker.models.items()}
+            workers[worker.index] = {"alive": worker.alive, "ready": worker.ready.is_set(), "models": model_states}
+        ready = bool(workers) and all(w["alive"] and w["ready"] and all(state == "ready" for state in w["models"].values()) for w in workers.values())
+        return ready, workers
+
+    def stats(self):
+        return {"processes": len(self._workers), "alive": sum(1 for w in self._workers if w.alive),
+                "free_slots": self._free_slots.qsize(), "slots": self.slots, "in_flight": len(self._pending),
+                "requests_sent": self.requests_sent, "requests_failed": self.requests_failed, "respawns": self.respawns}
+
+    def stop(self):
+        self._stopping = True
+        for worker in self._workers:
+            try: self._send(worker, {"stop": True})
+            except Exception: pass
+        for worker in self._workers: worker.process.join(timeout=5)
+        if self._shm is not None:
+            self._shm.close(); self._shm.unlink(); self._shm = None
+
+
+inference_pool = InferenceProcessPool() if INFERENCE_PROCESSES > 0 else None
@@ -0,0 +1,136 @@
+# backend/landmark_features.py
+"""
+Head pose and gaze features from FaceMesh landmarks, computed with NumPy.
+
+The mesh is converted to a (faces, landmarks, 3) array once per frame
+(`face_points`). Yaw, pitch and the iris ratio are then computed for every
+face at once, with no per-landmark protobuf access.
+
+Head pose modes (LOCKIN_HEAD_POSE):
+- "ratio" (default): nose-to-eye / nose-to-forehead distance ratios scaled to
+  approximate degrees. Cheap, and invariant to where the face sits in the image.
+- "pnp": cv2.solvePnP against a generic 3D face model. More accurate, one solve
+  per face; camera matrices are cached per resolution.
+
+`FeatureSmoother` keeps a per-student exponential moving average, so a single
+noisy frame does not flip a student between Focused and Looking Away.
+"""
+import os
+from functools import lru_cache
+import numpy as np
+
+# --- Configuration ---
+HEAD_POSE_MODE = os.environ.get("LOCKIN_HEAD_POSE", "ratio").lower() # "ratio" or "pnp"
+# Weight of the newest frame in the moving average; 1.0 disables smoothing
+SMOOTHING_ALPHA = float(os.environ.get("LOCKIN_POSE_SMOOTHING", "0.5"))
+
+# --- Landmark Indices (MediaPipe FaceMesh) ---
+NOSE_TIP, FOREHEAD, CHIN = 1, 10, 152
+LEFT_EYE_OUTER, LEFT_EYE_INNER, RIGHT_EYE_INNER, RIGHT_EYE_OUTER = 33, 133, 362, 263
+LEFT_MOUTH, RIGHT_MOUTH = 61, 291
+LEFT_IRIS_CENTER, RIGHT_IRIS_CENTER = 473, 468 # Only present with refine_landmarks=True
+REFINED_LANDMARK_COUNT = 478
+
+GAZE_RIGHT_BELOW, GAZE_LEFT_ABOVE = 0.35, 0.65
+
+# Generic 3D face model for solvePnP, in camera-style axes (y down, z away from
+# the camera), so a frontal face solves to a near-identity rotation
+PNP_LANDMARKS = [NOSE_TIP, CHIN, LEFT_EYE_OUTER, RIGHT_EYE_OUTER, LEFT_MOUTH, RIGHT_MOUTH]
+PNP_MODEL_POINTS = np.array([
+    (0.0, 0.0, 0.0),          # Nose tip
+    (0.0, 330.0, 65.0),       # Chin
+    (-225.0, -170.0, 135.0),  # Left eye left corner
+    (225.0, -170.0, 135.0),   # Right eye right corner
+    (-150.0, 150.0, 125.0),   # Left mouth corner
+    (150.0, 150.0, 125.0),    # Right mouth corner
+], dtype=np.float64)
+
+
+def face_points(multi_face_landmarks):
+    """ FaceMesh landmark lists -> float32 array of shape (faces, landmarks, 3), normalised x/y. """
+    if not multi_face_landmarks: return np.zeros((0, REFINED_LANDMARK_COUNT, 3), dtype=np.float32)
+    return np.array([[(p.x, p.y, p.z) for p in face.landmark] for face in multi_face_landmarks], dtype=np.float32)
+
+
+# --- Head Pose ---
+def head_pose_ratio(points):
+    """ (faces, N, 3) -> (yaw, pitch) arrays in approximate degrees. Pitch is positive looking up. """
+    nose = points[:, NOSE_TIP]
+    to_left = np.abs(nose[:, 0] - points[:, LEFT_EYE_INNER, 0])
+    to_right = np.abs(nose[:, 0] - points[:, RIGHT_EYE_INNER, 0])
+    yaw = (to_left - to_right) / (to_left + to_right + 1e-6) * 90
+    to_forehead = np.abs(nose[:, 1] - points[:, FOREHEAD, 1])
+    to_chin = np.abs(nose[:, 1] - points[:, CHIN, 1])
+    # Image y grows downwards, so a positive ratio means looking down; flip it so "up" is positive
+    pitch = (to_forehead - to_chin) / (to_forehead + to_chin + 1e-6) * -90
+    return yaw, pitch
+
+@lru_cache(maxsize=16)
+def camera_matrix(width, height):
+    """ Pinhole approximation (focal length = image width), cached per resolution. """
+    matrix = np.array([[width, 0, width / 2.0], [0, width, height / 2.0], [0, 0, 1]], dtype=np.float64)
+    matrix.setflags(write=False)
+    return matrix
+
+_NO_DISTORTION = np.zeros((4, 1))
+
+def head_pose_pnp(points, image_shape):
+    """ (faces, N, 3) landmarks of an image of `image_shape` (h, w) -> (yaw, pitch) arrays in degrees. """
+    import cv2
+    height, width = image_shape[:2]
+    matrix = camera_matrix(width, height)
+    image_points = points[:, PNP_LANDMARKS, :2].astype(np.float64) * np.array([width, height], dtype=np.float64)
+    yaw, pitch = np.zeros(len(points)), np.zeros(len(points))
+    for i in range(len(points)):
+        ok, rotation_vector, _ = cv2.solvePnP(PNP_MODEL_POINTS, image_points[i], matrix, _NO_DISTORTION, flags=cv2.SOLVEPNP_ITERATIVE)
+        if not ok: continue
+        rotation, _ = cv2.Rodrigues(rotation_vector)
+        sy = np.hypot(rotation[0, 0], rotation[1, 0])
+        yaw[i] = np.degrees(np.arctan2(-rotation[2, 0], sy))
+        # Chin coming towards the camera (looking up) is a negative rotation about x
+        pitch[i] = -np.degrees(np.arctan2(rotation[2, 1], rotation[2, 2]) if sy > 1e-6 else np.arctan2(-rotation[1, 2], rotation[1, 1]))
+    return yaw, pitch
+
+def head_pose(points, image_shape, mode=HEAD_POSE_MODE):
+    if mode == "pnp": return head_pose_pnp(points, image_shape)
+    return head_pose_ratio(points)
+
+
+# --- Gaze ---
+def _eye_ratio(points, iris, corner_a, corner_b):
+    left = np.minimum(points[:, corner_a, 0], points[:, corner_b, 0])
+    width = np.abs(points[:, corner_a, 0] - points[:, corner_b, 0])
+    safe_width = np.where(width > 0, width, 1.0)
+    return np.where(width > 0, np.clip((points[:, iris, 0] - left) / safe_width, 0.0, 1.0), 0.5)
+
+def iris_ratio(points):
+    """ (faces, N, 3) -> horizontal iris position per face, averaged over both eyes (0 = right, 1 = left). """
+    if points.shape[1] < REFINED_LANDMARK_COUNT: return np.full(len(points), 0.5) # No iris landmarks
+    left = _eye_ratio(points, LEFT_IRIS_CENTER, LEFT_EYE_OUTER, LEFT_EYE_INNER)
+    right = _eye_ratio(points, RIGHT_IRIS_CENTER, RIGHT_EYE_INNER, RIGHT_EYE_OUTER)
+    return (left + right) / 2.0
+
+def gaze_direction(ratio):
+    if ratio < GAZE_RIGHT_BELOW: return "right" # Looking right
+    if ratio > GAZE_LEFT_ABOVE: return "left" # Looking left
+    return "center"
+
+
+# --- Temporal Smoothing ---
+class FeatureSmoother:
+    """ Exponential moving average of one student's (yaw, pitch, iris ratio). """
+    __slots__ = ("alpha", "values")
+
+    def __init__(self, alpha=SMOOTHING_ALPHA):
+        self.alpha = min(1.0, max(0.0, alpha)) or 1.0
+        self.values = None
+
+    def update(self, yaw, pitch, ratio):
+        sample = np.array((yaw, pitch, ratio), dtype=np.float64)
+        if self.values is None or self.alpha >= 1.0: self.values = sample
+        else: self.values = self.values + self.alpha * (sample - self.values)
+        return tuple(float(v) for v in self.values)
+
+    def reset(self):
+        """ Called when the face is lost or others appear: the next face starts fresh. """
+        self.values = None
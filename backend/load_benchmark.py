@@ -0,0 +1,356 @@
+# backend/load_benchmark.py
+"""
+Synthetic load generator and latency benchmark for the LockIn backend.
+
+Starts server.py locally (or targets --url), then for each student count N:
+connects N simulated students (studentJoin, then video_frame at --fps from a
+corpus of sample JPEGs, optionally audio_chunk every --audio-interval seconds)
+plus --admins admin clients in admin_room. Every frame carries a sequence
+number which the server acknowledges with 'frame_ack' once the frame has been
+analysed and applied, giving an end-to-end latency per frame.
+
+Reported per step: frame latency percentiles, dropped frames (never acked),
+late frames (acked after --late-ms), admin event rates, server CPU and RSS.
+Results are written as JSON (--output) so runs can be compared across releases.
+
+Needs the `bench` extra: python-socketio[client] and psutil.
+
+    python load_benchmark.py --students 10,25,50 --admins 2 --fps 2 --duration 30 --output bench.json
+
+Note: with a single sample image every frame is identical, so change gating
+skips most inference. Point --frames at a directory of varied JPEGs, or run
+with LOCKIN_CHANGE_GATING=0, to measure full inference cost.
+"""
+import argparse
+import base64
+import datetime
+import glob
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+
+import psutil
+import socketio
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_FRAMES = os.path.join(BASE_DIR, "reference_image.jpg")
+ACK_GRACE_SECONDS = 5.0 # Wait this long after a step for outstanding acks
+
+
+def percentiles(values, points=(50, 90, 95, 99)):
+    """ Nearest-rank percentiles, plus mean/max, in the unit of `values`. """
+    if not values: return {f"p{p}": None for p in points} | {"mean": None, "max": None, "count": 0}
+    ordered = sorted(values)
+    result = {f"p{p}": round(ordered[min(len(ordered) - 1, max(0, int(round(p / 100.0 * len(ordered))) - 1))], 2) for p in points}
+    result.update({"mean": round(sum(ordered) / len(ordered), 2), "max": round(ordered[-1], 2), "count": len(ordered)})
+    return result
+
+def load_files(path, patterns):
+    if os.path.isfile(path): files = [path]
+    else: files = sorted(f for pattern in patterns for f in glob.glob(os.path.join(path, pattern)))
+    if not files: raise SystemExit(f"No input files found at {path}")
+    contents = []
+    for filename in files:
+        with open(filename, "rb") as f: contents.append(f.read())
+    return contents
+
+
+class SimulatedStudent:
+    """ One student connection: joins, streams frames with sequence numbers and records their acks. """
+
+    def __init__(self, url, student_id, frames, fps, audio_chunks, audio_interval):
+        self.url = url
+        self.student_id = student_id
+        self.frames = frames
+        self.interval = 1.0 / fps
+        self.audio_chunks = audio_chunks
+        self.audio_interval = audio_interval
+        self.client = socketio.Client(reconnection=False)
+        self.sent_at = {} # seq -> send time
+        self._acked = set()
+        self.latencies_ms = []
+        self.audio_sent = 0
+        self.capture_rate_hints = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.client.on("frame_ack", self._on_frame_ack)
+        self.client.on("capture_rate", self._on_capture_rate)
+
+    def _on_frame_ack(self, data):
+        now = time.perf_counter()
+        with self._lock:
+            seq = data.get("seq"); sent = self.sent_at.get(seq)
+            if sent is not None and seq not in self._acked:
+                self._acked.add(seq); self.latencies_ms.append((now - sent) * 1000.0)
+
+    def _on_capture_rate(self, data):
+        self.capture_rate_hints += 1
+
+    def start(self):
+        self.client.connect(self.url, transports=["websocket"])
+        self.client.emit("studentJoin", {"studentId": self.student_id})
+        self._thread = threading.Thread(target=self._run, name=f"bench-{self.student_id}", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        seq = 0
+        next_frame = time.perf_counter()
+        next_audio = next_frame + self.audio_interval if self.audio_chunks else None
+        while not self._stop.is_set():
+            now = time.perf_counter()
+            if now >= next_frame:
+                frame = self.frames[seq % len(self.frames)]
+                with self._lock: self.sent_at[seq] = time.perf_counter()
+                try: self.client.emit("video_frame", {"frame": frame, "seq": seq})
+                except Exception: self.errors += 1
+                seq += 1
+                next_frame += self.interval
+                if next_frame < now: next_frame = now + self.interval # Fell behind: don't burst
+            if next_audio is not None and now >= next_audio:
+                chunk = self.audio_chunks[self.audio_sent % len(self.audio_chunks)]
+                try:
+                    self.client.emit("audio_chunk", {"audio": base64.b64encode(chunk).decode("ascii"), "snapshot": base64.b64encode(self.frames[0]).decode("ascii")})
+                    self.audio_sent += 1
+                except Exception: self.errors += 1
+                next_audio += self.audio_interval
+            wake = min(t for t in (next_frame, next_audio) if t is not None)
+            self._stop.wait(max(0.0, wake - time.perf_counter()))
+
+    def stop_sending(self):
+        self._stop.set()
+        if self._thread: self._thread.join()
+
+    def disconnect(self):
+        try: self.client.disconnect()
+        except Exception: pass
+
+    def results(self, late_ms):
+        with self._lock:
+            sent = len(self.sent_at); acked = len(self.latencies_ms)
+            late = sum(1 for latency in self.latencies_ms if latency > late_ms)
+            return {"sent": sent, "acked": acked, "dropped": sent - acked, "late": late, "latencies_ms": list(self.latencies_ms)}
+
+
+class SimulatedAdmin:
+    """ One admin connection in admin_room, counting what the server pushes. """
+
+    def __init__(self, url):
+        self.url = url
+        self.client = socketio.Client(reconnection=False)
+        self.events = {"student_list": 0, "student_updates": 0, "new_student": 0, "student_left": 0, "new_alert": 0}
+        self.updated_students = 0
+        self.update_gaps_ms = []
+        self._last_update = None
+        for event in self.events: self.client.on(event, self._counter(event))
+
+    def _counter(self, event):
+        def handler(data=None):
+            self.events[event] += 1
+            if event == "student_updates":
+                now = time.perf_counter()
+                if self._last_update is not None: self.update_gaps_ms.append((now - self._last_update) * 1000.0)
+                self._last_update = now
+                if isinstance(data, list): self.updated_students += len(data)
+        return handler
+
+    def start(self):
+        self.client.connect(self.url, transports=["websocket"])
+        self.client.emit("adminJoin")
+
+    def disconnect(self):
+        try: self.client.disconnect()
+        except Exception: pass
+
+
+class ResourceSampler:
+    """ Samples CPU% and RSS of the server process (and its children) once per interval. """
+
+    def __init__(self, pid, interval=1.0):
+        self.root = psutil.Process(pid) if pid else None
+        self.interval = interval
+        self.cpu_percent = []
+        self.rss_mb = []
+        self._procs = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        try: procs = [self.root] + self.root.children(recursive=True)
+        except psutil.NoSuchProcess: return
+        cpu = 0.0; rss = 0
+        for proc in procs:
+            tracked = self._procs.setdefault(proc.pid, proc)
+            try: cpu += tracked.cpu_percent(None); rss += tracked.memory_info().rss
+            except psutil.NoSuchProcess: self._procs.pop(proc.pid, None)
+        self.cpu_percent.append(cpu); self.rss_mb.append(rss / (1024 * 1024))
+
+    def _run(self):
+        self._sample() # Primes cpu_percent
+        self.cpu_percent.clear(); self.rss_mb.clear()
+        while not self._stop.wait(self.interval): self._sample()
+
+    def start(self):
+        if self.root is None: return
+        self._stop.clear(); self.cpu_percent = []; self.rss_mb = []
+        self._thread = threading.Thread(target=self._run, name="bench-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None: return {}
+        self._stop.set(); self._thread.join()
+        return {
+            "cpu_percent": percentiles(self.cpu_percent, points=(50, 95)),
+            "rss_mb": {"max": round(max(self.rss_mb), 1) if self.rss_mb else None, "end": round(self.rss_mb[-1], 1) if self.rss_mb else None},
+        }
+
+
+def start_server(port, log_path):
+    env = dict(os.environ, LOCKIN_PORT=str(port), PYTHONUNBUFFERED="1")
+    log = open(log_path, "ab") if log_path else subprocess.DEVNULL
+    return subprocess.Popen([sys.executable, os.path.join(BASE_DIR, "server.py")], cwd=BASE_DIR, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+def wait_until_up(url, process, timeout):
+    """ The server listens at once and warms its models up in the background; poll /ready until it returns 200. """
+    deadline = time.time() + timeout
+    last_status = "no answer"
+    while time.time() < deadline:
+        if process is not None and process.poll() is not None: raise SystemExit(f"Server exited with code {process.returncode} during start-up")
+        try: urllib.request.urlopen(url + "/ready", timeout=2)
+        except urllib.error.HTTPError as e: last_status = f"HTTP {e.code}: {e.read(500).decode('utf-8', 'replace')}" # 503 while warming up
+        except Exception as e: last_status = str(e)
+        else: return
+        time.sleep(1.0)
+    raise SystemExit(f"Server at {url} was not ready within {timeout}s (last /ready: {last_status})")
+
+
+def run_step(args, url, step_index, n_students, frames, audio_chunks, sampler):
+    run_tag = f"bench{int(time.time())}-{step_index}"
+    admins = [SimulatedAdmin(url) for _ in range(args.admins)]
+    for admin in admins: admin.start()
+    students = [SimulatedStudent(url, f"{run_tag}-s{i}", frames, args.fps, audio_chunks, args.audio_interval) for i in range(n_students)]
+    connect_started = time.perf_counter()
+    for student in students:
+        student.start()
+        if args.ramp: time.sleep(args.ramp / max(1, n_students))
+    connect_seconds = time.perf_counter() - connect_started
+
+    sampler.start()
+    time.sleep(args.duration)
+    for student in students: student.stop_sending()
+    time.sleep(ACK_GRACE_SECONDS)
+    resources = sampler.stop()
+
+    per_student = [student.results(args.late_ms) for student in students]
+    latencies = [latency for result in per_student for latency in result["latencies_ms"]]
+    sent = sum(r["sent"] for r in per_student); acked = sum(r["acked"] for r in per_student)
+    step = {
+        "students": n_students,
+        "admins": args.admins,
+        "connect_seconds": round(connect_seconds, 2),
+        "frames": {
+            "sent": sent, "acked": acked,
+            "dropped": sent - acked, "dropped_ratio": round((sent - acked) / sent, 4) if sent else None,
+            "late": sum(r["late"] for r in per_student), "late_threshold_ms": args.late_ms,
+            "acked_per_second": round(acked / args.duration, 2),
+        },
+        "frame_latency_ms": percentiles(latencies),
+        "audio_chunks_sent": sum(s.audio_sent for s in students),
+        "capture_rate_hints": sum(s.capture_rate_hints for s in students),
+        "client_errors": sum(s.errors for s in students),
+        "admin": {
+            "events": {event: sum(a.events[event] for a in admins) for event in ("student_updates", "new_alert", "new_student", "student_left")},
+            "student_updates_gap_ms": percentiles([gap for a in admins for gap in a.update_gaps_ms], points=(50, 95)),
+            "updated_students": sum(a.updated_students for a in admins),
+        },
+        "server": resources,
+    }
+    for student in students: student.disconnect()
+    for admin in admins: admin.disconnect()
+    time.sleep(1.0) # Let the server clean up before the next step
+    return step
+
+def print_summary(steps):
+    print(f"{'students':>8} {'sent':>7} {'acked':>7} {'drop%':>6} {'late':>6} {'p50ms':>8} {'p95ms':>8} {'p99ms':>8} {'cpu%':>6} {'rssMB':>7}")
+    for step in steps:
+        frames = step["frames"]; latency = step["frame_latency_ms"]; server = step.get("server") or {}
+        drop = f"{frames['dropped_ratio'] * 100:.1f}" if frames["dropped_ratio"] is not None else "-"
+        cpu = (server.get("cpu_percent") or {}).get("mean"); rss = (server.get("rss_mb") or {}).get("max")
+        print(f"{step['students']:>8} {frames['sent']:>7} {frames['acked']:>7} {drop:>6} {frames['late']:>6} "
+              f"{latency['p50'] if latency['p50'] is not None else '-':>8} {latency['p95'] if latency['p95'] is not None else '-':>8} "
+              f"{latency['p99'] if latency['p99'] is not None else '-':>8} {cpu if cpu is not None else '-':>6} {rss if rss is not None else '-':>7}")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Multi-student load generator and latency benchmark for server.py")
+    parser.add_argument("--students", default="1,5,10,25", help="Comma-separated student counts, one step each (default: 1,5,10,25)")
+    parser.add_argument("--admins", type=int, default=1, help="Admin clients connected during each step")
+    parser.add_argument("--fps", type=float, default=1.0, help="Frames per second per student")
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds of load per step")
+    parser.add_argument("--ramp", type=float, default=2.0, help="Seconds over which students connect")
+    parser.add_argument("--late-ms", type=float, default=None, help="Acks slower than this count as late (default: one frame interval)")
+    parser.add_argument("--frames", default=DEFAULT_FRAMES, help="JPEG file or directory of JPEGs to stream")
+    parser.add_argument("--audio", default=None, help="Audio chunk file or directory (webm/ogg/wav); enables audio_chunk events")
+    parser.add_argument("--audio-interval", type=float, default=10.0, help="Seconds between audio chunks per student")
+    parser.add_argument("--url", default=None, help="Target a running server instead of starting one")
+    parser.add_argument("--server-pid", type=int, default=None, help="PID to sample CPU/RSS from when using --url")
+    parser.add_argument("--port", type=int, default=8765, help="Port for the locally started server")
+    parser.add_argument("--startup-timeout", type=float, default=300.0, help="Seconds to wait for model loading at start-up")
+    parser.add_argument("--server-log", default=None, help="Write the started server's output to this file")
+    parser.add_argument("--output", default=None, help="Write JSON results to this file (default: stdout only)")
+    args = parser.parse_args()
+    if args.late_ms is None: args.late_ms = 1000.0 / args.fps
+    return args
+
+def main():
+    args = parse_args()
+    student_counts = [int(n) for n in args.students.split(",") if n.strip()]
+    frames = load_files(args.frames, ("*.jpg", "*.jpeg"))
+    audio_chunks = load_files(args.audio, ("*.webm", "*.ogg", "*.wav")) if args.audio else []
+
+    server = None
+    if args.url: url = args.url.rstrip("/"); pid = args.server_pid
+    else:
+        url = f"http://127.0.0.1:{args.port}"
+        server = start_server(args.port, args.server_log); pid = server.pid
+    try:
+        started = time.time()
+        wait_until_up(url, server, args.startup_timeout)
+        startup_seconds = round(time.time() - started, 1)
+        print(f"Server ready at {url} (waited {startup_seconds}s). Running steps: {student_counts}")
+        sampler = ResourceSampler(pid)
+        steps = []
+        for index, n_students in enumerate(student_counts):
+            print(f"--- Step {index + 1}/{len(student_counts)}: {n_students} students, {args.admins} admins, {args.fps} fps, {args.duration}s ---")
+            steps.append(run_step(args, url, index, n_students, frames, audio_chunks, sampler))
+    finally:
+        if server is not None:
+            server.terminate()
+            try: server.wait(timeout=10)
+            except subprocess.TimeoutExpired: server.kill()
+
+    report = {
+        "meta": {
+            "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+            "url": url, "started_server": server is not None, "startup_seconds": startup_seconds,
+            "fps": args.fps, "duration_seconds": args.duration, "admins": args.admins,
+            "frame_files": len(frames), "audio_files": len(audio_chunks), "audio_interval_seconds": args.audio_interval if audio_chunks else None,
+            "python": sys.version.split()[0], "cpu_count": psutil.cpu_count(),
+            "env": {key: value for key, value in os.environ.items() if key.startswith("LOCKIN_")},
+        },
+        "steps": steps,
+    }
+    print_summary(steps)
+    if args.output:
+        with open(args.output, "w") as f: json.dump(report, f, indent=2)
+        print(f"Results written to {args.output}")
+    else: print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
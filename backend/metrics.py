@@ -0,0 +1,161 @@
+# backend/metrics.py
+"""
+Minimal in-process metrics, rendered in the Prometheus text exposition format.
+
+Histograms and counters are updated on the hot path (from the eventlet hub
+and from native worker threads alike). Gauges are callbacks read at scrape
+time, so they never go stale and cost nothing between scrapes. server.py
+serves `registry.render()` on /metrics.
+"""
+import time
+from contextlib import contextmanager
+from native_threading import threading # Observed from analysis / audio worker threads
+from async_logging import get_logger
+
+log = get_logger("metrics")
+
+# Seconds; spans cheap decodes (~1 ms) up to slow DeepFace/ASR calls
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(labelnames, labelvalues, extra=None):
+    pairs = list(zip(labelnames, labelvalues))
+    if extra: pairs.append(extra)
+    if not pairs: return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+def _format_value(value):
+    if value == float("inf"): return "+Inf"
+    if isinstance(value, float) and value.is_integer(): return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """ Monotonic counter, optionally labelled. """
+    metric_type = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name; self.documentation = documentation; self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self._lock: self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock: values = dict(self._values)
+        return [(self.name + _format_labels(self.labelnames, key), value) for key, value in sorted(values.items())]
+
+
+class Histogram:
+    """ Cumulative-bucket histogram, optionally labelled. """
+    metric_type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name; self.documentation = documentation; self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {} # labels -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None: series = self._series[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound: series[i] += 1; break # Stored per bucket, made cumulative when rendered
+            series[-2] += value; series[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try: yield
+        finally: self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self):
+        with self._lock: series_by_key = {key: list(series) for key, series in self._series.items()}
+        lines = []
+        for key, series in sorted(series_by_key.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series[:len(self.buckets)] + [series[-1] - sum(series[:len(self.buckets)])]):
+                cumulative += count
+                lines.append((self.name + "_bucket" + _format_labels(self.labelnames, key, ("le", _format_value(float(bound)))), cumulative))
+            lines.append((self.name + "_sum" + _format_labels(self.labelnames, key), series[-2]))
+            lines.append((self.name + "_count" + _format_labels(self.labelnames, key), series[-1]))
+        return lines
+
+
+class CallbackMetric:
+    """
+    Gauge (or counter) read from a callback at scrape time. The callback returns
+    a number, or a dict {label value (or tuple of values): number} for labelled series.
+    """
+
+    def __init__(self, name, documentation, fn, labelnames=(), metric_type="gauge"):
+        self.name = name; self.documentation = documentation; self.fn = fn
+        self.labelnames = tuple(labelnames); self.metric_type = metric_type
+
+    def samples(self):
+        value = self.fn()
+        if not isinstance(value, dict): return [(self.name, value)]
+        return [(self.name + _format_labels(self.labelnames, key if isinstance(key, tuple) else (key,)), v) for key, v in sorted(value.items())]
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics: raise ValueError(f"Metric '{metric.name}' is already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def gauge_callback(self, name, documentation, fn, labelnames=()):
+        return self._register(CallbackMetric(name, documentation, fn, labelnames, "gauge"))
+
+    def counter_callback(self, name, documentation, fn, labelnames=()):
+        return self._register(CallbackMetric(name, documentation, fn, labelnames, "counter"))
+
+    def render(self):
+        """ All metrics in Prometheus text format (version 0.0.4). """
+        with self._lock: metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            try: samples = metric.samples()
+            except Exception as e:
+                log.warning(f"[Metrics]: Could not collect {metric.name}: {e}")
+                continue
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.metric_type}")
+            lines.extend(f"{series} {_format_value(value)}" for series, value in samples)
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+# --- Hot-path instrumentation shared by all modules ---
+STAGE_SECONDS = registry.histogram("lockin_stage_duration_seconds", "Time spent in each processing stage.", ["stage"])
+EVENTS = registry.counter("lockin_events_total", "Processed events by type and outcome.", ["event", "outcome"])
+YOLO_BATCH_SIZE = registry.histogram("lockin_yolo_batch_size", "Frames per YOLOv5 forward pass.", buckets=(1, 2, 4, 8, 16, 32, 64))
+
+def time_stage(stage):
+    """ Context manager timing one stage: `with metrics.time_stage("face_mesh"): ...` """
+    return STAGE_SECONDS.time(stage=stage)
+
+def observe_stage(stage, seconds):
+    STAGE_SECONDS.observe(seconds, stage=stage)
+
+def count_event(event, outcome="ok"):
+    EVENTS.inc(event=event, outcome=outcome)
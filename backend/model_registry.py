@@ -0,0 +1,120 @@
+# backend/model_registry.py
+"""
+Lazily loaded, warmable ML models.
+
+Modules register their heavy models here instead of loading them at import:
+
+    models.register("yolo", phone_detectors.create_detector, warmup=lambda detector: ...)
+    detector = models.get("yolo") # Loads on first use, then cached
+
+Importing server.py therefore no longer pays for TensorFlow, PyTorch or
+MediaPipe. The server warms every component up in a background thread at
+start-up: it loads the model, then runs one dummy inference, so the first
+student frame (or verification) does not pay for lazy initialisation. /ready
+reports each component's state so an orchestrator only routes students to
+nodes that have finished warming up.
+
+A component that fails to load stays failed and is reported as such; callers
+get ModelUnavailable, as they got a None model before.
+"""
+import time
+from native_threading import threading # Loaders run on warm-up and analysis worker threads
+from async_logging import get_logger
+
+log = get_logger("models")
+
+COLD, LOADING, READY, FAILED = "cold", "loading", "ready", "failed"
+
+
+class ModelUnavailable(Exception):
+    """ The model failed to load; `get()` re-raises this for every caller. """
+
+
+class ModelComponent:
+    """ One model: loaded once, by whichever thread asks first, then warmed up with a dummy inference. """
+
+    def __init__(self, name, loader, warmup=None):
+        self.name = name
+        self.loader = loader
+        self.warmup = warmup
+        self.state = COLD
+        self.error = None
+        self.load_seconds = None
+        self.warmup_seconds = None
+        self._value = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        if self.state == READY: return self._value
+        with self._lock: # Concurrent callers wait for the one load
+            if self.state == COLD: self._load()
+        if self.state == FAILED: raise ModelUnavailable(f"{self.name} failed to load: {self.error}")
+        return self._value
+
+    def _load(self):
+        self.state = LOADING
+        started = time.perf_counter()
+        log.info(f"[Models]: Loading {self.name}...")
+        try:
+            value = self.loader()
+            self.load_seconds = time.perf_counter() - started
+        except Exception as e:
+            self.state, self.error = FAILED, f"{type(e).__name__}: {e}"
+            log.error(f"[Models]: Could not load {self.name}: {self.error}")
+            return
+        if self.warmup is not None:
+            started = time.perf_counter()
+            try: self.warmup(value)
+            except Exception as e: log.warning(f"[Models]: Warm-up inference for {self.name} failed (model stays usable): {e}")
+            self.warmup_seconds = time.perf_counter() - started
+        self._value = value
+        self.state = READY
+        log.info(f"[Models]: {self.name} ready (load {self.load_seconds:.1f}s, warm-up {self.warmup_seconds or 0.0:.1f}s).")
+
+    def status(self):
+        status = {"state": self.state}
+        if self.load_seconds is not None: status["load_seconds"] = round(self.load_seconds, 3)
+        if self.warmup_seconds is not None: status["warmup_seconds"] = round(self.warmup_seconds, 3)
+        if self.error: status["error"] = self.error
+        return status
+
+
+class ModelRegistry:
+    def __init__(self):
+        self._components = {}
+        self._warmup_thread = None
+        self._lock = threading.Lock()
+
+    def register(self, name, loader, warmup=None):
+        with self._lock:
+            if name in self._components: raise ValueError(f"Model '{name}' is already registered")
+            component = self._components[name] = ModelComponent(name, loader, warmup)
+        return component
+
+    def get(self, name):
+        """ The loaded model; loads (and warms) it on first use. Raises ModelUnavailable. """
+        return self._components[name].get()
+
+    def warm_up(self):
+        """ Loads every registered model in turn, in the calling thread. """
+        with self._lock: components = list(self._components.values())
+        for component in components:
+            try: component.get()
+            except ModelUnavailable: pass # Logged and reported by /ready
+
+    def warm_up_in_background(self):
+        """ Starts warm_up() on a native thread (idempotent). """
+        with self._lock:
+            if self._warmup_thread is not None: return
+            self._warmup_thread = threading.Thread(target=self.warm_up, name="model-warmup", daemon=True)
+        self._warmup_thread.start()
+
+    def status(self):
+        with self._lock: components = list(self._components.values())
+        return {component.name: component.status() for component in components}
+
+    def ready(self):
+        return all(status["state"] == READY for status in self.status().values())
+
+
+models = ModelRegistry()
@@ -0,0 +1,18 @@
+# backend/native_threading.py
+"""
+Real OS-thread primitives that survive eventlet.monkey_patch().
+
+server.py patches `threading`, `queue` and `subprocess` with green versions. Code that runs
+inside eventlet's tpool, or in its own worker threads, must block on these
+native primitives instead, otherwise it would park a green thread on a hub
+that nothing ever wakes.
+"""
+try:
+    from eventlet.patcher import original
+    threading = original('threading')
+    queue = original('queue')
+    subprocess = original('subprocess')
+except ImportError: # Running without eventlet (scripts, notebooks)
+    import threading
+    import queue
+    import subprocess
@@ -1,34 +1,170 @@
 # backend/phone_detection.py
-import torch
 import cv2
 import numpy as np
 import time
+import os
+from native_threading import threading, queue # Batcher is driven from analysis worker threads
+import metrics
+import phone_detectors # YOLOv5 engines: ONNX Runtime (optionally int8) or torch.hub
+from model_registry import models, ModelUnavailable # Lazy loading + warm-up
+from async_logging import get_logger
+
+log = get_logger("phone")
 
 # --- Per-Student State Management ---
 student_phone_states = {} # Dictionary to hold state for each student
 
-# --- YOLOv5 Initialization (Global) ---
-try:
-    # Load YOLOv5 model (downloads weights on first run)
-    yolo_model = torch.hub.load('ultralytics/yolov5', 'yolov5s', pretrained=True)
-    # Set to evaluation mode
-    yolo_model.eval()
-    print("YOLOv5 model loaded successfully.")
-except Exception as e:
-    print(f"ERROR: Could not initialize YOLOv5 model: {e}")
-    yolo_model = None
+# --- YOLOv5 Initialization (lazy, see model_registry) ---
+def _load_yolo():
+    detector = phone_detectors.create_detector() # LOCKIN_PHONE_DETECTOR picks the engine
+    log.info(f"YOLOv5 model loaded successfully ({detector.name} engine, input {detector.input_size}).")
+    return detector
+
+def _warm_up_yolo(detector):
+    detector.detect_batch([np.zeros((240, 320, 3), dtype=np.uint8)], CONFIDENCE_THRESHOLD)
+
+models.register("yolo", _load_yolo, warmup=_warm_up_yolo)
 
 # --- Constants ---
 # Timer to only trigger a major alert if a phone is visible for > X seconds
 PHONE_ALERT_THRESHOLD_SECONDS = 1.0
 # Confidence threshold for detection
 CONFIDENCE_THRESHOLD = 0.3
+# Cross-student batching: frames are collected for up to BATCH_WINDOW_SECONDS
+# (or until BATCH_MAX_SIZE frames are waiting) and run as one YOLOv5 forward pass
+BATCHING_ENABLED = os.environ.get("LOCKIN_PHONE_BATCHING", "1") != "0"
+BATCH_WINDOW_SECONDS = float(os.environ.get("LOCKIN_PHONE_BATCH_WINDOW", "0.05"))
+BATCH_MAX_SIZE = int(os.environ.get("LOCKIN_PHONE_BATCH_MAX", "16"))
+# A frame whose batch has not come back within this long gets no phone result (the analysis thread moves on)
+BATCH_TIMEOUT_SECONDS = float(os.environ.get("LOCKIN_PHONE_BATCH_TIMEOUT", "5"))
+# Detect-then-track: while phones are visible, changed frames only re-detect inside an enlarged
+# region around the last boxes; a full-frame pass still runs every FULL_DETECT_EVERY frames
+TRACKING_ENABLED = os.environ.get("LOCKIN_PHONE_TRACKING", "1") != "0"
+FULL_DETECT_EVERY = int(os.environ.get("LOCKIN_PHONE_FULL_EVERY", "5"))
+ROI_MARGIN = float(os.environ.get("LOCKIN_PHONE_ROI_MARGIN", "0.5")) # Of the boxes' size, on each side
+ROI_INPUT_SIZE = int(os.environ.get("LOCKIN_PHONE_ROI_INPUT_SIZE", "256"))
+ROI_MIN_SIDE = 64 # Pixels; tiny boxes still get some context
+
+# --- Inference Helpers ---
+def detect_phones_batch(images_rgb):
+    """
+    Runs YOLOv5 once over a list of RGB frames.
+    Returns a list (one entry per frame) of phone boxes [[x1, y1, x2, y2], ...].
+    """
+    yolo_model = models.get("yolo")
+    with metrics.time_stage("yolo_forward"):
+        boxes_per_image = yolo_model.detect_batch(list(images_rgb), CONFIDENCE_THRESHOLD)
+    metrics.YOLO_BATCH_SIZE.observe(len(images_rgb))
+    return boxes_per_image
+
+
+def phone_roi(phone_boxes, image_shape, margin=ROI_MARGIN):
+    """ Enlarged region (x1, y1, x2, y2) around all previous phone boxes, clamped to the frame. """
+    height, width = image_shape[:2]
+    x1, y1 = min(b[0] for b in phone_boxes), min(b[1] for b in phone_boxes)
+    x2, y2 = max(b[2] for b in phone_boxes), max(b[3] for b in phone_boxes)
+    grow_x = max((x2 - x1) * margin, (ROI_MIN_SIDE - (x2 - x1)) / 2.0)
+    grow_y = max((y2 - y1) * margin, (ROI_MIN_SIDE - (y2 - y1)) / 2.0)
+    return (max(0, int(x1 - grow_x)), max(0, int(y1 - grow_y)), min(width, int(x2 + grow_x)), min(height, int(y2 + grow_y)))
+
+def redetect_in_roi(image_rgb, phone_boxes):
+    """
+    Re-runs YOLOv5 on the crop around the previous phone boxes, at a small input size.
+    Returns phone boxes in frame coordinates ([] when the phone is no longer in the region).
+    """
+    x1, y1, x2, y2 = phone_roi(phone_boxes, image_rgb.shape)
+    if x2 - x1 < 2 or y2 - y1 < 2: return []
+    with metrics.time_stage("yolo_roi"):
+        boxes = models.get("yolo").detect_batch([image_rgb[y1:y2, x1:x2]], CONFIDENCE_THRESHOLD, input_size=ROI_INPUT_SIZE)[0]
+    return [[bx1 + x1, by1 + y1, bx2 + x1, by2 + y1] for bx1, by1, bx2, by2 in boxes]
+
+
+class _PendingFrame:
+    """ A frame waiting in the batcher, plus the slot its result is delivered to. """
+    __slots__ = ("image_rgb", "student_id", "done", "phone_boxes", "error", "abandoned")
+
+    def __init__(self, image_rgb, student_id):
+        self.image_rgb = image_rgb
+        self.student_id = student_id
+        self.done = threading.Event()
+        self.phone_boxes = None
+        self.error = None
+        self.abandoned = False # Caller timed out; skipped if its batch has not started yet
+
+
+class PhoneDetectionBatcher:
+    """
+    Collects frames from many students and runs them through YOLOv5 as one batch.
+    A batch is flushed when `window_seconds` have passed since its first frame
+    arrived, or as soon as `max_batch_size` frames are waiting.
+    """
+
+    def __init__(self, window_seconds=BATCH_WINDOW_SECONDS, max_batch_size=BATCH_MAX_SIZE, timeout_seconds=BATCH_TIMEOUT_SECONDS):
+        self.window_seconds = window_seconds
+        self.max_batch_size = max(1, max_batch_size)
+        self.timeout_seconds = timeout_seconds
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self.batches_run = 0
+        self.frames_run = 0
+        self.timeouts = 0
+
+    def _ensure_started(self):
+        if self._thread is not None: return
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="phone-batcher", daemon=True)
+                self._thread.start()
+
+    def detect(self, image_rgb, student_id):
+        """ Queues one frame and waits for its batch. Returns phone boxes, or None if the batch did not finish in time. """
+        self._ensure_started()
+        pending = _PendingFrame(image_rgb, student_id)
+        self._queue.put(pending)
+        if not pending.done.wait(self.timeout_seconds):
+            pending.abandoned = True; self.timeouts += 1
+            log.warning("[Phone Batch]: No result for %s within %.1fs.", student_id, self.timeout_seconds, student_id=student_id)
+            return None
+        if pending.error is not None: raise pending.error
+        return pending.phone_boxes
+
+    def _collect_batch(self):
+        batch = [self._queue.get()] # Block until the first frame arrives
+        deadline = time.time() + self.window_seconds
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.time()
+            if remaining <= 0: break
+            try: batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty: break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = [pending for pending in self._collect_batch() if not pending.abandoned]
+            if not batch: continue
+            try:
+                boxes_per_image = detect_phones_batch([p.image_rgb for p in batch])
+                for pending, phone_boxes in zip(batch, boxes_per_image):
+                    pending.phone_boxes = phone_boxes
+                self.batches_run += 1; self.frames_run += len(batch)
+            except Exception as e:
+                log.error(f"[Phone Batch]: Batched inference failed for {len(batch)} frames: {e}")
+                for pending in batch: pending.error = e
+            finally:
+                for pending in batch: pending.done.set()
+
+
+phone_batcher = PhoneDetectionBatcher() if BATCHING_ENABLED else None
 
 # --- Main Analysis Function ---
-def analyze_phone_frame(image_bgr, student_id):
+def analyze_phone_frame(image_bgr, student_id, reuse_last_results=False):
     """
     Analyzes a single BGR frame for cell phones, manages state (incl. timers),
-    and returns an analysis dictionary.
+    and returns an analysis dictionary. With reuse_last_results=True (frame
+    unchanged), the previous detections are reused and only the timers advance.
+    While a phone is tracked, most changed frames only re-detect it in an
+    enlarged region around its last box (see redetect_in_roi).
 
     Returns dict: {
         "status": str, 
@@ -38,18 +174,20 @@ def analyze_phone_frame(image_bgr, student_id):
     }
     """
     global student_phone_states
-    global yolo_model
 
     # --- 1. Get/Initialize State ---
     if student_id not in student_phone_states:
         student_phone_states[student_id] = {
             "phone_detected_start_time": None,
-            "phone_alerted": False
+            "phone_alerted": False,
+            "last_phone_boxes": None, # Detections from the last fully analysed frame
+            "frames_since_full": 0 # Frames answered from the ROI since the last full-frame pass
         }
     state = student_phone_states[student_id] # Use reference
 
     # --- 2. Basic Image Processing & Model Check ---
-    if yolo_model is None:
+    try: models.get("yolo") # Loads on first use unless warm-up already did
+    except ModelUnavailable:
         return {
             "status": "ERROR: YOLOv5 Failed", 
             "score_penalty": 100, 
@@ -57,32 +195,31 @@ def analyze_phone_frame(image_bgr, student_id):
             "phone_boxes": []
         }
 
-    # Convert BGR (OpenCV default) to RGB (YOLOv5/PIL default)
-    image_rgb = cv2.cvtColor(image_bgr, cv2.COLOR_BGR2RGB)
-    
-    # Run inference
-    # We run in a 'with' block for efficiency
-    with torch.no_grad():
-        results = yolo_model(image_rgb, size=640)
-
-    # --- 3. Parse Results ---
-    phone_detected_this_frame = False
-    phone_boxes = []
-    
-    # results.xyxy[0] contains [x1, y1, x2, y2, confidence, class_id]
-    predictions = results.xyxy[0].cpu().numpy()
-    names = results.names # Get class names
-
-    for pred in predictions:
-        confidence = pred[4]
-        class_id = int(pred[5])
-        class_name = names[class_id]
-
-        if class_name == "cell phone" and confidence > CONFIDENCE_THRESHOLD:
-            phone_detected_this_frame = True
-            # Get box coordinates as integers
-            box = list(map(int, pred[:4]))
-            phone_boxes.append(box)
+    # --- 3. Run Inference (batched across students when enabled) ---
+    if reuse_last_results and state["last_phone_boxes"] is not None:
+        phone_boxes = state["last_phone_boxes"] # Frame unchanged, skip YOLOv5
+    else:
+        # Convert BGR (OpenCV default) to RGB (YOLOv5/PIL default)
+        with metrics.time_stage("cvtcolor"): image_rgb = cv2.cvtColor(image_bgr, cv2.COLOR_BGR2RGB)
+        phone_boxes = None
+        if TRACKING_ENABLED and state["last_phone_boxes"] and state["frames_since_full"] < FULL_DETECT_EVERY - 1:
+            # A phone is being tracked: look for it again around where it was
+            phone_boxes = redetect_in_roi(image_rgb, state["last_phone_boxes"])
+            metrics.count_event("phone_detect", "roi" if phone_boxes else "roi_miss")
+            if phone_boxes: state["frames_since_full"] += 1
+            else: phone_boxes = None # Lost it: it may have moved, so check the whole frame
+        if phone_boxes is None:
+            if phone_batcher is not None:
+                phone_boxes = phone_batcher.detect(image_rgb, student_id)
+                if phone_boxes is None: # Batch timed out: no phone result this frame, timers left as they are
+                    metrics.count_event("phone_detect", "timeout")
+                    return {"status": "No Phone", "score_penalty": 0, "alert": None, "phone_boxes": []}
+            else:
+                phone_boxes = detect_phones_batch([image_rgb])[0]
+            state["frames_since_full"] = 0
+            metrics.count_event("phone_detect", "full")
+        state["last_phone_boxes"] = phone_boxes
+    phone_detected_this_frame = len(phone_boxes) > 0
 
     # --- 4. State Machine Logic ---
     alert = None
@@ -96,14 +233,14 @@ def analyze_phone_frame(image_bgr, student_id):
             state["phone_detected_start_time"] = time.time()
             state["phone_alerted"] = False
             status = "Phone Detected (Pending)"
-            print(f"[{student_id}] Phone detected - timer started.")
+            log.info("[%s] Phone detected - timer started.", student_id, student_id=student_id)
         else:
             # Timer is already running, check if it's past the threshold
             elapsed_time = time.time() - state["phone_detected_start_time"]
             
             if elapsed_time > PHONE_ALERT_THRESHOLD_SECONDS and not state["phone_alerted"]:
                 # Timer exceeded, trigger the main alert
-                print(f"[{student_id}] Exceeded {PHONE_ALERT_THRESHOLD_SECONDS}s phone threshold.")
+                log.info("[%s] Exceeded %ss phone threshold.", student_id, PHONE_ALERT_THRESHOLD_SECONDS, student_id=student_id)
                 status = "CRITICAL: Phone Detected"
                 alert = f"Phone Detected."
                 score_penalty = 25 # Assign a penalty
@@ -119,7 +256,7 @@ def analyze_phone_frame(image_bgr, student_id):
         # No phone is visible in this frame
         if state["phone_detected_start_time"] is not None:
             # Phone was visible, but now it's gone. Reset.
-            print(f"[{student_id}] Phone no longer detected - resetting timer.")
+            log.info("[%s] Phone no longer detected - resetting timer.", student_id, student_id=student_id)
         
         state["phone_detected_start_time"] = None
         state["phone_alerted"] = False
@@ -141,4 +278,4 @@ def remove_student_phone_state(student_id):
     global student_phone_states
     if student_id in student_phone_states:
         del student_phone_states[student_id]
-        print(f"Removed phone detection state for disconnected student {student_id}")
\ No newline at end of file
+        log.info(f"Removed phone detection state for disconnected student {student_id}")
\ No newline at end of file
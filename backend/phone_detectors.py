@@ -0,0 +1,164 @@
+# backend/phone_detectors.py
+"""
+Pluggable YOLOv5 engines for phone_detection.
+
+Each detector takes a list of RGB frames and returns, per frame, the boxes
+[[x1, y1, x2, y2], ...] of the cell phones found, in frame pixels. An
+`input_size` override lets small ROI crops run at a smaller input.
+
+- "onnx": ONNX Runtime on CPU (the `onnx` extra) with a YOLOv5 ONNX export kept
+  on local disk; no network and no PyTorch at run time. Optionally quantized to
+  int8 once, with the quantized model cached next to the original. Only the
+  `cell phone` class is decoded; everything else is dropped before NMS.
+- "torch": the original torch.hub YOLOv5 (AutoShape). Loads local weights when
+  LOCKIN_YOLO_WEIGHTS points at a .pt file; otherwise pulls yolov5s from the hub.
+
+Export the ONNX model once, from an ultralytics/yolov5 checkout:
+    python export.py --weights yolov5s.pt --include onnx --imgsz 416 --dynamic
+"""
+import os
+import numpy as np
+from async_logging import get_logger
+
+log = get_logger("yolo")
+
+# --- Configuration ---
+_BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+# "auto" (onnx when onnxruntime and the model file are present, else torch), "onnx" or "torch"
+DETECTOR_BACKEND = os.environ.get("LOCKIN_PHONE_DETECTOR", "auto").lower()
+ONNX_MODEL_PATH = os.environ.get("LOCKIN_YOLO_ONNX", os.path.join(_BACKEND_DIR, "models", "yolov5s.onnx"))
+TORCH_WEIGHTS_PATH = os.environ.get("LOCKIN_YOLO_WEIGHTS", "") # Local .pt; empty = hub yolov5s
+ONNX_INT8 = os.environ.get("LOCKIN_YOLO_INT8", "0") == "1"
+# Letterboxed input side; 320 or 416 is much cheaper than 640 for webcam-sized frames
+INPUT_SIZE = int(os.environ.get("LOCKIN_YOLO_INPUT_SIZE", "640"))
+ONNX_THREADS = int(os.environ.get("LOCKIN_YOLO_THREADS", "0")) # 0 = ONNX Runtime default
+PHONE_CLASS_ID = 67 # "cell phone" in the COCO classes YOLOv5 is trained on
+NMS_IOU_THRESHOLD = 0.45
+
+
+class DetectorUnavailable(Exception):
+    """ The requested engine could not be loaded (package or model file missing). """
+
+
+class TorchHubDetector:
+    """ YOLOv5 through torch.hub's AutoShape wrapper (letterboxing and NMS inside). """
+    name = "torch"
+
+    def __init__(self, input_size=INPUT_SIZE, weights_path=TORCH_WEIGHTS_PATH):
+        try:
+            import torch
+        except ImportError as e:
+            raise DetectorUnavailable("torch is not installed") from e
+        self._torch = torch
+        self.input_size = input_size
+        if weights_path and os.path.exists(weights_path):
+            self.model = torch.hub.load('ultralytics/yolov5', 'custom', path=weights_path)
+        else:
+            # Load YOLOv5 model (downloads weights on first run)
+            self.model = torch.hub.load('ultralytics/yolov5', 'yolov5s', pretrained=True)
+        self.model.eval()
+        self.phone_class_ids = {i for i, class_name in self.model.names.items() if class_name == "cell phone"} if isinstance(self.model.names, dict) \
+            else {i for i, class_name in enumerate(self.model.names) if class_name == "cell phone"}
+
+    def detect_batch(self, images_rgb, confidence_threshold, input_size=None):
+        with self._torch.no_grad():
+            results = self.model(list(images_rgb), size=input_size or self.input_size)
+        boxes_per_image = []
+        # results.xyxy[i] contains [x1, y1, x2, y2, confidence, class_id] for image i
+        for image_predictions in results.xyxy:
+            predictions = image_predictions.cpu().numpy()
+            keep = np.isin(predictions[:, 5].astype(int), list(self.phone_class_ids)) & (predictions[:, 4] > confidence_threshold)
+            boxes_per_image.append([list(map(int, pred[:4])) for pred in predictions[keep]])
+        return boxes_per_image
+
+
+class OnnxDetector:
+    """ YOLOv5 ONNX export on ONNX Runtime's CPU provider, with our own letterbox and phone-only decode. """
+    name = "onnx"
+
+    def __init__(self, model_path=ONNX_MODEL_PATH, input_size=INPUT_SIZE, int8=ONNX_INT8, threads=ONNX_THREADS):
+        try:
+            import onnxruntime as ort
+        except ImportError as e:
+            raise DetectorUnavailable("onnxruntime is not installed (pip install onnxruntime)") from e
+        if not os.path.exists(model_path): raise DetectorUnavailable(f"ONNX model not found at {model_path}")
+        if int8: model_path = self._quantized(model_path)
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads > 0: options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(model_path, sess_options=options, providers=["CPUExecutionProvider"])
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        batch_dim, _, height_dim, width_dim = model_input.shape
+        # A static export fixes the input size (and usually batch 1); a --dynamic one takes ours
+        self.dynamic_size = not isinstance(height_dim, int)
+        self.input_size = input_size if self.dynamic_size else height_dim
+        self.max_batch = batch_dim if isinstance(batch_dim, int) else None
+        self.model_path = model_path
+        log.info(f"[YOLO]: ONNX Runtime detector loaded from {model_path} (input {self.input_size}, batch {self.max_batch or 'dynamic'}).")
+
+    @staticmethod
+    def _quantized(model_path):
+        """ Dynamic int8 quantization, done once and cached as <model>.int8.onnx. """
+        quantized_path = os.path.splitext(model_path)[0] + ".int8.onnx"
+        if not os.path.exists(quantized_path):
+            from onnxruntime.quantization import quantize_dynamic, QuantType
+            log.info(f"[YOLO]: Quantizing {model_path} to int8 (one-off)...")
+            temp_path = f"{quantized_path}.{os.getpid()}.part"
+            quantize_dynamic(model_path, temp_path, weight_type=QuantType.QUInt8)
+            os.replace(temp_path, quantized_path)
+        return quantized_path
+
+    def _letterbox(self, image_rgb, size):
+        """ Resize keeping aspect ratio and pad to a square input. Returns (CHW float32, scale, pad_x, pad_y). """
+        import cv2
+        height, width = image_rgb.shape[:2]
+        scale = min(size / height, size / width)
+        new_w, new_h = int(round(width * scale)), int(round(height * scale))
+        pad_x, pad_y = (size - new_w) // 2, (size - new_h) // 2
+        canvas = np.full((size, size, 3), 114, dtype=np.uint8) # YOLOv5's grey padding
+        canvas[pad_y:pad_y + new_h, pad_x:pad_x + new_w] = cv2.resize(image_rgb, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+        return canvas.transpose(2, 0, 1).astype(np.float32) / 255.0, scale, pad_x, pad_y
+
+    def _decode(self, predictions, scale, pad_x, pad_y, image_shape, confidence_threshold):
+        """ One image's raw output (N, 5 + classes) -> phone boxes in frame pixels. """
+        import cv2
+        scores = predictions[:, 4] * predictions[:, 5 + PHONE_CLASS_ID] # objectness x phone class probability
+        candidates = predictions[scores > confidence_threshold]
+        if not len(candidates): return []
+        scores = scores[scores > confidence_threshold]
+        xywh = candidates[:, :4].copy()
+        xywh[:, 0] -= xywh[:, 2] / 2; xywh[:, 1] -= xywh[:, 3] / 2 # Center -> top-left
+        keep = cv2.dnn.NMSBoxes(xywh.tolist(), scores.tolist(), confidence_threshold, NMS_IOU_THRESHOLD)
+        height, width = image_shape[:2]
+        boxes = []
+        for i in np.array(keep).reshape(-1):
+            x, y, w, h = xywh[i]
+            x1, y1 = (x - pad_x) / scale, (y - pad_y) / scale
+            x2, y2 = x1 + w / scale, y1 + h / scale
+            boxes.append([int(np.clip(x1, 0, width)), int(np.clip(y1, 0, height)), int(np.clip(x2, 0, width)), int(np.clip(y2, 0, height))])
+        return boxes
+
+    def detect_batch(self, images_rgb, confidence_threshold, input_size=None):
+        size = input_size if input_size and self.dynamic_size else self.input_size
+        prepared = [self._letterbox(image, size) for image in images_rgb]
+        step = self.max_batch or len(prepared)
+        boxes_per_image = []
+        for start in range(0, len(prepared), step):
+            chunk = prepared[start:start + step]
+            outputs = self.session.run(None, {self.input_name: np.stack([tensor for tensor, _, _, _ in chunk])})[0]
+            for (_, scale, pad_x, pad_y), predictions, image in zip(chunk, outputs, images_rgb[start:start + step]):
+                boxes_per_image.append(self._decode(predictions, scale, pad_x, pad_y, image.shape, confidence_threshold))
+        return boxes_per_image
+
+
+def create_detector(requested=DETECTOR_BACKEND):
+    """ Builds the configured engine. "auto" prefers ONNX Runtime and falls back to torch.hub. """
+    if requested == "onnx": return OnnxDetector()
+    if requested == "torch": return TorchHubDetector()
+    if requested != "auto": raise ValueError(f"Unknown LOCKIN_PHONE_DETECTOR '{requested}' (expected onnx, torch or auto)")
+    try:
+        return OnnxDetector()
+    except DetectorUnavailable as e:
+        log.info(f"[YOLO]: ONNX detector unavailable ({e}); using torch.hub YOLOv5.")
+        return TorchHubDetector()
@@ -0,0 +1,156 @@
+# backend/risk_scoring.py
+"""
+Keyword/pattern risk scoring for audio transcripts.
+
+The lexicon is compiled once at import time:
+- KEYWORDS becomes one word-bounded alternation, so a transcript is scanned
+  once instead of once per keyword.
+- PATTERNS are compiled once and reused.
+
+StreamingRiskScorer keeps a short per-student context from the preceding
+chunk transcripts. A phrase split across the chunk boundary (e.g. "what is
+the" | "answer") still scores, and nothing is counted twice.
+score_batch / score_session score many transcripts at once for post-exam review.
+"""
+import re
+import time
+from collections import deque
+from native_threading import threading # Scorers are called from audio worker threads
+
+# --- Scoring thresholds ---
+SUSPICION_THRESHOLD = 12
+CRITICAL_THRESHOLD = 25
+QUESTION_BONUS = 5
+
+# --- Lexicon ---
+KEYWORDS = {
+    "answer": 10, "answers": 10, "solution": 10, "solutions": 10,
+    "question": 7, "help": 7, "tell": 7, "google": 7, "search": 7,
+    "phone": 7, "calculator": 7, "chatgpt": 7, "gpt": 7,
+    "test": 5, "exam": 5, "quiz": 5, "option": 5, "choice": 5,
+    "select": 5, "calculate": 5, "solve": 5,
+    "what": 3, "how": 3, "why": 3, "send": 3, "give": 3,
+    "show": 3, "find": 3, "check": 3, "define": 3,
+    "explain": 3, "list": 3, "name": 3,
+}
+PATTERNS = [
+   (r"what\s+is\s+the\s+(answer|solution)", 15),
+    (r"question\s+(number\s+)?\d+", 12),
+    (r"option\s+[a-d]", 10),
+    (r"help\s+me\s+(with|solve|answer)", 12),
+    (r"tell\s+me\s+(the|how)", 10),
+    (r"(search|google)\s+(for|this)", 12),
+    (r"can\s+you\s+(help|tell|give)", 10),
+    (r"i\s+don'?t\s+know\s+(the\s+)?(answer|solution)", 8),
+    (r"(send|share|give)\s+me", 10),
+    (r"what\s+does\s+.{5,30}\s+mean", 7),
+    (r"how\s+do\s+(i|you)\s+(calculate|solve|find)", 12),
+    (r"(alexa|siri|hey\s+google)", 15),
+]
+QUESTION_PREFIXES = ('what', 'how', 'why', 'can', 'could', 'is', 'are', 'do', 'does', 'tell me', 'explain', 'define')
+
+# Longest alternatives first, so "answers" is preferred over "answer" at the same position
+_KEYWORD_RE = re.compile(r"\b(?:" + "|".join(re.escape(word) for word in sorted(KEYWORDS, key=len, reverse=True)) + r")\b")
+_PATTERN_RES = [(re.compile(pattern), pts) for pattern, pts in PATTERNS]
+
+# --- Streaming configuration ---
+CONTEXT_WORDS = 8 # Trailing words of earlier chunks carried into the next chunk's pattern scan (longest pattern is ~7 words)
+WINDOW_SECONDS = 30.0 # Context older than this is dropped
+
+
+def risk_level(score):
+    if score >= CRITICAL_THRESHOLD: return "critical"
+    if score >= SUSPICION_THRESHOLD: return "high"
+    # Even if score is low, we detected speech, so risk is 'low' not None
+    return "low"
+
+def _matched_patterns(text):
+    return {i for i, (pattern_re, _) in enumerate(_PATTERN_RES) if pattern_re.search(text)}
+
+def score_transcript(text):
+    """
+    Scores one lowercased transcript on its own.
+    Returns {"score", "risk", "keywords", "text"} (same shape as voice_analysis results).
+    """
+    score = 0
+    keywords_found = []
+
+    # Keyword scan: one pass of the compiled alternation, each keyword counted once
+    for word in dict.fromkeys(_KEYWORD_RE.findall(text)):
+        score += KEYWORDS[word]
+        keywords_found.append(word)
+
+    # Pattern matching
+    matched = _matched_patterns(text)
+    if matched:
+        score += sum(_PATTERN_RES[i][1] for i in matched)
+        keywords_found.append("pattern_match") # Generic marker
+
+    # Simple question detection
+    if text.startswith(QUESTION_PREFIXES) or '?' in text:
+        score += QUESTION_BONUS
+        keywords_found.append("question_detected")
+
+    return {"score": score, "risk": risk_level(score), "keywords": keywords_found, "text": text}
+
+def score_batch(texts):
+    """ Scores many independent transcripts (e.g. a post-exam review export). Returns one result per text. """
+    return [score_transcript(text.lower()) for text in texts]
+
+def score_session(texts):
+    """ Scores one student's transcripts in order, with cross-chunk context, without touching live state. """
+    scorer = StreamingRiskScorer()
+    return [scorer.score(text.lower()) for text in texts]
+
+
+class StreamingRiskScorer:
+    """
+    Scores consecutive chunk transcripts from one student.
+
+    Each chunk gets its standalone score, plus the points for patterns that
+    only match when the tail of the preceding chunks is prepended. A phrase
+    split over the boundary therefore counts once, in the chunk that
+    completes it.
+    """
+
+    def __init__(self, context_words=CONTEXT_WORDS, window_seconds=WINDOW_SECONDS):
+        self.context_words = context_words
+        self.window_seconds = window_seconds
+        self._context = deque(maxlen=context_words) # (timestamp, word)
+
+    def _expire(self, now):
+        cutoff = now - self.window_seconds
+        while self._context and self._context[0][0] < cutoff: self._context.popleft()
+
+    def score(self, text, now=None):
+        now = time.time() if now is None else now
+        self._expire(now)
+        result = score_transcript(text)
+
+        if self._context:
+            tail = " ".join(word for _, word in self._context)
+            spanning = _matched_patterns(tail + " " + text) - _matched_patterns(tail) - _matched_patterns(text)
+            if spanning:
+                result["score"] += sum(_PATTERN_RES[i][1] for i in spanning)
+                if "pattern_match" not in result["keywords"]: result["keywords"].append("pattern_match")
+                result["keywords"].append("cross_chunk_match")
+                result["risk"] = risk_level(result["score"])
+
+        for word in text.split()[-self.context_words:]: self._context.append((now, word))
+        return result
+
+
+# --- Per-Student State Management ---
+_student_scorers = {}
+_scorers_lock = threading.Lock()
+
+def score_student_transcript(student_id, text):
+    """ Scores a live transcript with the student's streaming context. """
+    with _scorers_lock:
+        scorer = _student_scorers.get(student_id)
+        if scorer is None: scorer = _student_scorers[student_id] = StreamingRiskScorer()
+        return scorer.score(text)
+
+def remove_student_risk_state(student_id):
+    """ Removes the streaming context for a disconnected student """
+    with _scorers_lock: _student_scorers.pop(student_id, None)
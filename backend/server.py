@@ -1,7 +1,7 @@
 # backend/server.py
 import eventlet
 eventlet.monkey_patch() 
-from flask import Flask, request, send_from_directory
+from flask import Flask, request, send_from_directory, send_file, Response, jsonify
 from flask_socketio import SocketIO, emit, join_room, leave_room
 import time
 import datetime
@@ -9,20 +9,41 @@ import base64
 import numpy as np
 import cv2
 import os
-import tempfile
-import subprocess
-import threading
-import shutil
 import io
+import socket
 import soundfile as sf
+from eventlet import tpool
 
 # --- Import logic ---
 import  video_analysis # Expects analyze_frame, remove_student_state
-# from voice_analysis import transcribe_fast, analyze_fast
+import voice_analysis # Transcription + keyword risk scoring for audio chunks
+import audio_decoding # In-memory webm/opus -> 16 kHz PCM
+import risk_scoring # Per-student transcript context
 import phone_detection # Import phone detection
+import face_embeddings # Reference embeddings for identity verification
+import frame_change # Skips inference on unchanged frames
+import capture_rate # Per-student frame-rate hints
+from snapshot_store import snapshot_store, is_valid_image_id # Images referenced by ID in admin payloads
+from admin_broadcast import StudentUpdateBroadcaster
+from analysis_executor import AnalysisExecutor
+from audio_pipeline import AudioPipeline # Audio chunks on their own native threads, not the shared tpool
+from face_mesh_pool import face_mesh_pool # Per-student FaceMesh tracking contexts
+from inference_workers import inference_pool, InferenceError # Optional out-of-process inference tier
+import state_store as state_store_module # Session state shared between server processes
+from artifact_writer import artifact_writer, RetentionPolicy # Wallpapers / suspicious audio written off the hot path
+from model_registry import models # Lazily loaded ML models, warmed up in the background (/ready)
+import metrics # Prometheus-format stage timings, counters and gauges (/metrics)
+import async_logging # Leveled, sampled logging written by a background thread
+from async_logging import get_logger
+
+log = get_logger("server")
 
 app = Flask(__name__)
-socketio = SocketIO(app, cors_allowed_origins="*", async_mode='eventlet', logger=False, engineio_logger=False)
+# Several server processes can serve one exam: point them at the same message queue (e.g. redis://host:6379/0)
+# and state store, and put them behind a load balancer with sticky sessions.
+SOCKETIO_MESSAGE_QUEUE = os.environ.get("LOCKIN_SOCKETIO_MESSAGE_QUEUE") or None
+socketio = SocketIO(app, cors_allowed_origins="*", async_mode='eventlet', logger=False, engineio_logger=False,
+                    message_queue=SOCKETIO_MESSAGE_QUEUE, channel=os.environ.get("LOCKIN_SOCKETIO_CHANNEL", "lockin"))
 
 # --- Directories ---
 BASE_DIR = os.path.dirname(__file__)
@@ -32,6 +53,23 @@ REFERENCE_IMAGES_DIR = os.path.join(BASE_DIR, "reference_images")
 os.makedirs(SUSPICIOUS_AUDIO_DIR, exist_ok=True)
 os.makedirs(REFERENCE_IMAGES_DIR, exist_ok=True)
 
+# --- Artifact Retention (applied by the background artifact writer) ---
+AUDIO_MAX_FILES = int(os.environ.get("LOCKIN_AUDIO_MAX_FILES", "5000"))
+AUDIO_MAX_MB = float(os.environ.get("LOCKIN_AUDIO_MAX_MB", "2048"))
+AUDIO_RETENTION_HOURS = float(os.environ.get("LOCKIN_AUDIO_RETENTION_HOURS", "0")) # 0 = keep until the caps above
+REFERENCE_RETENTION_HOURS = float(os.environ.get("LOCKIN_REFERENCE_RETENTION_HOURS", "24"))
+artifact_writer.add_retention(RetentionPolicy(SUSPICIOUS_AUDIO_DIR, max_files=AUDIO_MAX_FILES, max_bytes=int(AUDIO_MAX_MB * 1024 * 1024),
+                                              max_age_seconds=AUDIO_RETENTION_HOURS * 3600))
+def pinned_reference_files():
+    """ Connected students' wallpapers (also those still being written) and their stored embeddings: the identity references. """
+    students = list(connected_students)
+    return ([connected_students.get(student_id, {}).get("wallpaperPath") for student_id in students] +
+            [write["path"] for write in list(wallpaper_writes.values())] +
+            [face_embeddings.embedding_store.path_for(student_id) for student_id in students])
+
+artifact_writer.add_retention(RetentionPolicy(REFERENCE_IMAGES_DIR, max_age_seconds=REFERENCE_RETENTION_HOURS * 3600,
+                                              pinned=pinned_reference_files))
+
 # --- Load STATIC Reference Image (as fallback ONLY) ---
 STATIC_REFERENCE_IMAGE_FILENAME = "reference_image.jpg" # Fallback filename
 STATIC_REFERENCE_IMAGE_PATH = os.path.join(BASE_DIR, STATIC_REFERENCE_IMAGE_FILENAME)
@@ -41,164 +79,307 @@ try:
     if os.path.exists(STATIC_REFERENCE_IMAGE_PATH):
         with open(STATIC_REFERENCE_IMAGE_PATH, "rb") as image_file:
             STATIC_REFERENCE_IMAGE_B64 = base64.b64encode(image_file.read()).decode('utf-8')
-        print(f"Loaded static fallback reference image ('{STATIC_REFERENCE_IMAGE_FILENAME}').")
+        log.info(f"Loaded static fallback reference image ('{STATIC_REFERENCE_IMAGE_FILENAME}').")
     else:
-        print(f"INFO: Static fallback reference image ('{STATIC_REFERENCE_IMAGE_FILENAME}') not found. Dynamic capture is required.")
+        log.info(f"Static fallback reference image ('{STATIC_REFERENCE_IMAGE_FILENAME}') not found. Dynamic capture is required.")
 except Exception as e:
-     print(f"WARNING: Error loading static fallback reference image: {e}")
+     log.warning(f"Error loading static fallback reference image: {e}")
 
 # --- Server State ---
-connected_students = {}  # {id, sid, score, status, snapshot, wallpaperB64, wallpaperPath, warnings}
+connected_students = {}  # {id, sid, score, status, wallpaperId, wallpaperPath, warnings, ...}
 admin_sids = set()       # Use set for efficiency
 exam_questions = []
 sid_to_student = {}
+latest_snapshots = {}    # {student_id: {"jpeg": bytes|None, "b64": str|None}}, JPEG decoded lazily for legacy snapshots
+# {student_id: {"sid", "path", "jpeg", "state": "writing"|"written"|"failed"}}; state is set by the artifact writer thread
+wallpaper_writes = {}
+# Students above are the ones whose sockets this process owns. The state store publishes their
+# admin view so that other processes can list them, and carries admin commands between processes.
+NODE_ID = f"{socket.gethostname()}:{os.getpid()}"
+state_store = state_store_module.create_state_store()
+STATE_SYNC_INTERVAL_SECONDS = 2.0
 
 # --- Helper Functions ---
-def b64_to_cv2_image(b64_string):
-    """ Converts a Base64 string to an OpenCV image (BGR). """
+def frame_payload_to_jpeg(payload):
+    """
+    Normalises a video_frame payload to raw JPEG bytes.
+    Binary frames (bytes from Socket.IO attachments) are passed through untouched;
+    legacy Base64 strings are decoded once.
+    """
+    if isinstance(payload, (bytes, bytearray, memoryview)): return payload
     try:
-        img_bytes = base64.b64decode(b64_string)
-        img_arr = np.frombuffer(img_bytes, dtype=np.uint8)
-        img = cv2.imdecode(img_arr, cv2.IMREAD_COLOR)
-        if img is None: print("ERROR [Image Decode]: cv2.imdecode returned None."); return None
-        return img
-    except Exception as e: print(f"ERROR [Image Decode]: {e}"); return None
+        with metrics.time_stage("b64_decode"): return base64.b64decode(payload)
+    except Exception as e: log.error(f"[Image Decode]: Invalid Base64 frame: {e}"); return None
 
-def emit_alert_to_admin(student_id, message, color="#ffc107", snapshot=None, audio_filename=None):
-    """ Sends a standardized alert message to all connected admins. """
-    if not admin_sids: print(f"ALERT (No Admins): {student_id}: {message}"); return
-    print(f"ALERT: {student_id}: {message}")
-    alert = { "id": f"{student_id}_{int(time.time()*1000)}", "text": f"{student_id}: {message}", "time": time.strftime("%H:%M:%S"), "color": color, "snapshot": snapshot, "audio_filename": audio_filename }
-    socketio.emit("new_alert", alert, room="admin_room") # Emit to admin room
+def jpeg_to_cv2_image(jpeg_bytes):
+    """ Converts raw JPEG bytes to an OpenCV image (BGR) without intermediate copies. """
+    try:
+        img_arr = np.frombuffer(jpeg_bytes, dtype=np.uint8)
+        with metrics.time_stage("jpeg_decode"): img = cv2.imdecode(img_arr, cv2.IMREAD_COLOR)
+        if img is None: log.error("[Image Decode]: cv2.imdecode returned None."); return None
+        return img
+    except Exception as e: log.error(f"[Image Decode]: {e}"); return None
+
+def set_latest_snapshot(student_id, jpeg_bytes=None, b64_string=None):
+    """ Remembers the student's latest frame. It is only written to the snapshot store if an emit needs it. """
+    latest_snapshots[student_id] = {"jpeg": jpeg_bytes, "b64": b64_string}
+
+def get_snapshot_jpeg(student_id):
+    """ Returns the latest snapshot as JPEG bytes, or None. """
+    entry = latest_snapshots.get(student_id)
+    if entry is None: return None
+    if entry["jpeg"] is None and entry["b64"] is not None:
+        try: entry["jpeg"] = base64.b64decode(entry["b64"])
+        except Exception as e: log.warning(f"[Snapshot]: Invalid Base64 snapshot for {student_id}: {e}"); return None
+    return entry["jpeg"]
+
+def store_latest_snapshot(student_id, kind="snapshot"):
+    """ Puts the latest snapshot in the snapshot store and returns its ID (or None). Alerts pass kind="alert" to keep it. """
+    snapshot_jpeg = get_snapshot_jpeg(student_id)
+    return store_image(student_id, kind, snapshot_jpeg) if snapshot_jpeg is not None else None
+
+def store_image(student_id, kind, jpeg_bytes):
+    """ snapshot_store.put through tpool: hashing and the file write would otherwise block the eventlet hub. """
+    return tpool.execute(snapshot_store.put, student_id, kind, jpeg_bytes)
+
+def emit_alert_to_admin(student_id, message, color="#ffc107", snapshot_id=None, audio_filename=None):
+    """ Sends a standardized alert message to all connected admins. Returns the alert ID, or None if nobody could receive it. """
+    # Alerts are the audit trail of the exam: WARNING, so log sampling never drops one
+    if not admins_may_be_listening(): log.warning("ALERT (No Admins): %s: %s", student_id, message, student_id=student_id); return None
+    log.warning("ALERT: %s: %s", student_id, message, student_id=student_id)
+    alert = { "id": f"{student_id}_{int(time.time()*1000)}", "text": f"{student_id}: {message}", "time": time.strftime("%H:%M:%S"), "color": color, "snapshot_id": snapshot_id, "audio_filename": audio_filename }
+    with metrics.time_stage("socket_emit"): socketio.emit("new_alert", alert, room="admin_room") # Emit to admin room
+    metrics.count_event("alert")
+    return alert["id"]
+
+# Fields of connected_students that admins see; everything else is server-internal
+ADMIN_VIEW_FIELDS = ("id", "score", "status", "warnings", "wallpaperId", "inferenceSkipRate", "captureIntervalMs")
+
+def student_admin_view(student_id):
+    """ Admin-facing record for a student. Images are referenced by ID, never inlined. """
+    student_data = connected_students.get(student_id)
+    if student_data is None: return None
+    view = {field: student_data.get(field) for field in ADMIN_VIEW_FIELDS}
+    view["snapshotId"] = store_latest_snapshot(student_id)
+    return view
+
+def admins_may_be_listening():
+    """ With a message queue, admins may be connected to another process, so always emit. """
+    return bool(admin_sids) or SOCKETIO_MESSAGE_QUEUE is not None
+
+def store_call(fn, *args):
+    """ Runs a state-store call; shared (SQLite) stores block on I/O, so they go through tpool. """
+    return tpool.execute(fn, *args) if state_store.shared else fn(*args)
+
+def publish_student_views(views):
+    """ Publishes admin views of students owned by this process to the state store. """
+    if not views: return
+    records = {student_id: dict(view, node=NODE_ID, sid=connected_students.get(student_id, {}).get("sid")) for student_id, view in views.items()}
+    try: store_call(state_store.set_many, "students", records)
+    except Exception as e: log.error(f"[State]: Could not publish student views: {e}")
+
+def remote_student_views():
+    """ Live admin views of students owned by other server processes. """
+    if not state_store.shared: return []
+    try: records = store_call(state_store.items, "students", state_store_module.STALE_AFTER_SECONDS)
+    except Exception as e: log.error(f"[State]: Could not read shared student list: {e}"); return []
+    return [{field: record.get(field) for field in ADMIN_VIEW_FIELDS + ("snapshotId",)}
+            for student_id, record in records.items() if record.get("node") != NODE_ID and student_id not in connected_students]
 
 def emit_student_update(student_id):
-    """ Sends the complete, current state of a student to all admins. """
-    if student_id in connected_students and admin_sids:
-        state_to_send = connected_students[student_id].copy()
-        print(f"DEBUG [Update]: Emitting update for {student_id} | Score: {state_to_send.get('score','N/A')} | Status: '{state_to_send.get('status','N/A')}' | Wallpaper Set: {'Yes' if state_to_send.get('wallpaperPath') else 'No'}")
-        socketio.emit("student_update", state_to_send, room="admin_room")
+    """ Queues a student's changed fields for the next coalesced broadcast to admins. """
+    if student_id in connected_students: admin_broadcaster.mark_dirty(student_id)
+
+admin_broadcaster = StudentUpdateBroadcaster(socketio, student_admin_view, on_flush=publish_student_views)
 
 
 # --- SocketIO Event Handlers ---
 
 @socketio.on('connect')
 def on_connect():
-    sid = request.sid; print(f"Client connected: {sid}")
+    sid = request.sid; log.warning("Client connected: %s", sid)
 
 @socketio.on('disconnect')
 def on_disconnect():
-    sid = request.sid; print(f"Client disconnected: {sid}")
+    sid = request.sid; log.warning("Client disconnected: %s", sid)
     if sid in sid_to_student:
         student_id = sid_to_student.pop(sid)
-        print(f"Student left: {student_id}")
+        log.warning("Student left: %s", student_id, student_id=student_id)
         if student_id in connected_students: del connected_students[student_id]
+        try: store_call(state_store.delete, "students", student_id)
+        except Exception as e: log.error(f"[State]: Could not unpublish {student_id}: {e}")
+        latest_snapshots.pop(student_id, None); wallpaper_writes.pop(student_id, None)
+        admin_broadcaster.forget(student_id); snapshot_store.remove_student(student_id)
+        analysis_executor.discard(student_id) # Drop any frame still waiting for analysis
         try:
             video_analysis.remove_student_state(student_id) # Cleanup focus state
             phone_detection.remove_student_phone_state(student_id) # Cleanup phone state
-            print(f"DEBUG [Disconnect]: Cleaned up analysis states for {student_id}")
-        except Exception as e: print(f"ERROR [Disconnect Cleanup]: {e}")
-        if admin_sids: print(f"DEBUG [Disconnect]: Emitting student_left for {student_id}"); socketio.emit("student_left", {"student_id": student_id}, room="admin_room")
-    elif sid in admin_sids: print(f"Admin left: {sid}"); admin_sids.discard(sid)
-    print(f"Current State: {len(connected_students)} students, {len(admin_sids)} admins.")
+            frame_change.remove_student_change_state(student_id) # Cleanup change-detector state
+            risk_scoring.remove_student_risk_state(student_id) # Cleanup transcript context
+            if inference_pool is not None: inference_pool.forget(student_id) # Cleanup state held by the inference worker
+            log.debug(f"[Disconnect]: Cleaned up analysis states for {student_id}")
+        except Exception as e: log.error(f"[Disconnect Cleanup]: {e}")
+        if admins_may_be_listening(): log.debug(f"[Disconnect]: Emitting student_left for {student_id}"); socketio.emit("student_left", {"student_id": student_id}, room="admin_room")
+    elif sid in admin_sids: log.warning("Admin left: %s", sid); admin_sids.discard(sid)
+    log.warning("Current State: %d students, %d admins.", len(connected_students), len(admin_sids))
 
 
 @socketio.on('adminJoin')
 def on_admin_join():
+    # Deliver pending deltas to the admins already listening first; the baseline they share must not be reset here
+    admin_broadcaster.flush()
     sid = request.sid; admin_sids.add(sid); join_room("admin_room") # Use admin_room
-    print(f"Admin joined room 'admin_room': {sid}. Total admins: {len(admin_sids)}")
-    current_student_list = list(connected_students.values())
-    print(f"DEBUG [Admin Join]: Sending student_list ({len(current_student_list)} students) to {sid}")
+    log.warning("Admin joined room 'admin_room': %s. Total admins: %d", sid, len(admin_sids))
+    current_student_list = [view for view in (student_admin_view(student_id) for student_id in list(connected_students)) if view]
+    current_student_list.extend(remote_student_views()) # Students served by other processes
+    log.debug(f"[Admin Join]: Sending student_list ({len(current_student_list)} students) to {sid}")
     emit("student_list", current_student_list, to=sid)
 
 
 @socketio.on('adminKickStudent')
 def on_admin_kick(data):
-    student_id = data.get("student_id"); print(f"INFO [Kick]: Admin requested kick for {student_id}")
+    student_id = data.get("student_id"); log.warning("[Kick]: Admin requested kick for %s", student_id, student_id=student_id)
     student_data = connected_students.get(student_id)
+    if not student_data and state_store.shared: student_data = store_call(state_store.get, "students", student_id) # Owned by another process; the message queue delivers to its SID
     if student_data and student_data.get("sid"):
-        student_sid = student_data["sid"]; print(f"INFO [Kick]: Sending 'kick' to {student_id} (SID: {student_sid})")
+        student_sid = student_data["sid"]; log.warning("[Kick]: Sending 'kick' to %s (SID: %s)", student_id, student_sid, student_id=student_id)
         emit("kick", {"reason": "Kicked by administrator."}, to=student_sid)
         emit_alert_to_admin(student_id, "Manually kicked by admin.", color="#6c757d")
-    else: print(f"WARN [Kick]: Cannot kick {student_id}, not found or no SID.")
+    else: log.warning(f"[Kick]: Cannot kick {student_id}, not found or no SID.")
 
 
 @socketio.on('adminFalseAlarm')
 def on_admin_false_alarm(data):
-    student_id = data.get("student_id"); print(f"DEBUG [False Alarm]: Received for {student_id}")
+    student_id = data.get("student_id"); log.debug(f"[False Alarm]: Received for {student_id}")
+    if student_id not in connected_students and state_store.shared:
+        # The owning process applies it on its next state sync
+        store_call(state_store.set, "commands", student_id, {"command": "false_alarm"}); return
+    apply_false_alarm(student_id)
+
+def apply_false_alarm(student_id):
     student_data = connected_students.get(student_id)
     if student_data and "Multiple Faces" in student_data.get("status", ""):
-        print(f"DEBUG [False Alarm]: Resetting status for {student_id}."); student_data["status"] = "Focused"
+        log.debug(f"[False Alarm]: Resetting status for {student_id}."); student_data["status"] = "Focused"
         emit_student_update(student_id); emit_alert_to_admin(student_id, "Admin marked 'Multiple Face' as false alarm.", color="#17a2b8")
-    else: print(f"DEBUG [False Alarm]: Ignoring for {student_id}, status not 'Multiple Faces'.")
+    else: log.debug(f"[False Alarm]: Ignoring for {student_id}, status not 'Multiple Faces'.")
 
 
 @socketio.on('studentJoin')
 def on_student_join(data):
     sid = request.sid; student_id = data.get("studentId")
-    if not student_id: print(f"WARN [Student Join]: Failed - no studentId. SID: {sid}"); return
-    if student_id in connected_students: print(f"WARN [Student Join]: {student_id} already joined?"); return
-
-    print(f"Student joined: {student_id} (SID: {sid})")
+    if not student_id: log.warning(f"[Student Join]: Failed - no studentId. SID: {sid}"); return
+    if student_id in connected_students: log.warning(f"[Student Join]: {student_id} already joined?"); return
+    if state_store.shared:
+        existing = store_call(state_store.get, "students", student_id)
+        if existing and existing.get("node") != NODE_ID and time.time() - existing["updated_at"] < state_store_module.STALE_AFTER_SECONDS:
+            log.warning(f"[Student Join]: {student_id} already joined on {existing.get('node')}."); return
+
+    log.warning("Student joined: %s (SID: %s)", student_id, sid, student_id=student_id)
     connected_students[student_id] = {
-        "id": student_id, "sid": sid, "score": 100, "status": "Connected", "snapshot": None,
-        "wallpaperB64": None, # Will be set by the first video frame
+        "id": student_id, "sid": sid, "score": 100, "status": "Connected",
+        "wallpaperId": None, # Will be set by the first video frame
         "wallpaperPath": None, # Will be set when wallpaper is saved
-        "warnings": 0, "looking_away_start_time": None, "looking_away_alerted": False
+        "warnings": 0, "looking_away_start_time": None, "looking_away_alerted": False,
+        "inferenceSkipRate": 0.0, # Share of frames that reused the previous inference results
+        "focused_since": None, "captureIntervalMs": capture_rate.DEFAULT_INTERVAL_MS
     }
     sid_to_student[sid] = student_id
-    if admin_sids: print(f"DEBUG [Student Join]: Emitting new_student for {student_id}"); socketio.emit("new_student", connected_students[student_id], room="admin_room")
+    new_student_view = student_admin_view(student_id); admin_broadcaster.set_baseline(student_id, new_student_view)
+    if state_store.shared: publish_student_views({student_id: new_student_view})
+    if admins_may_be_listening(): log.debug(f"[Student Join]: Emitting new_student for {student_id}"); socketio.emit("new_student", new_student_view, room="admin_room")
     if exam_questions: emit('receiveExam', {"questions": exam_questions}, room=sid)
 
 # --- 'setReferenceImage' handler REMOVED ---
 
 @socketio.on('video_frame')
 def on_video_frame(data):
+    """ Validates the frame and queues it; all blocking work happens in the analysis executor. """
     sid = request.sid
     student_id = sid_to_student.get(sid)
     if not student_id or student_id not in connected_students: return
 
-    frame_b64 = data.get("frame")
-    snapshot_b64 = data.get("snapshot") or frame_b64
+    # "frame" is raw JPEG bytes (binary transport) or a Base64 string (legacy clients).
+    frame_payload = data.get("frame")
+    if not frame_payload: return
+    # Legacy clients may send a separate snapshot; it is only kept when it differs from the frame.
+    snapshot_b64 = data.get("snapshot")
+    if snapshot_b64 == frame_payload: snapshot_b64 = None
+
+    # Optional client sequence number, acknowledged with 'frame_ack' once the frame has been applied (used by load_benchmark.py)
+    job = {"student_id": student_id, "sid": sid, "frame": frame_payload, "snapshot_b64": snapshot_b64, "seq": data.get("seq"), "received_at": time.perf_counter()}
+    if not analysis_executor.submit(student_id, job):
+        metrics.count_event("video_frame", "dropped")
+        log.warning("[Video]: Analysis queue full, dropped frame from %s.", student_id, student_id=student_id)
+
+
+def start_wallpaper_write(student_id, sid, jpeg_bytes):
+    """ Queues the student's wallpaper; the artifact writer marks the entry in wallpaper_writes once it is on disk (or failed). """
+    safe_student_id = "".join(c for c in student_id if c.isalnum() or c in ('-', '_', '.')).rstrip()
+    save_path = os.path.join(REFERENCE_IMAGES_DIR, f"wallpaper_{safe_student_id}.jpg")
+    write = wallpaper_writes[student_id] = {"sid": sid, "path": save_path, "jpeg": jpeg_bytes, "state": "writing"}
+    # The frame is already a JPEG, so write it as-is instead of re-encoding (in the background)
+    if artifact_writer.submit(save_path, jpeg_bytes, "wallpaper", on_done=lambda ok: write.update(state="written" if ok else "failed")):
+        log.warning("[%s]: Saving wallpaper image to: %s", student_id, save_path, student_id=student_id)
+    elif wallpaper_writes.get(student_id) is write: del wallpaper_writes[student_id] # Dropped: the next frame tries again
+
+
+def run_frame_analysis(job):
+    """
+    Blocking half of frame handling. Runs in a native worker thread:
+    decodes the frame, saves the wallpaper if needed and runs focus + phone analysis.
+    Must not emit to sockets.
+    """
+    student_id = job["student_id"]
+    result = {"analysis": None, "wallpaper_path": None, "wallpaper_jpeg": None, "jpeg": None, "skip_rate": None}
 
-    if not frame_b64: return
-
-    student_data = connected_students[student_id]
-    student_data["snapshot"] = snapshot_b64
+    student_data = connected_students.get(student_id)
+    if student_data is None: return result
     wallpaper_path = student_data.get("wallpaperPath")
-    wallpaper_just_set = False
+
+    # --- Image Decode (once per frame) ---
+    jpeg_bytes = frame_payload_to_jpeg(job["frame"])
+    if jpeg_bytes is None: return result
+    result["jpeg"] = jpeg_bytes
+    frame_cv2_analysis = jpeg_to_cv2_image(jpeg_bytes)
+    if frame_cv2_analysis is None: log.error(f"[Video]: Failed decode for analysis {student_id}."); return result
 
     # --- Save Wallpaper Image (if not already done) ---
-    if not wallpaper_path and frame_b64:
-        try:
-            img_cv2 = b64_to_cv2_image(frame_b64)
-            if img_cv2 is not None:
-                safe_student_id = "".join(c for c in student_id if c.isalnum() or c in ('-', '_', '.')).rstrip()
-                filename = f"wallpaper_{safe_student_id}.jpg"
-                save_path = os.path.join(REFERENCE_IMAGES_DIR, filename)
-
-                cv2.imwrite(save_path, img_cv2)
-                print(f"INFO [{student_id}]: Saved wallpaper image to: {save_path}")
-
-                student_data['wallpaperPath'] = save_path
-                student_data['wallpaperB64'] = frame_b64
-                wallpaper_path = save_path
-                wallpaper_just_set = True
-            else:
-                print(f"WARN [{student_id}]: Failed to decode frame for wallpaper saving.")
-        except Exception as e:
-            print(f"ERROR [{student_id}]: Failed to save wallpaper image: {e}")
+    # The path is only used once the background write has landed; a failed or dropped write is retried with a later frame
+    if not wallpaper_path:
+        write = wallpaper_writes.get(student_id)
+        if write is not None and (write["sid"] != job["sid"] or write["state"] == "failed"):
+            if write["state"] == "failed": log.warning(f"[{student_id}]: Wallpaper write failed, retrying with this frame.")
+            wallpaper_writes.pop(student_id, None); write = None
+        if write is None:
+            try: start_wallpaper_write(student_id, job["sid"], jpeg_bytes)
+            except Exception as e: log.error(f"[{student_id}]: Failed to save wallpaper image: {e}")
+        elif write["state"] == "written":
+            wallpaper_writes.pop(student_id, None)
+            wallpaper_path = result["wallpaper_path"] = write["path"]; result["wallpaper_jpeg"] = write["jpeg"]
+            # Embed the reference face once, on a verification worker, so re-verification only embeds the live frame
+            # (with inference workers, the worker queues it instead)
+            if inference_pool is None: video_analysis.prepare_reference(student_id, wallpaper_path)
 
     # --- Image Analysis ---
-    frame_cv2_analysis = b64_to_cv2_image(frame_b64)
-    if frame_cv2_analysis is None: print(f"ERROR [Video]: Failed decode for analysis {student_id}."); return
-
     reference_path_for_analysis = wallpaper_path or STATIC_REFERENCE_IMAGE_PATH
+    # Unchanged frames reuse the last FaceMesh/YOLO results; the timers still advance
+    reuse = not frame_change.frame_changed(frame_cv2_analysis, student_id)
+    result["skip_rate"] = frame_change.get_skip_stats(student_id)["skip_rate"]
 
     focus_analysis = None; phone_analysis = None; analysis_error = False
-    try: focus_analysis = video_analysis.analyze_frame(frame_cv2_analysis, student_id, reference_path_for_analysis)
-    except Exception as e: print(f"ERROR [Focus Analysis]: {e}"); focus_analysis = {"status": "ERROR: Focus Failed", "alert": f"Focus error: {e}", "score_penalty": 10}; analysis_error = True
-    try: phone_analysis = phone_detection.analyze_phone_frame(frame_cv2_analysis, student_id)
-    except Exception as e: print(f"ERROR [Phone Analysis]: {e}"); phone_analysis = {"status": "ERROR: Phone Failed", "alert": f"Phone error: {e}", "score_penalty": 10}; analysis_error = True
+    if inference_pool is not None:
+        # Models run in a worker process; the frame travels through shared memory
+        try:
+            focus_analysis, phone_analysis = inference_pool.analyze(frame_cv2_analysis, student_id, reference_path_for_analysis, reuse_last_results=reuse,
+                                                                    reference_path=result["wallpaper_path"])
+        except InferenceError as e: focus_analysis = {"error": str(e)}; phone_analysis = {"error": str(e)}
+        if "error" in focus_analysis: log.error(f"[Focus Analysis]: {focus_analysis['error']}"); focus_analysis = {"status": "ERROR: Focus Failed", "alert": f"Focus error: {focus_analysis['error']}", "score_penalty": 10}; analysis_error = True
+        if "error" in phone_analysis: log.error(f"[Phone Analysis]: {phone_analysis['error']}"); phone_analysis = {"status": "ERROR: Phone Failed", "alert": f"Phone error: {phone_analysis['error']}", "score_penalty": 10}; analysis_error = True
+    else:
+        try: focus_analysis = video_analysis.analyze_frame(frame_cv2_analysis, student_id, reference_path_for_analysis, reuse_last_results=reuse)
+        except Exception as e: log.error(f"[Focus Analysis]: {e}"); focus_analysis = {"status": "ERROR: Focus Failed", "alert": f"Focus error: {e}", "score_penalty": 10}; analysis_error = True
+        try: phone_analysis = phone_detection.analyze_phone_frame(frame_cv2_analysis, student_id, reuse_last_results=reuse)
+        except Exception as e: log.error(f"[Phone Analysis]: {e}"); phone_analysis = {"status": "ERROR: Phone Failed", "alert": f"Phone error: {e}", "score_penalty": 10}; analysis_error = True
 
     # Combine results
     analysis = focus_analysis if focus_analysis else {}
@@ -211,6 +392,38 @@ def on_video_frame(data):
     elif focus_analysis and focus_analysis.get("status") == "Looking Away": analysis = focus_analysis
     elif phone_analysis and phone_analysis.get("status") == "Phone Detected (Pending)": analysis = phone_analysis
 
+    result["analysis"] = analysis
+    return result
+
+
+def apply_frame_analysis(job, result):
+    """ Hub half of frame handling: score, status, alert and timer logic, then emits. """
+    student_id = job["student_id"]
+    student_data = connected_students.get(student_id)
+    if student_data is None:
+        # Student left while the frame was being analysed; drop state the worker may have recreated
+        video_analysis.remove_student_state(student_id); phone_detection.remove_student_phone_state(student_id)
+        frame_change.remove_student_change_state(student_id)
+        if inference_pool is not None: inference_pool.forget(student_id)
+        return
+    if student_data.get("sid") != job["sid"]: return # Frame belongs to an earlier session
+
+    jpeg_bytes = result["jpeg"]
+    if job["snapshot_b64"]: set_latest_snapshot(student_id, b64_string=job["snapshot_b64"])
+    elif jpeg_bytes is not None: set_latest_snapshot(student_id, jpeg_bytes)
+    wallpaper_just_set = False
+    if result["wallpaper_path"] and not student_data.get("wallpaperPath"):
+        student_data['wallpaperPath'] = result["wallpaper_path"]
+        student_data['wallpaperId'] = store_image(student_id, "wallpaper", result["wallpaper_jpeg"])
+        wallpaper_just_set = True
+    if result["skip_rate"] is not None: student_data["inferenceSkipRate"] = round(result["skip_rate"], 3) # Sent with the next update
+
+    analysis = result["analysis"]
+    if analysis is None: # Decode failed
+        if wallpaper_just_set: emit_student_update(student_id)
+        ack_frame(job)
+        return
+
     # --- Score, Status, Alert, Timer Logic ---
     previous_status = student_data["status"]
     student_data["status"] = analysis.get("status", previous_status)
@@ -222,18 +435,18 @@ def on_video_frame(data):
     is_looking_away = (analysis.get("status") == "Looking Away")
     looking_away_start_time = student_data.get("looking_away_start_time")
     if is_looking_away:
-        if looking_away_start_time is None: student_data["looking_away_start_time"] = time.time(); student_data["looking_away_alerted"] = False; print(f"DEBUG [Video]: {student_id} timer started (Looking Away).")
+        if looking_away_start_time is None: student_data["looking_away_start_time"] = time.time(); student_data["looking_away_alerted"] = False; log.debug("[Video]: %s timer started (Looking Away).", student_id, student_id=student_id)
         else:
              elapsed = time.time() - looking_away_start_time
              if elapsed > 2.0 and not student_data.get("looking_away_alerted"):
-                  print(f"DEBUG [Video]: {student_id} exceeded 2.0s threshold.")
+                  log.debug("[Video]: %s exceeded 2.0s threshold.", student_id, student_id=student_id)
                   current_score = student_data["score"]; penalty = analysis.get("score_penalty", 0)
                   new_score = max(0, current_score - penalty)
                   if new_score != current_score: student_data["score"] = new_score; score_updated = True
                   student_data["warnings"] += 1; student_data["looking_away_alerted"] = True; alert_triggered_this_frame = True
-                  emit_alert_to_admin(student_id, analysis.get("alert", "Looking away threshold exceeded"), color="#ffc107", snapshot=snapshot_b64)
+                  emit_alert_to_admin(student_id, analysis.get("alert", "Looking away threshold exceeded"), color="#ffc107", snapshot_id=store_latest_snapshot(student_id, "alert"))
     else: # Not "Looking Away"
-        if looking_away_start_time is not None: print(f"DEBUG [Video]: {student_id} timer reset.")
+        if looking_away_start_time is not None: log.debug("[Video]: %s timer reset.", student_id, student_id=student_id)
         student_data["looking_away_start_time"] = None; student_data["looking_away_alerted"] = False
 
     # Handle OTHER alerts
@@ -246,11 +459,36 @@ def on_video_frame(data):
         alert_color = "#dc3545" if "CRITICAL" in analysis.get("status", "") else "#ffc107"
         if "Identity Verified" in alert_message: alert_color = "#28a745"
         alert_triggered_this_frame = True
-        emit_alert_to_admin(student_id, alert_message, color=alert_color, snapshot=snapshot_b64)
+        emit_alert_to_admin(student_id, alert_message, color=alert_color, snapshot_id=store_latest_snapshot(student_id, "alert"))
+
+    # --- Capture Rate Hint ---
+    update_capture_rate(student_id, student_data)
 
     # --- Emit Update ---
     if wallpaper_just_set or score_updated or status_changed:
         emit_student_update(student_id)
+    ack_frame(job)
+
+
+def ack_frame(job):
+    """ Records the frame's end-to-end time and acknowledges it to clients that sent a sequence number. """
+    metrics.observe_stage("frame_total", time.perf_counter() - job["received_at"]); metrics.count_event("video_frame", "processed")
+    if job.get("seq") is not None: socketio.emit("frame_ack", {"seq": job["seq"]}, to=job["sid"])
+
+
+def update_capture_rate(student_id, student_data):
+    """ Sends the student a new capture interval when the recommended one changes. """
+    if student_data["status"] == "Focused":
+        if student_data.get("focused_since") is None: student_data["focused_since"] = time.time()
+    else: student_data["focused_since"] = None
+    interval_ms = capture_rate.recommend_interval_ms(student_data["status"], student_data.get("focused_since"), analysis_executor.is_saturated())
+    if interval_ms != student_data.get("captureIntervalMs"):
+        student_data["captureIntervalMs"] = interval_ms
+        log.debug("[Capture Rate]: %s -> %s ms (Status: '%s')", student_id, interval_ms, student_data['status'], student_id=student_id)
+        socketio.emit("capture_rate", {"interval_ms": interval_ms}, to=student_data["sid"])
+
+
+analysis_executor = AnalysisExecutor(run_frame_analysis, apply_frame_analysis)
 
 
 @socketio.on('audio_chunk')
@@ -259,109 +497,190 @@ def on_audio_chunk(data):
     if not student_id: return
     audio_b64 = data.get("audio"); snapshot_b64 = data.get("snapshot")
     if not audio_b64: return
-    thread = threading.Thread(target=handle_audio_analysis, args=(student_id, audio_b64, snapshot_b64), daemon=True)
-    thread.start()
+    audio_pipeline.submit(student_id, (audio_b64, snapshot_b64))
 
 def process_audio_chunk_wrapper(student_id, base64_audio):
-    # This function now correctly handles ffmpeg and calls voice_recognition helpers
-    print(f"[{student_id}] Processing audio chunk...")
-    temp_wav_path = None; analysis = {"score": 0, "risk": "low", "text": "", "keywords": []}
-    webm_path = None # Define outside try
+    """
+    Blocking half of audio handling, run on an audio_pipeline worker thread.
+    Decodes the chunk in memory to 16 kHz mono PCM, then transcribes and scores it.
+    Returns (analysis, pcm_to_save); pcm_to_save is only set for risky chunks.
+    """
+    log.debug("[%s] Processing audio chunk...", student_id, student_id=student_id)
+    analysis = {"score": 0, "risk": "low", "text": "", "keywords": []}
     try:
-        audio_data = base64.b64decode(base64_audio)
-        # Save temp webm
-        with tempfile.NamedTemporaryFile(suffix=".webm", delete=False, prefix=f"{student_id}_aud_") as webm_file:
-            webm_path = webm_file.name
-            webm_file.write(audio_data)
-
-        # Convert to wav
-        temp_wav_path = webm_path.replace(".webm", ".wav")
-        command = ['ffmpeg', '-i', webm_path, '-ac', '1', '-ar', '16000', temp_wav_path, '-y'] # Force mono, 16kHz
-        print(f"[{student_id}] Running ffmpeg: {' '.join(command)}")
-        result = subprocess.run(command, timeout=10, check=True, capture_output=True, text=True)
-        print(f"[{student_id}] ffmpeg successful.")
-
-        # Transcribe wav
-        text = transcribe_fast(temp_wav_path) # From voice_recognition.py
-        if text:
-            print(f"[{student_id}] Transcription: '{text}'")
-            analysis = analyze_fast(text) # From voice_recognition.py
-            analysis['text'] = text
+        with metrics.time_stage("audio_decode"): pcm = audio_decoding.decode_audio_chunk(base64.b64decode(base64_audio))
+        speech_analysis = voice_analysis.analyze_audio_chunk(pcm, audio_decoding.TARGET_SAMPLE_RATE, student_id=student_id)
+        if speech_analysis:
+            analysis = speech_analysis
+            log.info("[%s] Transcription: '%s'", student_id, analysis.get('text', ''), student_id=student_id)
             if analysis.get('risk') in ['high', 'critical']:
-                return analysis, temp_wav_path # Keep wav path if risky
+                return analysis, pcm # Keep audio if risky
         else:
-             print(f"[{student_id}] Transcription resulted in empty text.")
-        # If not risky or no text, return None for path (will be deleted)
-        return analysis, None
-    except subprocess.TimeoutExpired:
-        print(f"[{student_id}] ERROR: ffmpeg command timed out.")
-        analysis['text'] = "Audio processing timeout"; analysis['risk'] = 'error'
-        return analysis, None
-    except FileNotFoundError:
-        print(f"[{student_id}] CRITICAL ERROR: 'ffmpeg' command not found. Install ffmpeg and add to PATH.")
-        analysis['text'] = "Backend Error: ffmpeg not found"; analysis['risk'] = 'error'
+             log.debug("[%s] No speech transcribed in chunk.", student_id, student_id=student_id)
         return analysis, None
-    except subprocess.CalledProcessError as e:
-        print(f"[{student_id}] ERROR: ffmpeg failed: {e.stderr}")
-        analysis['text'] = f"Audio conversion error: {e.stderr[:100]}..."; analysis['risk'] = 'error'
+    except audio_decoding.AudioDecodeError as e:
+        log.error(f"[{student_id}] ERROR: {e}")
+        analysis['text'] = str(e); analysis['risk'] = 'error'
         return analysis, None
     except Exception as e:
-        print(f"[{student_id}] ERROR processing audio chunk: {e}")
+        log.error(f"[{student_id}] ERROR processing audio chunk: {e}")
         analysis['text'] = f"Audio Error: {e}"; analysis['risk'] = 'error'
         return analysis, None
-    finally:
-        # Clean up temp webm file
-        if webm_path and os.path.exists(webm_path):
-            try: os.remove(webm_path)
-            except Exception as e: print(f"WARN: Failed to delete temp webm {webm_path}: {e}")
-        # Temp wav deletion is handled based on return value in handle_audio_analysis
-
-
-def handle_audio_analysis(student_id, base64_audio, snapshot_b64):
-    analysis, wav_file_path_to_save = process_audio_chunk_wrapper(student_id, base64_audio)
-    saved_audio_filename = None
-    if wav_file_path_to_save:
-        try:
-            timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S"); safe_id = "".join(c for c in student_id if c.isalnum() or c in ('-', '_')).rstrip(); score = analysis.get('score', 0)
-            new_filename = f"{safe_id}_{timestamp}_risk{score}.wav"; destination_path = os.path.join(SUSPICIOUS_AUDIO_DIR, new_filename)
-            shutil.move(wav_file_path_to_save, destination_path); saved_audio_filename = new_filename
-            print(f"[{student_id}] Saved suspicious audio: {saved_audio_filename}")
-        except Exception as e: print(f"[{student_id}] Error saving audio {wav_file_path_to_save}: {e}");
-        if os.path.exists(wav_file_path_to_save): os.remove(wav_file_path_to_save); wav_file_path_to_save = None
 
+def save_suspicious_audio(student_id, pcm, score, on_done=None):
+    """
+    Encodes a risky chunk as 16-bit WAV in memory and queues it for SUSPICIOUS_AUDIO_DIR.
+    Returns the filename, or None if dropped; `on_done(filename, ok)` runs on the writer thread once it has landed or failed.
+    """
+    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S"); safe_id = "".join(c for c in student_id if c.isalnum() or c in ('-', '_')).rstrip()
+    new_filename = f"{safe_id}_{timestamp}_risk{score}.wav"; destination_path = os.path.join(SUSPICIOUS_AUDIO_DIR, new_filename)
+    wav = io.BytesIO()
+    sf.write(wav, pcm, audio_decoding.TARGET_SAMPLE_RATE, format='WAV', subtype='PCM_16')
+    return new_filename if artifact_writer.submit(destination_path, wav.getvalue(), "audio", on_done=on_done and (lambda ok: on_done(new_filename, ok))) else None
+
+def publish_alert_audio(student_id, alert_id, filename, ok):
+    """ Hub side of a suspicious-audio write: links the WAV to its alert only once it is on disk. """
+    if not ok: log.warning("[%s] Suspicious audio %s could not be written; alert %s stays without audio.", student_id, filename, alert_id, student_id=student_id); return
+    if alert_id: socketio.emit("alert_audio", {"id": alert_id, "audio_filename": filename}, room="admin_room")
+
+def save_alert_audio(student_id, alert_id, pcm, score):
+    """ Queues the alert's audio; the writer's callback is handed back to the hub through audio_pipeline. """
+    def on_done(filename, ok): audio_pipeline.post(publish_alert_audio, student_id, alert_id, filename, ok) # Writer thread: no socket I/O here
+    try:
+        filename = save_suspicious_audio(student_id, pcm, score, on_done=on_done) # No disk I/O here
+        if filename: log.warning("[%s] Saving suspicious audio: %s", student_id, filename, student_id=student_id)
+    except Exception as e: log.error(f"[{student_id}] Error saving suspicious audio: {e}")
+
+
+def apply_audio_analysis(student_id, payload, result):
+    """ Hub half of audio handling: counts the chunk, raises alerts and queues their audio. """
+    snapshot_b64 = payload[1]; analysis, pcm_to_save = result
+    # Every processed chunk is counted here (dropped ones in audio_pipeline); nothing transcribed is not the same as low risk
+    metrics.count_event("audio_chunk", analysis.get('risk', 'low') if analysis.get('text') or analysis.get('risk') == 'error' else "no_speech")
     risk_level = analysis.get('risk', 'low'); text = analysis.get('text', '')
     if risk_level in ["high", "critical", "error"]:
-        print(f"[{student_id}] !!! AUDIO ALERT !!! (Risk: {risk_level})")
+        log.warning("[%s] !!! AUDIO ALERT !!! (Risk: %s)", student_id, risk_level, student_id=student_id)
         alert_color = '#dc3545' if risk_level == 'critical' or risk_level == 'error' else '#ffc107'
-        emit_alert_to_admin(student_id, f"(Audio) \"{text}\"", color=alert_color, snapshot=snapshot_b64, audio_filename=saved_audio_filename)
+        snapshot_id = None
+        if snapshot_b64:
+            try: snapshot_id = store_image(student_id, "alert", base64.b64decode(snapshot_b64))
+            except Exception as e: log.warning(f"[{student_id}]: Could not store audio alert snapshot: {e}")
+        # The audio link follows in an "alert_audio" event once the WAV has landed, so it never points at a failed write
+        alert_id = emit_alert_to_admin(student_id, f"(Audio) \"{text}\"", color=alert_color, snapshot_id=snapshot_id)
+        if pcm_to_save is not None: save_alert_audio(student_id, alert_id, pcm_to_save, analysis.get('score', 0))
         if student_id in connected_students:
              current_score = connected_students[student_id]['score']; penalty = analysis.get('score', 10 if risk_level=='error' else 0)
              new_score = max(0, current_score - penalty)
              if new_score != current_score: connected_students[student_id]['score'] = new_score; connected_students[student_id]['warnings'] += 1; emit_student_update(student_id)
-    else: print(f"[{student_id}] Audio analysis complete (Low risk).")
-    # Clean up temp wav if it wasn't saved
-    if wav_file_path_to_save and os.path.exists(wav_file_path_to_save):
-         try: os.remove(wav_file_path_to_save)
-         except Exception as e: print(f"WARN: Failed to delete temp wav {wav_file_path_to_save}: {e}")
+    else: log.debug("[%s] Audio analysis complete (Low risk).", student_id, student_id=student_id)
+
+audio_pipeline = AudioPipeline(socketio, lambda student_id, payload: process_audio_chunk_wrapper(student_id, payload[0]), apply_audio_analysis)
 
 
+# --- Shared State Sync ---
+def run_state_sync():
+    """
+    Only with a shared state store: keeps this process's student records fresh
+    (so others don't treat them as stale) and applies admin commands that other
+    processes queued for students owned here.
+    """
+    while True:
+        socketio.sleep(STATE_SYNC_INTERVAL_SECONDS)
+        try:
+            local_ids = list(connected_students)
+            store_call(state_store.touch_many, "students", local_ids)
+            commands = store_call(state_store.items, "commands")
+            for student_id in commands:
+                if student_id not in connected_students:
+                    # Nobody applied it in time (student left or moved); drop it
+                    if time.time() - commands[student_id]["updated_at"] > state_store_module.STALE_AFTER_SECONDS: store_call(state_store.delete, "commands", student_id)
+                    continue
+                command = store_call(state_store.pop, "commands", student_id)
+                if command and command.get("command") == "false_alarm": apply_false_alarm(student_id)
+        except Exception as e: log.error(f"[State]: Sync failed: {e}")
+
+
+# --- Metrics ---
+metrics.registry.gauge_callback("lockin_connected_students", "Students currently connected.", lambda: len(connected_students))
+metrics.registry.gauge_callback("lockin_connected_admins", "Admins currently in admin_room.", lambda: len(admin_sids))
+metrics.registry.gauge_callback("lockin_analysis_queue_depth", "Students with a frame waiting for analysis.", lambda: analysis_executor.stats()["queue_depth"])
+metrics.registry.gauge_callback("lockin_analysis_running", "Frames being analysed right now.", lambda: analysis_executor.stats()["running"])
+metrics.registry.counter_callback("lockin_analysis_jobs_total", "Analysis executor jobs by outcome.",
+                                  lambda: {outcome: analysis_executor.stats()[outcome] for outcome in ("submitted", "completed", "dropped", "superseded", "failed")}, ["outcome"])
+metrics.registry.gauge_callback("lockin_audio_queue_depth", "Audio chunks waiting for an audio worker.", lambda: audio_pipeline.stats()["queue_depth"])
+metrics.registry.counter_callback("lockin_audio_jobs_total", "Audio pipeline chunks by outcome.",
+                                  lambda: {outcome: audio_pipeline.stats()[outcome] for outcome in ("submitted", "completed", "dropped", "failed")}, ["outcome"])
+metrics.registry.gauge_callback("lockin_verification_backlog", "Identity verifications waiting or running.",
+                                lambda: (lambda stats: stats["queue_depth"] + stats["running"])(video_analysis.verification_scheduler.stats()))
+metrics.registry.gauge_callback("lockin_inference_skip_rate", "Mean share of frames that reused previous inference results.",
+                                lambda: (sum(s.get("inferenceSkipRate") or 0.0 for s in list(connected_students.values())) / len(connected_students)) if connected_students else 0.0)
+metrics.registry.counter_callback("lockin_log_records_lost_total", "Log records not written: sampled out, or dropped on a full log queue.",
+                                  lambda: (lambda stats: {"suppressed": stats["suppressed"], "dropped": stats["dropped"]})(async_logging.get_stats()), ["reason"])
+metrics.registry.gauge_callback("lockin_facemesh_instances", "FaceMesh tracking contexts held in this process, by state.",
+                                lambda: (lambda stats: {"busy": stats["busy"], "idle": stats["instances"] - stats["busy"]})(face_mesh_pool.stats()), ["state"])
+metrics.registry.gauge_callback("lockin_artifact_queue_depth", "Wallpapers / audio clips waiting for the artifact writer.", lambda: artifact_writer.stats()["queue_depth"])
+metrics.registry.counter_callback("lockin_artifacts_deleted_total", "Artifacts removed by retention limits.", lambda: artifact_writer.stats()["deleted"])
+metrics.registry.gauge_callback("lockin_model_ready", "1 once the model is loaded and warmed up in this process.",
+                                lambda: {name: int(status["state"] == "ready") for name, status in models.status().items()}, ["model"])
+metrics.registry.counter_callback("lockin_facemesh_evictions_total", "FaceMesh contexts reassigned from the least recently used student.",
+                                  lambda: face_mesh_pool.stats()["evictions"])
+
+if inference_pool is not None:
+    metrics.registry.gauge_callback("lockin_inference_free_slots", "Free shared-memory frame slots.", lambda: inference_pool.stats()["free_slots"])
+    metrics.registry.gauge_callback("lockin_inference_workers_alive", "Inference worker processes running.", lambda: inference_pool.stats()["alive"])
+
+@app.route('/metrics')
+def serve_metrics():
+    """ Prometheus scrape endpoint. """
+    return Response(metrics.registry.render(), mimetype="text/plain; version=0.0.4; charset=utf-8")
+
+@app.route('/ready')
+def serve_ready():
+    """ Readiness probe: 200 once every model (or every inference worker) is loaded and warmed up, else 503. """
+    if inference_pool is not None:
+        ready, workers = inference_pool.readiness()
+        body = {"ready": ready, "inference_workers": workers}
+    else:
+        ready = models.ready()
+        body = {"ready": ready, "models": models.status()}
+    return jsonify(body), 200 if ready else 503
+
+# --- Flask Route to Serve Student Images ---
+@app.route('/images/<image_id>')
+def serve_image(image_id):
+    """ Content-addressed images: the ID is the SHA-256 of the bytes, so it doubles as a strong ETag. """
+    if not is_valid_image_id(image_id): return "Invalid image id", 400
+    if not snapshot_store.has(image_id): return "Image not found", 404
+    try:
+        response = send_file(snapshot_store.path_for(image_id), mimetype="image/jpeg", etag=image_id, conditional=True, max_age=31536000)
+        response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+        return response
+    except FileNotFoundError: return "Image not found", 404
+
 # --- Flask Route to Serve Audio Files ---
 @app.route('/audio/<path:filename>')
 def serve_audio(filename):
-    print(f"Serving audio file: {filename}"); 
+    log.debug("Serving audio file: %s", filename)
     try:
         if '..' in filename or filename.startswith('/'): return "Invalid filename", 400
-        response = send_from_directory(SUSPICIOUS_AUDIO_DIR, filename, as_attachment=False)
+        queued = artifact_writer.pending(os.path.join(SUSPICIOUS_AUDIO_DIR, filename))
+        if queued is not None: response = Response(queued, mimetype="audio/wav") # Not on disk yet
+        else: response = send_from_directory(SUSPICIOUS_AUDIO_DIR, filename, as_attachment=False)
         response.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"; response.headers["Pragma"] = "no-cache"; response.headers["Expires"] = "0"; return response
     except FileNotFoundError: return "File not found", 404
-    except Exception as e: print(f"Error serving {filename}: {e}"); return "Server error", 500
+    except Exception as e: log.error(f"Error serving {filename}: {e}"); return "Server error", 500
 
 # --- Main Execution ---
 if __name__ == '__main__':
-    print(f"Flask-SocketIO server starting on http://localhost:8000")
-    print(f"Static reference image path (fallback): {STATIC_REFERENCE_IMAGE_PATH}")
-    print(f"Dynamic reference images will be saved to: {REFERENCE_IMAGES_DIR}")
-    print(f"Suspicious audio directory: {SUSPICIOUS_AUDIO_DIR}")
-    try: socketio.run(app, host='0.0.0.0', port=8000, debug=False, use_reloader=False)
-    except KeyboardInterrupt: print("Server shutting down.")
-    except Exception as e: print(f"Failed to start server: {e}")
\ No newline at end of file
+    port = int(os.environ.get("LOCKIN_PORT", "8000"))
+    log.info(f"Flask-SocketIO server starting on http://localhost:{port}")
+    log.info(f"Static reference image path (fallback): {STATIC_REFERENCE_IMAGE_PATH}")
+    log.info(f"Dynamic reference images will be saved to: {REFERENCE_IMAGES_DIR}")
+    log.info(f"Suspicious audio directory: {SUSPICIOUS_AUDIO_DIR}")
+    if inference_pool is not None: inference_pool.start() # Workers load and warm up their models while the server comes up
+    else: models.warm_up_in_background() # Serve right away; /ready turns 200 once the models are warm
+    analysis_executor.start(); audio_pipeline.start()
+    if state_store.shared: socketio.start_background_task(run_state_sync)
+    try: socketio.run(app, host='0.0.0.0', port=port, debug=False, use_reloader=False)
+    except KeyboardInterrupt: log.info("Server shutting down.")
+    except Exception as e: log.error(f"Failed to start server: {e}")
\ No newline at end of file
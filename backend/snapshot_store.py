@@ -0,0 +1,146 @@
+# backend/snapshot_store.py
+"""
+Content-addressed, bounded on-disk store for student snapshots and wallpapers.
+
+Socket payloads carry only an image ID (the SHA-256 of the JPEG); browsers
+fetch /images/<image_id> when they actually display an image, and because an
+ID never changes content it is served with a strong ETag and a long cache
+lifetime.
+
+Retention:
+- each student keeps a ring of their last SNAPSHOT_RETENTION_PER_STUDENT
+  snapshots; older ones are deleted once no other slot references them;
+- snapshots attached to alerts ("alert") have their own ring of
+  ALERT_SNAPSHOT_RETENTION_PER_STUDENT, so routine snapshots never evict them;
+- a student's current wallpaper and alert snapshots are pinned while they are connected;
+- the whole store is capped at SNAPSHOT_MAX_FILES, evicting the oldest
+  unpinned files first (this is what ages out disconnected students).
+"""
+import collections
+import hashlib
+import os
+import re
+from native_threading import threading
+from async_logging import get_logger
+
+log = get_logger("snapshots")
+
+# --- Configuration ---
+SNAPSHOTS_DIR = os.path.join(os.path.dirname(__file__), "snapshots")
+SNAPSHOT_RETENTION_PER_STUDENT = int(os.environ.get("LOCKIN_SNAPSHOT_RETENTION", "20"))
+SNAPSHOT_MAX_FILES = int(os.environ.get("LOCKIN_SNAPSHOT_MAX_FILES", "5000"))
+ALERT_SNAPSHOT_RETENTION_PER_STUDENT = int(os.environ.get("LOCKIN_ALERT_SNAPSHOT_RETENTION", "500"))
+
+_IMAGE_ID_RE = re.compile(r"^[0-9a-f]{64}$")
+
+
+def image_id_for(jpeg_bytes):
+    """ Content address of a JPEG. """
+    return hashlib.sha256(jpeg_bytes).hexdigest()
+
+def is_valid_image_id(image_id):
+    return bool(_IMAGE_ID_RE.match(image_id or ""))
+
+
+class SnapshotStore:
+    def __init__(self, directory=SNAPSHOTS_DIR, retention_per_student=SNAPSHOT_RETENTION_PER_STUDENT, max_files=SNAPSHOT_MAX_FILES,
+                 alert_retention_per_student=ALERT_SNAPSHOT_RETENTION_PER_STUDENT):
+        self.directory = directory
+        self.retention_per_student = max(1, retention_per_student)
+        self.alert_retention_per_student = max(1, alert_retention_per_student)
+        self.max_files = max(1, max_files)
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._files = collections.OrderedDict() # image_id -> None, oldest first
+        self._refs = collections.Counter()      # image_id -> ring/pin slots referencing it
+        self._rings = {}                        # student_id -> deque of snapshot IDs
+        self._alert_rings = {}                  # student_id -> deque of IDs referenced by alerts
+        self._wallpapers = {}                   # student_id -> pinned wallpaper ID
+        self._index_existing_files()
+
+    def _index_existing_files(self):
+        """ Picks up files from a previous run so the global cap covers them. """
+        entries = []
+        for name in os.listdir(self.directory):
+            image_id, ext = os.path.splitext(name)
+            if ext == ".jpg" and is_valid_image_id(image_id):
+                entries.append((os.path.getmtime(os.path.join(self.directory, name)), image_id))
+        for _, image_id in sorted(entries): self._files[image_id] = None
+        self._enforce_global_cap()
+
+    def path_for(self, image_id):
+        return os.path.join(self.directory, f"{image_id}.jpg")
+
+    def _write_file(self, image_id, jpeg_bytes):
+        path = self.path_for(image_id)
+        if os.path.exists(path): return
+        temp_path = f"{path}.{os.getpid()}.tmp" # Sibling server processes may write the same image
+        with open(temp_path, "wb") as image_file: image_file.write(jpeg_bytes)
+        os.replace(temp_path, path) # Readers never see a partial file
+
+    def _delete_file(self, image_id):
+        self._files.pop(image_id, None)
+        try: os.remove(self.path_for(image_id))
+        except FileNotFoundError: pass
+        except Exception as e: log.warning(f"[Snapshots]: Could not delete {image_id}: {e}")
+
+    def _release(self, image_id):
+        self._refs[image_id] -= 1
+        if self._refs[image_id] <= 0:
+            del self._refs[image_id]
+            self._delete_file(image_id)
+
+    def _enforce_global_cap(self):
+        if len(self._files) <= self.max_files: return
+        pinned = set(self._wallpapers.values())
+        for ring in self._alert_rings.values(): pinned.update(ring)
+        for image_id in list(self._files):
+            if len(self._files) <= self.max_files: break
+            if image_id in pinned: continue
+            self._refs.pop(image_id, None)
+            self._delete_file(image_id)
+
+    def put(self, student_id, kind, jpeg_bytes):
+        """
+        Stores an image ("snapshot", "alert" or "wallpaper") for a student and returns its ID.
+        Identical content is stored once.
+        """
+        jpeg_bytes = bytes(jpeg_bytes)
+        image_id = image_id_for(jpeg_bytes)
+        with self._lock:
+            if kind == "wallpaper":
+                previous = self._wallpapers.get(student_id)
+                if previous == image_id: return image_id
+                self._wallpapers[student_id] = image_id
+                self._refs[image_id] += 1
+                if previous is not None: self._release(previous)
+            else:
+                rings, retention = (self._alert_rings, self.alert_retention_per_student) if kind == "alert" else (self._rings, self.retention_per_student)
+                ring = rings.setdefault(student_id, collections.deque())
+                if ring and ring[-1] == image_id: return image_id # Unchanged snapshot
+                ring.append(image_id); self._refs[image_id] += 1
+                while len(ring) > retention: self._release(ring.popleft())
+            if image_id not in self._files:
+                try: self._write_file(image_id, jpeg_bytes)
+                except Exception as e: log.error(f"[Snapshots]: Failed to write {image_id}: {e}")
+            self._files[image_id] = None; self._files.move_to_end(image_id)
+            self._enforce_global_cap()
+        return image_id
+
+    def has(self, image_id):
+        with self._lock:
+            if image_id in self._files: return True
+        return os.path.exists(self.path_for(image_id)) # Written by another server process sharing the directory
+
+    def remove_student(self, student_id):
+        """
+        Forgets a disconnected student's rings and pins. Their files stay
+        (alerts may still point at them) until the global cap ages them out.
+        """
+        with self._lock:
+            self._rings.pop(student_id, None)
+            self._alert_rings.pop(student_id, None)
+            self._wallpapers.pop(student_id, None)
+
+
+snapshot_store = SnapshotStore()
@@ -0,0 +1,156 @@
+# backend/state_store.py
+"""
+Pluggable store for session state that several server processes must share.
+
+Per-frame analysis state (FaceMesh/YOLO timers, change gating) stays local to
+the process that owns the student's socket. Sticky sessions route a student
+to one process, and that state changes on every frame. What is shared is
+whatever another process needs to serve admins:
+- each student's admin-facing record, plus which node owns it (namespace "students")
+- admin commands for students owned by another node (namespace "commands")
+
+Backends:
+- MemoryStateStore (default): plain dicts, single process, same behaviour as before.
+- SQLiteStateStore: one database file shared by every process on a node (WAL mode).
+
+Values are JSON-serialisable dicts. Every record carries `updated_at`, so
+readers can ignore entries left behind by a process that died.
+
+    LOCKIN_STATE_STORE=memory | sqlite:////var/run/lockin/state.db
+"""
+import os
+import json
+import time
+import sqlite3
+from native_threading import threading # SQLite calls run in tpool threads
+from async_logging import get_logger
+
+log = get_logger("state")
+
+# --- Configuration ---
+STATE_STORE_URL = os.environ.get("LOCKIN_STATE_STORE", "memory")
+# Records not refreshed for this long are treated as stale (their process is gone)
+STALE_AFTER_SECONDS = float(os.environ.get("LOCKIN_STATE_STALE_SECONDS", "30"))
+
+
+class MemoryStateStore:
+    """ In-process store. `shared` is False: nothing outside this process can see it. """
+    shared = False
+
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, namespace, key):
+        with self._lock:
+            value = self._data.get(namespace, {}).get(key)
+            return dict(value) if value is not None else None
+
+    def set_many(self, namespace, items):
+        now = time.time()
+        with self._lock:
+            bucket = self._data.setdefault(namespace, {})
+            for key, value in items.items(): bucket[key] = dict(value, updated_at=now)
+
+    def set(self, namespace, key, value):
+        self.set_many(namespace, {key: value})
+
+    def delete(self, namespace, key):
+        with self._lock: self._data.get(namespace, {}).pop(key, None)
+
+    def pop(self, namespace, key):
+        with self._lock: return self._data.get(namespace, {}).pop(key, None)
+
+    def items(self, namespace, max_age=None):
+        cutoff = time.time() - max_age if max_age else None
+        with self._lock:
+            return {key: dict(value) for key, value in self._data.get(namespace, {}).items() if cutoff is None or value["updated_at"] >= cutoff}
+
+    def touch_many(self, namespace, keys):
+        now = time.time()
+        with self._lock:
+            bucket = self._data.get(namespace, {})
+            for key in keys:
+                if key in bucket: bucket[key]["updated_at"] = now
+
+
+class SQLiteStateStore:
+    """
+    Store backed by one SQLite file, shared by all server processes on a node.
+    Each thread gets its own connection; WAL mode lets readers run alongside the writer.
+    """
+    shared = True
+
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._local = threading.local()
+        with self._connect() as connection:
+            connection.execute("CREATE TABLE IF NOT EXISTS state (namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, updated_at REAL NOT NULL, PRIMARY KEY (namespace, key))")
+        log.info(f"[State]: Using shared SQLite state store at {path}")
+
+    def _connect(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5.0, isolation_level=None) # Autocommit; explicit transactions below
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL") # Session state is rebuilt on reconnect; no fsync per write
+            self._local.connection = connection
+        return connection
+
+    def get(self, namespace, key):
+        row = self._connect().execute("SELECT value, updated_at FROM state WHERE namespace = ? AND key = ?", (namespace, key)).fetchone()
+        return dict(json.loads(row[0]), updated_at=row[1]) if row else None
+
+    def set_many(self, namespace, items):
+        if not items: return
+        now = time.time()
+        connection = self._connect()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            connection.executemany("INSERT OR REPLACE INTO state (namespace, key, value, updated_at) VALUES (?, ?, ?, ?)",
+                                   [(namespace, key, json.dumps(value, default=str), now) for key, value in items.items()])
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK"); raise
+
+    def set(self, namespace, key, value):
+        self.set_many(namespace, {key: value})
+
+    def delete(self, namespace, key):
+        self._connect().execute("DELETE FROM state WHERE namespace = ? AND key = ?", (namespace, key))
+
+    def pop(self, namespace, key):
+        connection = self._connect()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            row = connection.execute("SELECT value, updated_at FROM state WHERE namespace = ? AND key = ?", (namespace, key)).fetchone()
+            if row: connection.execute("DELETE FROM state WHERE namespace = ? AND key = ?", (namespace, key))
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK"); raise
+        return dict(json.loads(row[0]), updated_at=row[1]) if row else None
+
+    def items(self, namespace, max_age=None):
+        if max_age: rows = self._connect().execute("SELECT key, value, updated_at FROM state WHERE namespace = ? AND updated_at >= ?", (namespace, time.time() - max_age))
+        else: rows = self._connect().execute("SELECT key, value, updated_at FROM state WHERE namespace = ?", (namespace,))
+        return {key: dict(json.loads(value), updated_at=updated_at) for key, value, updated_at in rows.fetchall()}
+
+    def touch_many(self, namespace, keys):
+        keys = list(keys)
+        if not keys: return
+        now = time.time()
+        self._connect().executemany("UPDATE state SET updated_at = ? WHERE namespace = ? AND key = ?", [(now, namespace, key) for key in keys])
+
+
+def create_state_store(url=STATE_STORE_URL):
+    """ 'memory' or 'sqlite:///path/to/state.db' (relative paths are resolved from backend/). """
+    if url in ("", "memory"): return MemoryStateStore()
+    if url.startswith("sqlite://"):
+        path = url[len("sqlite://"):]
+        if path.startswith("/") and not path.startswith("//"): path = path[1:] # sqlite:///relative.db
+        elif path.startswith("//"): path = path[1:] # sqlite:////absolute/path.db
+        if not os.path.isabs(path): path = os.path.join(os.path.dirname(os.path.abspath(__file__)), path)
+        return SQLiteStateStore(path)
+    raise ValueError(f"Unsupported LOCKIN_STATE_STORE '{url}' (expected 'memory' or 'sqlite:///path')")
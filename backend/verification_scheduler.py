@@ -0,0 +1,122 @@
+# backend/verification_scheduler.py
+"""
+Bounded scheduler for face-verification jobs.
+
+A fixed number of native worker threads run verifications. Each student has at
+most one pending job: a newer submission replaces the frame of the waiting job
+(the newest frame wins) and can raise its priority, but never queues a second
+run. Lower priority numbers run first.
+
+Other per-student face work (computing a reference embedding) can run on the
+same workers by passing `fn`. It never displaces a more urgent pending job.
+"""
+import heapq
+import itertools
+import os
+from native_threading import threading
+from async_logging import get_logger
+
+log = get_logger("verification")
+
+# --- Configuration ---
+VERIFICATION_WORKERS = int(os.environ.get("LOCKIN_VERIFICATION_WORKERS", "2"))
+
+# --- Priorities (lower runs first) ---
+PRIORITY_IMPERSONATION_RECHECK = 0 # Student was last seen failing verification
+PRIORITY_WELCOME_BACK = 1          # Routine check after returning to the camera
+PRIORITY_REFERENCE_EMBEDDING = 2   # Embedding a new wallpaper ahead of the first verification
+
+
+class VerificationScheduler:
+    """ Priority queue of per-student verification jobs served by `workers` native threads. """
+
+    def __init__(self, verify_fn, workers=VERIFICATION_WORKERS):
+        self.verify_fn = verify_fn
+        self.workers = max(1, workers)
+        self._cond = threading.Condition()
+        self._heap = []                   # (priority, seq, student_id); stale entries skipped on pop
+        self._pending = {}                # student_id -> {"fn", "args", "priority", "seq"}
+        self._running = set()
+        self._seq = itertools.count()
+        self._threads = []
+        self.submitted = 0
+        self.deduplicated = 0
+        self.completed = 0
+        self.failed = 0
+        self.cancelled = 0
+        self.max_queue_depth = 0
+
+    def _ensure_started(self):
+        if self._threads: return
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"verification-{i}", daemon=True)
+            thread.start(); self._threads.append(thread)
+        log.info(f"[Verification]: Scheduler started with {self.workers} workers.")
+
+    def submit(self, student_id, args, priority=PRIORITY_WELCOME_BACK, fn=None):
+        """
+        Schedules `fn(*args)` (default `verify_fn`) for a student.
+        Returns True if a new job was queued, False if it was merged into the pending one.
+        """
+        fn = fn or self.verify_fn
+        with self._cond:
+            self._ensure_started()
+            self.submitted += 1
+            job = self._pending.get(student_id)
+            if job is not None:
+                self.deduplicated += 1
+                if fn is not job["fn"] and priority > job["priority"]: return False # Less urgent work never replaces a pending job
+                job["fn"], job["args"] = fn, args # Newest frame wins
+                if priority < job["priority"]:
+                    job["priority"] = priority; job["seq"] = next(self._seq)
+                    heapq.heappush(self._heap, (priority, job["seq"], student_id))
+                    self._cond.notify()
+                return False
+            job = {"fn": fn, "args": args, "priority": priority, "seq": next(self._seq)}
+            self._pending[student_id] = job
+            heapq.heappush(self._heap, (priority, job["seq"], student_id))
+            self.max_queue_depth = max(self.max_queue_depth, len(self._pending))
+            self._cond.notify()
+            return True
+
+    def cancel(self, student_id):
+        """ Drops a student's pending job (a running job is left to finish). """
+        with self._cond:
+            if self._pending.pop(student_id, None) is not None: self.cancelled += 1
+
+    def stats(self):
+        with self._cond:
+            by_priority = {}
+            for job in self._pending.values(): by_priority[job["priority"]] = by_priority.get(job["priority"], 0) + 1
+            return {
+                "queue_depth": len(self._pending), "queue_depth_by_priority": by_priority,
+                "running": len(self._running), "workers": self.workers,
+                "max_queue_depth": self.max_queue_depth, "submitted": self.submitted,
+                "deduplicated": self.deduplicated, "completed": self.completed,
+                "failed": self.failed, "cancelled": self.cancelled,
+            }
+
+    def _next_job(self):
+        """ Blocks until a live job is available; returns (student_id, fn, args). """
+        with self._cond:
+            while True:
+                while self._heap:
+                    priority, seq, student_id = heapq.heappop(self._heap)
+                    job = self._pending.get(student_id)
+                    if job is None or job["seq"] != seq: continue # Cancelled or re-prioritised
+                    del self._pending[student_id]
+                    self._running.add(student_id)
+                    return student_id, job["fn"], job["args"]
+                self._cond.wait()
+
+    def _worker(self):
+        while True:
+            student_id, fn, args = self._next_job()
+            try:
+                fn(*args)
+                with self._cond: self.completed += 1
+            except Exception as e:
+                with self._cond: self.failed += 1
+                log.error(f"[Verification]: Job for {student_id} failed: {e}")
+            finally:
+                with self._cond: self._running.discard(student_id)
@@ -0,0 +1,105 @@
+# backend/voice_activity.py
+"""
+Voice-activity detection between audio decoding and speech recognition.
+
+The chunk is cut into short frames and each frame is classified as speech or
+not. By default this uses framewise RMS energy and zero-crossing rate, computed
+with vectorized NumPy over the whole chunk. If the optional `webrtcvad` package
+is installed, it is used instead. Runs of speech frames that are too short
+are dropped; the rest are padded with a short hangover, so word edges survive,
+and merged into segments. Only the speech samples are passed on to the recognizer.
+"""
+import os
+import numpy as np
+
+try:
+    import webrtcvad # Optional: `vad` extra in requirements.txt
+except ImportError:
+    webrtcvad = None
+
+# --- Configuration ---
+# "auto" (webrtcvad if installed, else energy/ZCR), "webrtc", "energy" or "off"
+VAD_MODE = os.environ.get("LOCKIN_VAD", "auto").lower()
+VAD_FRAME_MS = 30 # webrtcvad accepts 10, 20 or 30 ms frames
+# webrtcvad aggressiveness, 0 (least) to 3 (most aggressive at filtering non-speech)
+WEBRTC_AGGRESSIVENESS = int(os.environ.get("LOCKIN_VAD_AGGRESSIVENESS", "2"))
+# Absolute RMS floor for a speech frame (float samples in [-1, 1])
+ENERGY_THRESHOLD = float(os.environ.get("LOCKIN_VAD_ENERGY_THRESHOLD", "0.008"))
+# A speech frame must also be this many times louder than the chunk's noise floor
+NOISE_FLOOR_RATIO = 3.0
+# Frames whose signs flip more often than this are treated as hiss/noise, not voiced speech
+ZCR_MAX = 0.35
+SPEECH_PADDING_MS = 200 # Hangover kept on each side of detected speech
+MIN_SPEECH_MS = int(os.environ.get("LOCKIN_VAD_MIN_SPEECH_MS", "250")) # Shorter segments are dropped
+WEBRTC_SAMPLE_RATES = (8000, 16000, 32000, 48000)
+
+_webrtc_vad = None
+
+
+def _frame_signal(audio_data, frame_length):
+    """ Returns a (n_frames, frame_length) view of the signal; the tail shorter than a frame is ignored. """
+    n_frames = len(audio_data) // frame_length
+    return audio_data[:n_frames * frame_length].reshape(n_frames, frame_length)
+
+def _energy_zcr_speech_mask(frames):
+    frames = frames.astype(np.float32, copy=False)
+    rms = np.sqrt(np.mean(frames * frames, axis=1))
+    signs = np.signbit(frames)
+    zcr = np.count_nonzero(signs[:, 1:] != signs[:, :-1], axis=1) / float(frames.shape[1] - 1)
+    noise_floor = np.percentile(rms, 10)
+    threshold = max(ENERGY_THRESHOLD, noise_floor * NOISE_FLOOR_RATIO)
+    return (rms >= threshold) & (zcr <= ZCR_MAX)
+
+def _webrtc_speech_mask(frames, samplerate):
+    global _webrtc_vad
+    if _webrtc_vad is None: _webrtc_vad = webrtcvad.Vad(WEBRTC_AGGRESSIVENESS)
+    pcm16 = (np.clip(frames, -1.0, 1.0) * 32767).astype('<i2')
+    return np.fromiter((_webrtc_vad.is_speech(frame.tobytes(), samplerate) for frame in pcm16), dtype=bool, count=len(pcm16))
+
+def _use_webrtc(samplerate):
+    if webrtcvad is None or samplerate not in WEBRTC_SAMPLE_RATES: return False
+    return VAD_MODE in ("auto", "webrtc")
+
+def speech_mask(audio_data, samplerate):
+    """ Returns (mask, frame_length): one bool per VAD frame, True where speech was detected. """
+    frame_length = int(samplerate * VAD_FRAME_MS / 1000)
+    frames = _frame_signal(audio_data, frame_length)
+    if len(frames) == 0: return np.zeros(0, dtype=bool), frame_length
+    if _use_webrtc(samplerate): mask = _webrtc_speech_mask(frames, samplerate)
+    else: mask = _energy_zcr_speech_mask(frames)
+    return mask, frame_length
+
+def _runs(mask):
+    """ (starts, ends) frame indices of the True runs in the mask. """
+    # Run boundaries: +1 where speech starts, -1 where it ends
+    edges = np.diff(np.concatenate(([0], mask.astype(np.int8), [0])))
+    return np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+
+def speech_segments(audio_data, samplerate):
+    """ Returns [(start_sample, end_sample), ...] for each speech segment in the chunk. """
+    mask, frame_length = speech_mask(audio_data, samplerate)
+    if not mask.any(): return []
+    # Length filter on the detected speech itself, before the hangover could stretch a click past it
+    min_frames = max(1, MIN_SPEECH_MS // VAD_FRAME_MS)
+    pad_frames = SPEECH_PADDING_MS // VAD_FRAME_MS
+    kept = np.zeros_like(mask)
+    for start, end in zip(*_runs(mask)):
+        if end - start >= min_frames: kept[max(0, start - pad_frames):end + pad_frames] = True # Hangover on both sides
+    if not kept.any(): return []
+    starts, ends = _runs(kept) # Padded runs that now touch are merged
+    return [(int(s) * frame_length, int(e) * frame_length) for s, e in zip(starts, ends)]
+
+def extract_speech(audio_data, samplerate):
+    """
+    Returns only the speech samples of the chunk (segments concatenated), or
+    None when it holds no speech and should not be transcribed.
+    With LOCKIN_VAD=off the whole chunk is returned unchanged.
+    """
+    if audio_data is None or len(audio_data) == 0: return None
+    if VAD_MODE == "off": return audio_data
+    segments = speech_segments(audio_data, samplerate)
+    if not segments: return None
+    if len(segments) == 1:
+        start, end = segments[0]
+        return audio_data[start:end]
+    return np.concatenate([audio_data[start:end] for start, end in segments])
@@ -10,17 +10,21 @@ import {
 // --- Central Backend Server URL ---
 const SOCKET_SERVER_URL = 'http://localhost:8000'; // Make sure this matches your server
 
+// Student images (snapshots, wallpapers) are content-addressed and served by ID, so the
+// browser fetches each one once, and only when it is displayed
+const imageUrlForId = (imageId) => (imageId ? `${SOCKET_SERVER_URL}/images/${imageId}` : null);
+
 // --- Modal Component (Updated for Impersonation Alert) ---
 const StudentDetailModal = ({ student, onClose, onKickStudent, styles, latestAlert }) => {
-    // student = { id, score, status, snapshot, sid, wallpaperB64 } // Updated expected props
-    // latestAlert = the alert object { ..., snapshot, audioFilename }
+    // student = { id, score, status, warnings, snapshotId, wallpaperId } // Images are referenced by ID
+    // latestAlert = the alert object { ..., snapshotId, audioFilename }
     const isImpersonation = student.status && student.status.includes('IMPERSONATION');
     // Consider other potential critical states if needed
     const isOtherCritical = !isImpersonation && student.status && (student.status.includes('CRITICAL') || student.status.includes('Multiple Faces') || student.status === 'Away'); // Include Away?
     const isCritical = isImpersonation || isOtherCritical; // General critical flag
 
     const audioFilename = latestAlert?.audioFilename;
-    const alertSnapshot = latestAlert?.snapshot; // Snapshot associated with the alert trigger
+    const alertSnapshotId = latestAlert?.snapshotId; // Snapshot associated with the alert trigger
 
     const handleConfirmKick = () => { onKickStudent(student.id); };
 
@@ -62,8 +66,8 @@ const StudentDetailModal = ({ student, onClose, onKickStudent, styles, latestAle
                         <div style={styles.modalSection}>
                             <h4 style={styles.modalPhotoLabel}>Baseline Photo (Start of Exam)</h4>
                             <ImageWithErrorFallback
-                                // Use wallpaperB64 for the baseline photo
-                                src={student.wallpaperB64 ? `data:image/jpeg;base64,${student.wallpaperB64}` : null}
+                                // Use the wallpaper (first frame) for the baseline photo
+                                src={imageUrlForId(student.wallpaperId)}
                                 alt="Reference Snapshot"
                                 style={styles.modalPhoto}
                                 fallbackText="Reference image unavailable"
@@ -74,7 +78,7 @@ const StudentDetailModal = ({ student, onClose, onKickStudent, styles, latestAle
                         <div style={styles.modalSection}>
                             <h4 style={styles.modalPhotoLabel}>New Snapshot (From Alert)</h4>
                              <ImageWithErrorFallback
-                                src={alertSnapshot ? `data:image/jpeg;base64,${alertSnapshot}` : null}
+                                src={imageUrlForId(alertSnapshotId)}
                                 alt="Alert Snapshot"
                                 style={styles.modalPhoto}
                                 fallbackText="Alert snapshot unavailable"
@@ -117,7 +121,7 @@ const StudentDetailModal = ({ student, onClose, onKickStudent, styles, latestAle
                        <div style={styles.modalSection}>
                          <h4 style={styles.modalPhotoLabel}>Snapshot (From Alert Time)</h4>
                           <ImageWithErrorFallback
-                             src={(alertSnapshot || student.snapshot) ? `data:image/jpeg;base64,${alertSnapshot || student.snapshot}` : null}
+                             src={imageUrlForId(alertSnapshotId || student.snapshotId)}
                              alt="Alert Snapshot"
                              style={styles.modalPhoto}
                              fallbackText="Snapshot unavailable"
@@ -148,7 +152,7 @@ const StudentDetailModal = ({ student, onClose, onKickStudent, styles, latestAle
                          <h3 style={styles.modalSectionTitle}>Latest Snapshot</h3>
                          {/* Show latest snapshot available (could be from alert or general state) */}
                           <ImageWithErrorFallback
-                             src={(alertSnapshot || student.snapshot) ? `data:image/jpeg;base64,${alertSnapshot || student.snapshot}` : null}
+                             src={imageUrlForId(alertSnapshotId || student.snapshotId)}
                              alt={student.id}
                              style={{...styles.feedItem, height: 'auto', width: '100%'}}
                              fallbackText="Waiting for snapshot..."
@@ -232,28 +236,18 @@ const AdminDashboard = () => {
       }
     });
 
-    socketRef.current.on('student_update', (data) => {
-       // 'data' IS the student object, e.g., { id: 'student1', score: 95, ... }
-       
-       // 1. Check if the data payload has an 'id' field
-       if (!data || !data.id) return; 
-
-       const studentId = data.id; // 2. The key is data.id
-
+    // Coalesced updates: a list of { id, ...changedFields } sent once per server tick
+    socketRef.current.on('student_updates', (updates) => {
+       if (!Array.isArray(updates) || updates.length === 0) return;
        setStudents(prevStudents => {
-            // 3. Check if that student exists in our *current* state
-            if (prevStudents[studentId]) {
-                // 4. Return the new state object
-                return {
-                    ...prevStudents,
-                    // 5. Merge the new 'data' object with the existing student data
-                    [studentId]: { ...prevStudents[studentId], ...data }
-                };
-            } else {
-                // This student isn't in our list yet, ignore the update
-                // (The 'new_student' event will handle adding them)
-                return prevStudents; 
-            }
+            let nextStudents = prevStudents;
+            updates.forEach(data => {
+                // Ignore updates for students not in our list yet ('new_student' adds them)
+                if (!data || !data.id || !prevStudents[data.id]) return;
+                if (nextStudents === prevStudents) nextStudents = { ...prevStudents };
+                nextStudents[data.id] = { ...nextStudents[data.id], ...data };
+            });
+            return nextStudents;
        });
     });
 
@@ -267,7 +261,7 @@ const AdminDashboard = () => {
              else if (alert.color === '#ffc107') Icon = FiAlertCircle;
              else if (alert.color === '#17a2b8') Icon = FiInfo;
 
-             const alertData = { ...alert, Icon: Icon, audioFilename: alert.audio_filename || null };
+             const alertData = { ...alert, Icon: Icon, audioFilename: alert.audio_filename || null, snapshotId: alert.snapshot_id || null };
              setAlerts(prev => [alertData, ...prev].slice(0, 15));
 
              // Auto-open modal for CRITICAL alerts
@@ -278,8 +272,7 @@ const AdminDashboard = () => {
                  }
              }
              // Update student snapshot state if alert includes one (used by normal modal)
-            // Update student snapshot state if alert includes one (used by normal modal)
-             if(alertData.snapshot && alertData.text) {
+             if(alertData.snapshotId && alertData.text) {
                  const studentIdMatch = alertData.text.match(/^([^:]+):/);
                  if (studentIdMatch && studentIdMatch[1]) {
                      const studentId = studentIdMatch[1];
@@ -289,7 +282,7 @@ const AdminDashboard = () => {
                           // Move the check INSIDE
                           if (prevStudents[studentId]) {
                               // Return the new state
-                              return { ...prevStudents, [studentId]: { ...prevStudents[studentId], snapshot: alertData.snapshot } };
+                              return { ...prevStudents, [studentId]: { ...prevStudents[studentId], snapshotId: alertData.snapshotId } };
                           }
                           // Return state unchanged if student not found
                           return prevStudents;
@@ -298,6 +291,11 @@ const AdminDashboard = () => {
              }
         }
     });
+    // Audio link of an alert, sent once its recording is on disk
+    socketRef.current.on('alert_audio', (data) => {
+        if (!data || !data.id || !data.audio_filename) return;
+        setAlerts(prev => prev.map(a => a.id === data.id ? { ...a, audio_filename: data.audio_filename, audioFilename: data.audio_filename, Icon: FiVolume2 } : a));
+    });
     socketRef.current.on('error', (data) => { console.error("Server error:", data.message); alert(`Server Error: ${data.message || 'Unknown'}`); });
 
     return () => { console.log("Disconnecting..."); socketRef.current?.disconnect(); socketRef.current = null; };
@@ -372,9 +370,8 @@ const AdminDashboard = () => {
                     {studentArray.map((student) => {
                       const score = student.score ?? 100;
                       const status = student.status ?? "Connecting...";
-                      // --- USE wallpaperB64 ---
-                      const wallpaperImage = student.wallpaperB64;
-                      // --- END USE ---
+                      // --- Wallpaper is fetched by ID (cached by the browser) ---
+                      const wallpaperImage = imageUrlForId(student.wallpaperId);
                       const borderColor = getBorderColor(score, status);
                       const isCritical = status.includes('CRITICAL') || status.includes('Multiple Faces');
                       return (
@@ -382,7 +379,7 @@ const AdminDashboard = () => {
                           style={{
                             ...styles.feedItem,
                             // --- USE wallpaperImage variable ---
-                            backgroundImage: wallpaperImage ? `url(data:image/jpeg;base64,${wallpaperImage})` : 'none',
+                            backgroundImage: wallpaperImage ? `url(${wallpaperImage})` : 'none',
                              // --- END USE ---
                             backgroundColor: wallpaperImage ? '#e0e0e0' : '#eee', // Light gray background
                             backgroundSize: 'cover',
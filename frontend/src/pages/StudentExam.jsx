@@ -4,12 +4,19 @@ import io from 'socket.io-client';
 
 // --- Central Backend Server URL ---
 const SOCKET_SERVER_URL = 'http://localhost:8000';
+// Send video frames as raw JPEG bytes (Socket.IO binary attachment) instead of Base64 strings
+const BINARY_FRAME_TRANSPORT = true;
+// Default frame interval; the server adjusts it per student via 'capture_rate' events
+const DEFAULT_CAPTURE_INTERVAL_MS = 2000;
+const MIN_CAPTURE_INTERVAL_MS = 250;
+const MAX_CAPTURE_INTERVAL_MS = 10000;
 
 // --- Webcam Component ---
 const StudentVideoFeed = ({ studentId, socket }) => {
   const videoRef = useRef(null);
   const canvasRef = useRef(null); // Changed: Initialize directly
   const videoIntervalRef = useRef(null);
+  const captureIntervalMsRef = useRef(DEFAULT_CAPTURE_INTERVAL_MS);
   const audioRecorderRef = useRef(null);
   const audioChunksRef = useRef([]);
   const streamRef = useRef(null);
@@ -46,6 +53,30 @@ const StudentVideoFeed = ({ studentId, socket }) => {
     return null;
   };
 
+  // Helper to take a snapshot as raw JPEG bytes (Promise<ArrayBuffer|null>)
+  const takeSnapshotJpeg = () => {
+    if (!canvasRef.current || !videoRef.current || videoRef.current.readyState < 3 || videoRef.current.paused) {
+      return Promise.resolve(null);
+    }
+    try {
+      const context = canvasRef.current.getContext('2d');
+      if (videoRef.current.videoWidth > 0 && videoRef.current.videoHeight > 0) {
+          canvasRef.current.width = videoRef.current.videoWidth;
+          canvasRef.current.height = videoRef.current.videoHeight;
+      }
+      context.drawImage(videoRef.current, 0, 0, canvasRef.current.width, canvasRef.current.height);
+      return new Promise((resolve) => {
+        canvasRef.current.toBlob((blob) => {
+          if (!blob) { resolve(null); return; }
+          blob.arrayBuffer().then(resolve, () => resolve(null));
+        }, 'image/jpeg', 0.6); // Same quality as the Base64 path
+      });
+    } catch (e) {
+      console.error("Error taking binary snapshot:", e);
+      return Promise.resolve(null);
+    }
+  };
+
   useEffect(() => {
     if (!socket || !studentId) {
         console.log("DEBUG [Student]: Socket or studentId missing, delaying stream start.");
@@ -58,6 +89,43 @@ const StudentVideoFeed = ({ studentId, socket }) => {
 
     let localStream = null; // Variable to hold the stream for cleanup
 
+    const sendFrame = () => {
+      if (!socket || !socket.connected) {
+         console.warn("DEBUG [Student]: Video frame skipped, socket not connected.");
+         return;
+      }
+      if (BINARY_FRAME_TRANSPORT) {
+        takeSnapshotJpeg().then((frameJpeg) => {
+          // The server uses the frame itself as the snapshot, so it is sent only once
+          if (frameJpeg && socket.connected) socket.emit('video_frame', { frame: frameJpeg });
+        });
+        return;
+      }
+      const frameB64 = takeSnapshotB64();
+      if (frameB64) {
+        // console.log("DEBUG [Student]: Emitting video_frame..."); // Noisy
+        socket.emit('video_frame', { frame: frameB64 });
+      }
+    };
+
+    // (Re)starts the frame timer; used at start-up and whenever the server sends a new rate
+    const startFrameInterval = (intervalMs) => {
+      if (videoIntervalRef.current) clearInterval(videoIntervalRef.current);
+      videoIntervalRef.current = setInterval(sendFrame, intervalMs);
+    };
+
+    // --- Server-driven capture rate ---
+    const handleCaptureRate = (data) => {
+      const requested = Number(data?.interval_ms);
+      if (!Number.isFinite(requested)) return;
+      const intervalMs = Math.min(MAX_CAPTURE_INTERVAL_MS, Math.max(MIN_CAPTURE_INTERVAL_MS, requested));
+      if (intervalMs === captureIntervalMsRef.current) return;
+      console.log(`DEBUG [Student]: Server requested capture interval ${intervalMs} ms.`);
+      captureIntervalMsRef.current = intervalMs;
+      if (videoIntervalRef.current) startFrameInterval(intervalMs); // Only once streaming has started
+    };
+    socket.on('capture_rate', handleCaptureRate);
+
     const startStreaming = async () => {
       console.log("DEBUG [Student]: Attempting to get user media (video & audio)...");
       try {
@@ -84,23 +152,8 @@ const StudentVideoFeed = ({ studentId, socket }) => {
         }
 
         // --- Video Frame Streaming ---
-        console.log("DEBUG [Student]: Setting up video frame interval (2 seconds)...");
-        // Clear any previous interval first
-        if(videoIntervalRef.current) clearInterval(videoIntervalRef.current);
-        videoIntervalRef.current = setInterval(() => {
-          if (!socket || !socket.connected) {
-             console.warn("DEBUG [Student]: Video frame skipped, socket not connected.");
-             return;
-          }
-          const frameB64 = takeSnapshotB64();
-          if (frameB64) {
-            // console.log("DEBUG [Student]: Emitting video_frame..."); // Noisy
-            socket.emit('video_frame', {
-              frame: frameB64,
-              snapshot: frameB64 // Explicitly send snapshot
-            });
-          }
-        }, 2000); // Send frame every 2 seconds
+        console.log(`DEBUG [Student]: Setting up video frame interval (${captureIntervalMsRef.current} ms)...`);
+        startFrameInterval(captureIntervalMsRef.current);
 
         // --- Audio Chunk Streaming ---
         if (localStream.getAudioTracks().length > 0) {
@@ -213,6 +266,7 @@ const StudentVideoFeed = ({ studentId, socket }) => {
     // Clean up function
     return () => {
       console.log("DEBUG [Student]: Cleaning up StudentVideoFeed component...");
+      socket.off('capture_rate', handleCaptureRate);
       clearInterval(videoIntervalRef.current);
       videoIntervalRef.current = null;
 